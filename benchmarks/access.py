@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from itertools import product
+import random
+import time
+
+from bravo.chunk import Chunk
+from bravo.config import BravoConfigParser
+from bravo.geometry.section import si
+from bravo.utilities.coords import iterchunk
+from bravo.world import ChunkCache, World
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# A chunk of noise up to y=64, loaded into a world.
+r = random.Random(42)
+chunk = Chunk(0, 0)
+for x, z, y in product(xrange(16), xrange(16), xrange(64)):
+    chunk.set_block((x, y, z), r.choice((0, 1, 2, 3)))
+
+config = BravoConfigParser()
+config.add_section("world bench")
+config.set("world bench", "url", "")
+config.set("world bench", "serializer", "memory")
+
+world = World(config, "bench")
+world._cache = ChunkCache()
+world._cache.put(chunk)
+
+coords = list(iterchunk())[:16384]
+
+@timed
+def get_block():
+    for x, z, y in coords:
+        chunk.get_block((x, y, z))
+
+@timed
+def get_block_index():
+    for x, z, y in coords:
+        chunk.get_block_index(si(x, y, z))
+
+@timed
+def get_column():
+    for x, z in product(xrange(16), repeat=2):
+        chunk.get_column(x, z)
+
+@timed
+def sync_get_block():
+    for x, z, y in coords:
+        world.sync_get_block((x, y, z))
+
+@timed
+def regenerate_heightmap():
+    chunk.regenerate_heightmap()
+
+def get_block_bench():
+    l = [get_block() for i in xrange(25)]
+    return "access_get_block", l
+
+def get_block_index_bench():
+    l = [get_block_index() for i in xrange(25)]
+    return "access_get_block_index", l
+
+def get_column_bench():
+    l = [get_column() for i in xrange(25)]
+    return "access_get_column", l
+
+def sync_get_block_bench():
+    l = [sync_get_block() for i in xrange(25)]
+    return "access_sync_get_block", l
+
+def regenerate_heightmap_bench():
+    l = [regenerate_heightmap() for i in xrange(25)]
+    return "access_regenerate_heightmap", l
+
+benchmarks = [
+    get_block_bench,
+    get_block_index_bench,
+    get_column_bench,
+    sync_get_block_bench,
+    regenerate_heightmap_bench,
+]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from array import array
+from itertools import izip_longest
+import os
+import time
+
+from bravo.utilities.bits import pack_nibbles, unpack_nibbles
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# The old, element-at-a-time implementations, for comparison.
+
+def reference_unpack_nibbles(l):
+    data = array("B")
+    for d in l:
+        i = ord(d)
+        data.append(i & 0xf)
+        data.append(i >> 4)
+    return data
+
+def reference_pack_nibbles(a):
+    args = [iter(a)] * 2
+    packed = array("B",
+        (((y & 0xf) << 4) | (x & 0xf) for x, y in izip_longest(*args)))
+    return packed.tostring()
+
+# A full chunk has metadata and skylight for sixteen sections, plus its
+# blocklight.
+packed = [os.urandom(2048) for i in range(33)]
+unpacked = [unpack_nibbles(data) for data in packed]
+
+@timed
+def chunk_unpack(f):
+    for data in packed:
+        f(data)
+
+@timed
+def chunk_pack(f):
+    for nibbles in unpacked:
+        f(nibbles)
+
+def unpack_reference_bench():
+    l = [chunk_unpack(reference_unpack_nibbles) for i in xrange(25)]
+    return "nibbles_chunk_unpack_reference", l
+
+def unpack_bench():
+    l = [chunk_unpack(unpack_nibbles) for i in xrange(25)]
+    return "nibbles_chunk_unpack", l
+
+def pack_reference_bench():
+    l = [chunk_pack(reference_pack_nibbles) for i in xrange(25)]
+    return "nibbles_chunk_pack_reference", l
+
+def pack_bench():
+    l = [chunk_pack(pack_nibbles) for i in xrange(25)]
+    return "nibbles_chunk_pack", l
+
+benchmarks = [unpack_reference_bench, unpack_bench, pack_reference_bench,
+              pack_bench]
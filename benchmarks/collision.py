@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+from itertools import product
+import time
+
+from bravo.chunk import Chunk
+from bravo.config import BravoConfigParser
+from bravo.world import ChunkCache, World
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# A world of four chunks, with the sky empty and stone up to y=63, and a
+# thousand mob-sized boxes standing on the ground, straddling the chunks.
+config = BravoConfigParser()
+config.add_section("world bench")
+config.set("world bench", "url", "")
+config.set("world bench", "serializer", "memory")
+
+world = World(config, "bench")
+world._cache = ChunkCache()
+for x, z in product(xrange(-1, 1), repeat=2):
+    chunk = Chunk(x, z)
+    for y in xrange(64):
+        for i, j in product(xrange(16), repeat=2):
+            chunk.set_block((i, y, j), 1)
+    world._cache.put(chunk)
+
+boxes = [((x % 24 - 12, 64, x // 24 % 24 - 12),
+          (x % 24 - 10, 66, x // 24 % 24 - 10)) for x in xrange(1000)]
+
+@timed
+def any_solid_voxels():
+    for lower, upper in boxes:
+        any(world.sync_get_block(coords)
+            for coords in product(*[xrange(l, u)
+                                    for l, u in zip(lower, upper)]))
+
+@timed
+def any_solid_bulk():
+    for lower, upper in boxes:
+        world.sync_any_solid(lower, upper)
+
+def voxels_bench():
+    l = [any_solid_voxels() for i in xrange(25)]
+    return "collision_voxels", l
+
+def bulk_bench():
+    l = [any_solid_bulk() for i in xrange(25)]
+    return "collision_bulk", l
+
+benchmarks = [
+    voxels_bench,
+    bulk_bench,
+]
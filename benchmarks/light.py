@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+from array import array
+from itertools import product
+import random
+import time
+
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# Three by three chunks of flat stone, with a hundred torches to stick on the
+# ground, all over the middle chunk.
+r = random.Random(42)
+torches = [(r.randint(0, 15), 64, r.randint(0, 15)) for i in xrange(100)]
+
+def make_chunks():
+    chunks = {}
+    for x, z in product(xrange(-1, 2), repeat=2):
+        chunk = Chunk(x, z)
+        for index in range(4):
+            section = chunk.unshare(index)
+            section.blocks = array("B", [1] * 4096)
+            section.recount()
+        chunk.neighbors = chunks.get
+        chunks[x, z] = chunk
+    for chunk in chunks.itervalues():
+        chunk.regenerate()
+        chunk.populated = True
+    return chunks
+
+@timed
+def place_torches(chunk):
+    for coords in torches:
+        chunk.set_block(coords, blocks["torch"].slot)
+
+@timed
+def remove_torches(chunk):
+    for coords in torches:
+        chunk.set_block(coords, blocks["air"].slot)
+
+# Bumpy terrain, with a hundred blocks to dig out of it.
+def make_terrain():
+    chunk = Chunk(0, 0)
+    for x, z in product(xrange(16), repeat=2):
+        for y in xrange(60 + (x * z) % 7):
+            chunk.set_block((x, y, z), 1)
+    chunk.regenerate_heightmap()
+    return chunk
+
+digs = [(r.randint(0, 15), r.randint(50, 60), r.randint(0, 15))
+        for i in xrange(100)]
+
+@timed
+def regenerate_skylight(chunk):
+    chunk.regenerate_skylight()
+
+@timed
+def dig(chunk):
+    for coords in digs:
+        chunk.set_block(coords, blocks["air"].slot)
+
+def place_bench():
+    l = []
+    for i in xrange(25):
+        chunks = make_chunks()
+        l.append(place_torches(chunks[0, 0]))
+    return "light_place_torches", l
+
+def remove_bench():
+    l = []
+    for i in xrange(25):
+        chunks = make_chunks()
+        place_torches(chunks[0, 0])
+        l.append(remove_torches(chunks[0, 0]))
+    return "light_remove_torches", l
+
+def skylight_bench():
+    l = []
+    for i in xrange(25):
+        chunk = make_terrain()
+        l.append(regenerate_skylight(chunk))
+    return "light_regenerate_skylight", l
+
+def dig_bench():
+    l = []
+    for i in xrange(25):
+        chunk = make_terrain()
+        chunk.regenerate()
+        chunk.populated = True
+        l.append(dig(chunk))
+    return "light_dig", l
+
+benchmarks = [
+    place_bench,
+    remove_bench,
+    skylight_bench,
+    dig_bench,
+]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+from StringIO import StringIO
+import time
+
+from bravo.chunk import Chunk
+from bravo.nbt import NBTFile, read_nbt
+from bravo.plugins.serializers.beta import Anvil
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+serializer = Anvil()
+
+def full_chunk():
+    """
+    Make a chunk with every section filled in, like a chunk from a real
+    world would be.
+    """
+
+    chunk = Chunk(0, 0)
+    for y in range(0, 256, 16):
+        chunk.set_block((0, y, 0), 1)
+    return chunk
+
+chunk = full_chunk()
+data = serializer._render_chunk(chunk)
+
+@timed
+def parse_tree(data):
+    NBTFile(buffer=StringIO(data))
+
+@timed
+def parse_lazy(data):
+    level = read_nbt(data)["Level"]
+    for section in level["Sections"]:
+        section["Y"], section["Blocks"], section["Data"], section["SkyLight"]
+    level["HeightMap"], level["BlockLight"], level["TerrainPopulated"]
+
+@timed
+def render_tree(chunk):
+    b = StringIO()
+    serializer._save_chunk_to_tag(chunk).write_file(buffer=b)
+
+@timed
+def render_direct(chunk):
+    serializer._render_chunk(chunk)
+
+def tree_bench():
+    l = [parse_tree(data) for i in xrange(25)]
+    return "nbt_chunk_tree", l
+
+def lazy_bench():
+    l = [parse_lazy(data) for i in xrange(25)]
+    return "nbt_chunk_lazy", l
+
+def render_tree_bench():
+    l = [render_tree(chunk) for i in xrange(25)]
+    return "nbt_chunk_render_tree", l
+
+def render_direct_bench():
+    l = [render_direct(chunk) for i in xrange(25)]
+    return "nbt_chunk_render_direct", l
+
+benchmarks = [tree_bench, lazy_bench, render_tree_bench, render_direct_bench]
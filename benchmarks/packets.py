@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import time
+
+from construct import Container
+
+from bravo.beta.packets import make_packet, packets, packets_by_name
+from bravo.beta.packets import packet_stream, parse_packets, PacketBuffer
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# A second's worth of movement from fifty players: a mix of the position,
+# orientation, location, and flying packets that clients send every tick.
+position = Container(x=1.5, y=64.0, stance=65.62, z=-3.5)
+orientation = Container(rotation=90.0, pitch=10.0)
+grounded = Container(grounded=True)
+
+movement = "".join([
+    make_packet("location", position=position, orientation=orientation,
+                grounded=grounded),
+    make_packet("position", position=position, grounded=grounded),
+    make_packet("orientation", orientation=orientation, grounded=grounded),
+    make_packet("grounded", grounded=True),
+]) * 250
+
+# A big plugin message, as it might trickle in over a slow connection.
+message = make_packet("plugin-message", channel=u"MC|Brand",
+                      data="x" * 8192)
+fragments = [message[i:i + 16] for i in xrange(0, len(message), 16)]
+
+@timed
+def parse_construct(data):
+    packet_stream.parse(data)
+
+@timed
+def parse_fixed(data):
+    parse_packets(data)
+
+@timed
+def build_construct(count):
+    header = packets_by_name["entity-location"]
+    for i in xrange(count):
+        chr(header) + packets[header].build(Container(eid=i, dx=1, dy=0,
+            dz=-1, yaw=12, pitch=0))
+
+@timed
+def build_fixed(count):
+    for i in xrange(count):
+        make_packet("entity-location", eid=i, dx=1, dy=0, dz=-1, yaw=12,
+                    pitch=0)
+
+@timed
+def fragments_reparse(fragments):
+    buf = ""
+    for fragment in fragments:
+        buf += fragment
+        parsed, buf = parse_packets(buf)
+
+@timed
+def fragments_buffer(fragments):
+    buf = PacketBuffer()
+    for fragment in fragments:
+        buf.feed(fragment)
+
+def parse_construct_bench():
+    l = [parse_construct(movement) for i in xrange(25)]
+    return "packets_parse_construct", l
+
+def parse_fixed_bench():
+    l = [parse_fixed(movement) for i in xrange(25)]
+    return "packets_parse_fixed", l
+
+def build_construct_bench():
+    l = [build_construct(1000) for i in xrange(25)]
+    return "packets_build_construct", l
+
+def build_fixed_bench():
+    l = [build_fixed(1000) for i in xrange(25)]
+    return "packets_build_fixed", l
+
+def fragments_reparse_bench():
+    l = [fragments_reparse(fragments) for i in xrange(25)]
+    return "packets_fragments_reparse", l
+
+def fragments_buffer_bench():
+    l = [fragments_buffer(fragments) for i in xrange(25)]
+    return "packets_fragments_buffer", l
+
+benchmarks = [
+    parse_construct_bench,
+    parse_fixed_bench,
+    build_construct_bench,
+    build_fixed_bench,
+    fragments_reparse_bench,
+    fragments_buffer_bench,
+]
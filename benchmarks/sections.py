@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import random
+import time
+
+from bravo.chunk import Chunk
+from bravo.geometry.section import PackedSection, si
+from bravo.ibravo import ITerrainGenerator
+from bravo.plugin import retrieve_plugins
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# Generated terrain, both as plain sections and packed.
+plugins = retrieve_plugins(ITerrainGenerator)
+pipeline = ["simplex", "erosion", "watertable", "beaches", "grass", "ore",
+            "safety", "caves"]
+
+def make_chunk(i):
+    chunk = Chunk(i, 0)
+    for name in pipeline:
+        plugins[name].populate(chunk, 0)
+    chunk.regenerate()
+    return chunk
+
+def packed_copy(chunk):
+    copy = Chunk(chunk.x, chunk.z)
+    copy.heightmap = chunk.heightmap
+    copy.blocklight = chunk.blocklight
+    copy.sections = list(chunk.sections)
+    copy.pack()
+    return copy
+
+# Generating terrain is slow, so the same few chunks are used over and over.
+flat = [make_chunk(i) for i in xrange(5)] * 5
+packed = [packed_copy(chunk) for chunk in flat]
+
+def kib(chunk):
+    """
+    Count the memory taken by a chunk's blocks and metadata, in KiB.
+    """
+
+    size = 0
+    for section in chunk.sections:
+        if section.shared:
+            continue
+        elif isinstance(section, PackedSection):
+            size += len(section.indices) + len(section.packed_metadata)
+        else:
+            size += len(section.blocks) + len(section.metadata)
+    return size / 1024.0
+
+# Memory isn't a timing, so it's reported here rather than as a benchmark.
+for layout, chunks in (("flat", flat), ("packed", packed)):
+    sizes = [kib(chunk) for chunk in chunks]
+    print "sections_%s_memory: Average %.1f KiB per chunk" % (
+        layout, sum(sizes) / len(sizes))
+
+r = random.Random(42)
+coords = [(r.randrange(16), r.randrange(64), r.randrange(16))
+          for i in xrange(16384)]
+indices = [si(x, y, z) for x, y, z in coords]
+
+@timed
+def get_block(chunk):
+    for xyz in coords:
+        chunk.get_block(xyz)
+
+@timed
+def get_block_index(chunk):
+    for i in indices:
+        chunk.get_block_index(i)
+
+@timed
+def packet(chunk):
+    chunk.packet_data()
+
+def get_block_bench(chunks):
+    return [get_block(chunk) for chunk in chunks]
+
+def get_block_index_bench(chunks):
+    return [get_block_index(chunk) for chunk in chunks]
+
+def packet_bench(chunks):
+    return [packet(chunk) for chunk in chunks]
+
+benchmarks = []
+for layout, chunks in (("flat", flat), ("packed", packed)):
+    for bench, name in (
+        (get_block_bench, "get_block"),
+        (get_block_index_bench, "get_block_index"),
+        (packet_bench, "packet"),
+    ):
+        def f(bench=bench, name=name, layout=layout, chunks=chunks):
+            return "sections_%s_%s" % (layout, name), bench(chunks)
+        benchmarks.append(f)
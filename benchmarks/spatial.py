@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import random
+import time
+from sys import maxint
+
+from bravo.entity import Chuck, Player
+from bravo.location import Location
+from bravo.utilities.spatial import EntityIndex
+
+def timed(f):
+    def wrapped(*args, **kwargs):
+        before = time.time()
+        f(*args, **kwargs)
+        return (time.time() - before) * 1000
+    return wrapped
+
+# Five hundred mobs and a hundred players, scattered over a world of about
+# forty by forty chunks.
+r = random.Random(42)
+
+def scattered():
+    return Location.at_block(r.randint(-320, 320), r.randint(60, 80),
+                             r.randint(-320, 320))
+
+mobs = [Chuck(location=scattered()) for i in xrange(500)]
+players = [Player(location=scattered()) for i in xrange(100)]
+
+index = EntityIndex()
+for player in players:
+    index.add(player)
+
+def closest_linear(position, threshold=maxint):
+    closest = None
+    for player in players:
+        distance = position.distance(player.location.pos)
+        if distance < threshold:
+            threshold = distance
+            closest = player
+    return closest
+
+# Every mob looks for the closest player within sixteen pixels, five times a
+# second.
+@timed
+def tick_linear():
+    for mob in mobs:
+        closest_linear(mob.location.pos, 16)
+
+@timed
+def tick_index():
+    for mob in mobs:
+        index.nearest(mob.location.pos, 1, 15)
+
+@timed
+def nearest_linear():
+    for mob in mobs:
+        closest_linear(mob.location.pos)
+
+@timed
+def nearest_index():
+    for mob in mobs:
+        index.nearest(mob.location.pos)
+
+def tick_linear_bench():
+    l = [tick_linear() for i in xrange(25)]
+    return "spatial_tick_linear", l
+
+def tick_index_bench():
+    l = [tick_index() for i in xrange(25)]
+    return "spatial_tick_index", l
+
+def nearest_linear_bench():
+    l = [nearest_linear() for i in xrange(25)]
+    return "spatial_nearest_linear", l
+
+def nearest_index_bench():
+    l = [nearest_index() for i in xrange(25)]
+    return "spatial_nearest_index", l
+
+benchmarks = [
+    tick_linear_bench,
+    tick_index_bench,
+    nearest_linear_bench,
+    nearest_index_bench,
+]
@@ -0,0 +1,153 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, succeed
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from bravo.beta.packets import make_chunk_packet
+from bravo.chunk import Chunk
+
+class ChunkCompressor(object):
+    """
+    Build chunk packets, compressing them off of the reactor.
+
+    Chunk data is gathered on the reactor, since chunks may change at any
+    time, but the expensive zlib compression is done in a pool of threads.
+    Only a limited number of chunks are built at once; the rest wait their
+    turn, and their data isn't gathered until their turn comes, so that a
+    flood of chunk requests can't tie up all of the memory in queued
+    compression jobs.
+
+    Built packets are cached on their chunks, and requests for a chunk whose
+    packet is already being built share that build, as long as the chunk
+    hasn't changed since its data was gathered.
+    """
+
+    threadpool = None
+    """
+    The pool of threads used for compression, if any.
+
+    When no pool is running, packets are compressed right away.
+    """
+
+    def __init__(self, level=6, backlog=16):
+        """
+        :param int level: the zlib compression level, from 1 to 9
+        :param int backlog: the largest number of chunks to compress at once
+        """
+
+        self.level = level
+        self.backlog = backlog
+
+        self._semaphore = DeferredSemaphore(backlog)
+        self._building = {}
+
+    def start(self, size):
+        """
+        Start compressing in a pool of threads.
+
+        :param int size: the largest number of threads to use
+        """
+
+        if self.threadpool is not None:
+            return
+
+        self.threadpool = ThreadPool(1, size, "compressor")
+        self.threadpool.start()
+
+    def stop(self):
+        """
+        Stop the thread pool, waiting for any running compression to finish.
+        """
+
+        if self.threadpool is None:
+            return
+
+        self.threadpool.stop()
+        self.threadpool = None
+
+    @property
+    def pending(self):
+        """
+        The number of chunks whose packets are being built.
+        """
+
+        return len(self._building)
+
+    def packet(self, chunk):
+        """
+        Get a chunk's packet.
+
+        The chunk may change while its packet is being built, so the packet
+        comes with the chunk's ``packet_serial`` from when its data was
+        gathered; callers can compare it against the chunk's current serial
+        to tell whether the packet is stale.
+
+        :returns: `Deferred` which will fire with a tuple of the packet and
+            its serial
+        """
+
+        packet = chunk.cached_packet()
+        if packet is not None:
+            return succeed((packet, chunk.packet_serial))
+
+        # Share a build which is still waiting its turn, or which gathered
+        # its data since the chunk last changed.
+        if chunk in self._building:
+            build = self._building[chunk]
+            if build.serial in (None, chunk.packet_serial):
+                Chunk.packet_hits += 1
+                d = Deferred()
+                build.waiters.append(d)
+                return d
+
+        Chunk.packet_misses += 1
+
+        build = _Build()
+        self._building[chunk] = build
+
+        d = self._semaphore.run(self._build, chunk, build)
+
+        @d.addBoth
+        def built(result):
+            if self._building.get(chunk) is build:
+                del self._building[chunk]
+
+            if not isinstance(result, Failure):
+                chunk.cache_packet(*result)
+
+            for waiter in build.waiters:
+                waiter.callback(result)
+
+            return result
+
+        return d
+
+    def _build(self, chunk, build):
+        build.serial = serial = chunk.packet_serial
+        mask, data = chunk.packet_data()
+
+        if self.threadpool is None:
+            d = succeed(make_chunk_packet(chunk.x, chunk.z, mask, data,
+                                          self.level))
+        else:
+            d = deferToThreadPool(reactor, self.threadpool,
+                                  make_chunk_packet, chunk.x, chunk.z, mask,
+                                  data, self.level)
+
+        d.addCallback(lambda packet: (packet, serial))
+        return d
+
+class _Build(object):
+    """
+    A chunk packet which is being built.
+    """
+
+    serial = None
+    """
+    The chunk's ``packet_serial`` when its data was gathered, or None if the
+    build is still waiting its turn.
+    """
+
+    def __init__(self):
+        self.waiters = []
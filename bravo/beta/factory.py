@@ -7,11 +7,13 @@ from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Factory
 from twisted.internet.task import LoopingCall
 from twisted.python import log
+from twisted.python.failure import Failure
 from zope.interface import implements
 
+from bravo.beta.compression import ChunkCompressor
 from bravo.beta.packets import make_packet
 from bravo.beta.protocol import BravoProtocol, KickedProtocol
-from bravo.entity import entities
+from bravo.entity import entities, Mob
 from bravo.ibravo import (ISortedPlugin, IAutomaton, ITerrainGenerator,
                           IUseHook, ISignHook, IPreDigHook, IDigHook,
                           IPreBuildHook, IPostBuildHook, IWindowOpenHook,
@@ -48,6 +50,17 @@ class BravoFactory(Factory):
 
     interfaces = []
 
+    _stopping = None
+    """
+    A ``Deferred`` for saving the world while stopping, or None if the
+    factory hasn't been stopped.
+    """
+
+    _shutdown_trigger = None
+    """
+    The reactor's shutdown trigger for stopping the factory, if it has one.
+    """
+
     def __init__(self, config, name):
         """
         Create a factory and world.
@@ -68,6 +81,9 @@ class BravoFactory(Factory):
         self.protocols = dict()
         self.connectedIPs = defaultdict(int)
 
+        # The protocols which have each chunk loaded, by chunk coordinates.
+        self.watchers = dict()
+
         self.mode = self.config.get(self.config_name, "mode")
         if self.mode not in ("creative", "survival"):
             raise Exception("Unsupported mode %s" % self.mode)
@@ -80,6 +96,12 @@ class BravoFactory(Factory):
 
         self.vane = WeatherVane(self)
 
+        level = self.config.getintdefault(self.config_name,
+                                          "compression_level", 6)
+        backlog = self.config.getintdefault(self.config_name,
+                                            "compression_backlog", 16)
+        self.compressor = ChunkCompressor(level, backlog)
+
     def startFactory(self):
         log.msg("Initializing factory for world '%s'..." % self.name)
 
@@ -89,6 +111,20 @@ class BravoFactory(Factory):
         log.msg("Starting world...")
         self.world.start()
 
+        # Saving the world can take several turns of the reactor, so make
+        # sure that the reactor doesn't shut down until the world is saved.
+        self._stopping = None
+        if self._shutdown_trigger is None:
+            self._shutdown_trigger = reactor.addSystemEventTrigger("before",
+                "shutdown", self.shutdown)
+
+        # Compress chunk packets off of the reactor, if asked to.
+        threads = self.config.getintdefault(self.config_name,
+                                            "compression_threads", 0)
+        if threads:
+            self.compressor.start(threads)
+            log.msg("Using %d compression threads" % threads)
+
         log.msg("Starting timekeeping...")
         self.timestamp = reactor.seconds()
         self.time = self.world.level.time
@@ -110,8 +146,16 @@ class BravoFactory(Factory):
         """
         Called before factory stops listening on ports. Used to perform
         shutdown tasks.
+
+        The world is saved in the background, and stopping twice only saves
+        it once.
+
+        :returns: ``Deferred`` which will fire once the world is saved
         """
 
+        if self._stopping is not None:
+            return self._stopping
+
         log.msg("Shutting down world...")
 
         # Stop automatons. Technically, they may not actually halt until their
@@ -127,14 +171,42 @@ class BravoFactory(Factory):
 
         self.time_loop.stop()
 
+        self.compressor.stop()
+
         # Write back current world time. This must be done before stopping the
         # world.
         self.world.time = self.time
 
         # And now stop the world.
-        self.world.stop()
+        self._stopping = d = self.world.stop()
+
+        @d.addBoth
+        def stopped(result):
+            # Nothing is left for the reactor to wait for.
+            if self._shutdown_trigger is not None:
+                reactor.removeSystemEventTrigger(self._shutdown_trigger)
+                self._shutdown_trigger = None
+
+            if isinstance(result, Failure):
+                log.err(result, "Couldn't save world data")
+            else:
+                log.msg("World data saved!")
+
+        return d
+
+    def shutdown(self):
+        """
+        Stop the factory before the reactor shuts down.
+
+        The factory may already be stopping, since services stop listening
+        before shutdown; either way, the reactor waits until the world has
+        been saved.
+
+        :returns: ``Deferred`` which will fire once the world is saved
+        """
 
-        log.msg("World data saved!")
+        self._shutdown_trigger = None
+        return self.stopFactory()
 
     def buildProtocol(self, addr):
         """
@@ -203,6 +275,11 @@ class BravoFactory(Factory):
         if username in self.protocols:
             del self.protocols[username]
 
+        self.world.player_index.discard(protocol)
+
+        for x, z in protocol.chunks:
+            self.unwatch_chunk(protocol, x, z)
+
         self.connectedIPs[host] -= 1
 
     def set_username(self, protocol, username):
@@ -332,10 +409,11 @@ class BravoFactory(Factory):
         @d.addCallback
         def cb(chunk):
             chunk.entities.add(entity)
+            self.world.entity_index.add(entity)
             log.msg("Created entity %s" % entity)
             # XXX Maybe just send the entity object to the manager instead of
             # the following?
-            if hasattr(entity,'loop'):
+            if isinstance(entity, Mob):
                 self.world.mob_manager.start_mob(entity)
 
         return entity
@@ -371,6 +449,9 @@ class BravoFactory(Factory):
         @d.addCallback
         def cb(chunk):
             chunk.entities.discard(entity)
+            self.world.entity_index.discard(entity)
+            if isinstance(entity, Mob) and entity.manager is not None:
+                entity.manager.stop_mob(entity)
             chunk.dirty = True
             log.msg("Destroyed entity %s" % entity)
 
@@ -467,6 +548,47 @@ class BravoFactory(Factory):
             if player is not protocol:
                 player.transport.write(packet)
 
+    def watch_chunk(self, protocol, x, z):
+        """
+        Note that a protocol has loaded a chunk, so that it is sent any
+        packets for that chunk.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        if (x, z) in self.watchers:
+            self.watchers[x, z].add(protocol)
+        else:
+            self.watchers[x, z] = set([protocol])
+            self.world.mob_manager.wake_chunk(x, z)
+
+    def unwatch_chunk(self, protocol, x, z):
+        """
+        Note that a protocol has unloaded a chunk.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        watchers = self.watchers.get((x, z))
+        if watchers is not None:
+            watchers.discard(protocol)
+            if not watchers:
+                del self.watchers[x, z]
+                self.world.mob_manager.sleep_chunk(x, z)
+                self.world.release_chunk((x, z))
+
+    def protocols_for_chunk(self, x, z):
+        """
+        Get the protocols which have a certain chunk loaded.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+
+        :returns: a possibly empty set of protocols, which must not be
+            modified
+        """
+
+        return self.watchers.get((x, z), frozenset())
+
     def broadcast_for_chunk(self, packet, x, z):
         """
         Broadcast a packet to all players that have a certain chunk loaded.
@@ -474,9 +596,8 @@ class BravoFactory(Factory):
         `x` and `z` are chunk coordinates, not block coordinates.
         """
 
-        for player in self.protocols.itervalues():
-            if (x, z) in player.chunks:
-                player.transport.write(packet)
+        for player in self.protocols_for_chunk(x, z):
+            player.transport.write(packet)
 
     def scan_chunk(self, chunk):
         """
@@ -497,9 +618,8 @@ class BravoFactory(Factory):
 
         if chunk.is_damaged():
             packet = chunk.get_damage_packet()
-            for player in self.protocols.itervalues():
-                if (chunk.x, chunk.z) in player.chunks:
-                    player.transport.write(packet)
+            for player in self.protocols_for_chunk(chunk.x, chunk.z):
+                player.transport.write(packet)
             chunk.clear_damage()
 
     def flush_all_chunks(self):
@@ -550,12 +670,8 @@ class BravoFactory(Factory):
 
         radius *= 32
 
-        for p in self.protocols.itervalues():
-            if p.player == player:
-                continue
-
-            distance = player.location.distance(p.location)
-            if distance <= radius:
+        for p in self.world.player_index.iternear(player.location.pos, radius):
+            if p.player != player:
                 yield p.player
 
     def pauseProducing(self):
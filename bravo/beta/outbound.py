@@ -0,0 +1,222 @@
+from collections import defaultdict
+from struct import unpack_from
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from zope.interface import implements
+
+from bravo.beta.packets import fixed_packets, make_packet
+
+# Entity packets which completely replace the state set by earlier packets
+# for the same entity, mapped to the earlier packets which they replace.
+# Teleports are absolute, so they replace relative moves as well.
+superseding = {
+    0x1c: (0x1c,),
+    0x20: (0x20,),
+    0x22: (0x1f, 0x20, 0x21, 0x22),
+    0x23: (0x23,),
+}
+
+# Relative moves, which can be added together.
+relative = (0x1f, 0x21)
+
+entity_packets = dict((header, 1 + fixed_packets[header].size)
+                      for header in list(superseding) + list(relative))
+
+class PacketQueue(object):
+    """
+    A wrapper around a transport which gathers up the packets written to it
+    during a single turn of the reactor, and writes them all at once.
+
+    While packets wait to be written, newer entity packets replace older ones
+    which they make pointless: a teleport replaces any earlier moves, looks,
+    and teleports of the same entity, and a relative move is added to the
+    previous relative move of the same entity when possible.
+
+    The queue is registered with its transport as a push producer. When the
+    transport's buffers are full, packets are held, and merged, until it
+    catches up. If a client falls too far behind, it is disconnected.
+    """
+
+    implements(IPushProducer)
+
+    superseded = 0
+    """
+    The number of packets which have been replaced by later packets.
+    """
+
+    merged = 0
+    """
+    The number of relative moves which have been added together.
+    """
+
+    limit = 4 * 1024 * 1024
+    """
+    The largest number of bytes to hold for a paused transport.
+    """
+
+    paused = False
+    stopped = False
+
+    def __init__(self, transport, clock=reactor):
+        self.transport = transport
+        self.clock = clock
+
+        self._call = None
+        self._clear()
+
+        transport.registerProducer(self, True)
+
+    def __getattr__(self, name):
+        # Everything that isn't writing is passed straight through.
+        return getattr(self.transport, name)
+
+    def __len__(self):
+        return self.size
+
+    def _clear(self):
+        self.pending = []
+        self.size = 0
+
+        # Indices of pending entity packets, by entity and header.
+        self.entities = defaultdict(list)
+
+        # Indices of the latest relative moves which are safe to add to,
+        # by entity.
+        self.moves = {}
+
+    def _append(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+
+    def _drop(self, i):
+        self.size -= len(self.pending[i])
+        self.pending[i] = None
+
+    def _merge(self, first, second):
+        """
+        Add two relative moves together.
+
+        :returns: the combined move, or None if the moves can't be combined
+        """
+
+        # A move without a look can't be put after an older look.
+        if first[0] == "\x21" and second[0] == "\x1f":
+            return None
+
+        dx, dy, dz = [a + b for a, b in zip(unpack_from(">bbb", first, 5),
+                                            unpack_from(">bbb", second, 5))]
+        if not all(-128 <= d <= 127 for d in (dx, dy, dz)):
+            return None
+
+        eid = unpack_from(">I", second, 1)[0]
+
+        if second[0] == "\x21":
+            yaw, pitch = unpack_from(">BB", second, 8)
+            return make_packet("entity-location", eid=eid, dx=dx, dy=dy,
+                               dz=dz, yaw=yaw, pitch=pitch)
+        else:
+            return make_packet("entity-position", eid=eid, dx=dx, dy=dy,
+                               dz=dz)
+
+    def _write_entity(self, data, header, eid):
+        for earlier in superseding.get(header, ()):
+            for i in self.entities.pop((eid, earlier), ()):
+                self._drop(i)
+                PacketQueue.superseded += 1
+
+        if header == 0x22:
+            self.moves.pop(eid, None)
+        elif header in relative:
+            i = self.moves.get(eid)
+            if i is not None:
+                merged = self._merge(self.pending[i], data)
+                if merged is not None:
+                    self.entities[eid, ord(self.pending[i][0])].remove(i)
+                    self._drop(i)
+                    PacketQueue.merged += 1
+                    data = merged
+                    header = ord(data[0])
+
+            self.moves[eid] = len(self.pending)
+
+        self.entities[eid, header].append(len(self.pending))
+        self._append(data)
+
+    def write(self, data):
+        """
+        Queue some data, which may be any number of packets.
+        """
+
+        if self.stopped or not data:
+            return
+
+        header = ord(data[0])
+        if entity_packets.get(header) == len(data):
+            self._write_entity(data, header, unpack_from(">I", data, 1)[0])
+        else:
+            # Other packets might depend on where entities are, so moves
+            # from before them can't be added to.
+            self.moves.clear()
+            self._append(data)
+
+        if self.paused:
+            if self.size > self.limit:
+                log.msg("Client fell %d bytes behind; disconnecting" %
+                        self.size)
+                self.stopProducing()
+                self.transport.loseConnection()
+        elif self._call is None:
+            self._call = self.clock.callLater(0, self.flush)
+
+    def writeSequence(self, iovec):
+        for data in iovec:
+            self.write(data)
+
+    def _cancel(self):
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+    def _write(self):
+        pending = [data for data in self.pending if data is not None]
+        self._clear()
+
+        if pending:
+            self.transport.writeSequence(pending)
+
+    def flush(self):
+        """
+        Write all of the queued packets to the transport, unless it is
+        paused.
+        """
+
+        self._cancel()
+
+        if not (self.paused or self.stopped):
+            self._write()
+
+    def loseConnection(self):
+        # Parting words, like kick messages, are written even if the
+        # transport is paused.
+        self._cancel()
+
+        if not self.stopped:
+            self._write()
+
+        self.transport.loseConnection()
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+    def stopProducing(self):
+        self._cancel()
+
+        self.stopped = True
+        self._clear()
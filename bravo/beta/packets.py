@@ -1,4 +1,7 @@
 from collections import namedtuple
+from operator import attrgetter, itemgetter
+from struct import pack, Struct as Packer, error as StructError
+from zlib import compress
 
 from construct import Struct, Container, Embed, Enum, MetaField
 from construct import MetaArray, If, Switch, Const, Peek, Magic
@@ -10,6 +13,7 @@ from construct import BFloat32, BFloat64
 from construct import BitStruct, BitField
 from construct import StringAdapter, LengthValueAdapter, Sequence
 from construct import ConstructError
+from construct import FormatField, StaticField, MappingAdapter, Reconfig
 
 def IPacket(object):
     """
@@ -56,6 +60,145 @@ def simple(name, fmt, *args):
 
     return type(name, (namedtuple(name, *args),), methods)
 
+class FixedPacket(object):
+    """
+    A packet with a fixed layout, parsed and built with a single precompiled
+    struct.
+
+    Fixed packets are compiled from the construct definition of the packet,
+    and give exactly the same containers and bytes as the construct does, but
+    without walking the construct tree for every field of every packet.
+    Nested structs become nested containers, and enums and flags are mapped
+    the same way that construct maps them.
+
+    Packets with any variable-length fields can't be compiled, and raise
+    ValueError instead.
+    """
+
+    def __init__(self, construct):
+        self.name = construct.name
+
+        self.formats = []
+        self.paths = []
+        self.adapters = []
+        self.layout = self._compile(construct, ())
+
+        self.packer = Packer(">" + "".join(self.formats))
+        self.size = self.packer.size
+        self.getter = attrgetter(*self.paths)
+
+        del self.formats
+
+    def _compile(self, construct, path):
+        """
+        Compile a struct into a layout, recording the format, attribute path,
+        and adapter of each of its fields along the way.
+
+        The layout of a struct is a tuple of the names of its fields, a
+        function which picks their values out of the unpacked values, and the
+        names and layouts of its nested structs.
+        """
+
+        if not isinstance(construct, Struct):
+            raise ValueError("%s is not a struct" % construct.name)
+
+        names = []
+        indices = []
+        nested = []
+
+        for sc in construct.subcons:
+            if sc.conflags & sc.FLAG_EMBED:
+                if not isinstance(sc, Reconfig):
+                    raise ValueError("Can't embed %s" % sc.name)
+                embedded = self._compile(sc.subcon, path)
+                nested.extend(embedded[2])
+                for name in embedded[0]:
+                    names.append(name)
+                    indices.append(self.paths.index(".".join(path + (name,))))
+                continue
+            elif isinstance(sc, Struct):
+                nested.append((sc.name, self._compile(sc, path + (sc.name,))))
+                continue
+            elif isinstance(sc, MappingAdapter):
+                self.adapters.append((len(self.paths), sc))
+                self.formats.append(self._format(sc.subcon))
+            else:
+                self.formats.append(self._format(sc))
+
+            names.append(sc.name)
+            indices.append(len(self.paths))
+            self.paths.append(".".join(path + (sc.name,)))
+
+        if not indices:
+            getter = lambda values: ()
+        elif len(indices) == 1:
+            index = indices[0]
+            getter = lambda values: (values[index],)
+        else:
+            getter = itemgetter(*indices)
+
+        return tuple(names), getter, tuple(nested)
+
+    def _format(self, field):
+        if isinstance(field, FormatField):
+            # Strip the endianness; all packets are big-endian.
+            return field.packer.format[1:]
+        elif type(field) is StaticField:
+            return "%ds" % field.length
+        else:
+            raise ValueError("%s is not a fixed field" % field.name)
+
+    def _unpack(self, layout, values):
+        names, getter, nested = layout
+
+        fields = dict(zip(names, getter(values)))
+        for name, layout in nested:
+            fields[name] = self._unpack(layout, values)
+
+        return Container(**fields)
+
+    def parse(self, buf, offset):
+        """
+        Parse a packet payload out of the given buffer, starting at the given
+        offset.
+
+        Like the packets made by `simple()`, returns a tuple of the parsed
+        container and the next packet offset if the parse is successful, or
+        a tuple of None and the amount of data still needed if not.
+
+        :raises ConstructError: if an enum or flag has an unknown value
+        """
+
+        end = offset + self.size
+        if len(buf) < end:
+            return None, end - len(buf)
+
+        values = self.packer.unpack_from(buf, offset)
+        if self.adapters:
+            values = list(values)
+            for i, adapter in self.adapters:
+                values[i] = adapter._decode(values[i], None)
+
+        return self._unpack(self.layout, values), end
+
+    def build(self, obj):
+        """
+        Build a packet payload from a container.
+
+        :raises: any of the errors that building a bad container can cause;
+            the packet's construct gives more useful messages for those
+        """
+
+        if len(self.paths) == 1:
+            values = [self.getter(obj)]
+        else:
+            values = list(self.getter(obj))
+
+        for i, adapter in self.adapters:
+            values[i] = adapter._encode(values[i], None)
+
+        return self.packer.pack(*values)
+
 
 DUMP_ALL_PACKETS = False
 
@@ -969,6 +1112,16 @@ packets = {
     0xff: Struct("error", AlphaString("message")),
 }
 
+# Precompiled codecs for all of the packets with fixed layouts. The rest of
+# the packets are handled by their constructs.
+fixed_packets = {}
+for header, construct in packets.iteritems():
+    try:
+        fixed_packets[header] = FixedPacket(construct)
+    except ValueError:
+        pass
+del header, construct
+
 packet_stream = Struct("packet_stream",
     OptionalGreedyRange(
         Struct("full_packet",
@@ -981,6 +1134,81 @@ packet_stream = Struct("packet_stream",
     ),
 )
 
+class BufferStream(object):
+    """
+    A read-only file-like view of part of a string or bytearray, for handing
+    to constructs without copying the rest of the buffer.
+
+    The stream remembers how far into the buffer any read has tried to go,
+    which is how much of the buffer a construct needed.
+    """
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+        self.wanted = offset
+
+    def read(self, length):
+        start = self.offset
+        self.offset += length
+        self.wanted = max(self.wanted, self.offset)
+        return str(self.data[start:self.offset])
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += len(self.data)
+        self.offset = offset
+
+def parse_packet(bytestream, offset=0):
+    """
+    Parse a single packet out of a string or bytearray, starting at the given
+    offset.
+
+    If a whole packet is available, returns a tuple of its header, its
+    payload, and the offset of the next packet.
+
+    Otherwise, returns a tuple of None, None, and the length that the buffer
+    must reach before trying again is worthwhile. For fixed packets this is
+    the exact end of the packet; for other packets it is the end of the
+    first field which didn't fit, like the body of a string whose length has
+    already been read. If the packet is garbage, rather than incomplete, the
+    length is zero.
+    """
+
+    if offset >= len(bytestream):
+        return None, None, offset + 1
+
+    header = ord(bytestream[offset:offset + 1])
+
+    if header in fixed_packets:
+        try:
+            payload, end = fixed_packets[header].parse(bytestream, offset + 1)
+        except ConstructError:
+            return None, None, 0
+
+        if payload is None:
+            return None, None, offset + 1 + fixed_packets[header].size
+
+        return header, payload, end
+
+    elif header in packets:
+        stream = BufferStream(bytestream, offset + 1)
+        try:
+            payload = packets[header].parse_stream(stream)
+        except ConstructError:
+            if stream.wanted > len(bytestream):
+                return None, None, stream.wanted
+            return None, None, 0
+
+        return header, payload, stream.tell()
+
+    return None, None, 0
+
 def parse_packets(bytestream):
     """
     Opportunistically parse out as many packets as possible from a raw
@@ -990,10 +1218,18 @@ def parse_packets(bytestream):
     leftover unparseable bytes.
     """
 
-    container = packet_stream.parse(bytestream)
+    l = []
+    offset = 0
+
+    while True:
+        header, payload, end = parse_packet(bytestream, offset)
+        if header is None:
+            break
 
-    l = [(i.header, i.payload) for i in container.full_packet]
-    leftovers = "".join(chr(i) for i in container.leftovers)
+        l.append((header, payload))
+        offset = end
+
+    leftovers = bytestream[offset:]
 
     if DUMP_ALL_PACKETS:
         for header, payload in l:
@@ -1002,6 +1238,64 @@ def parse_packets(bytestream):
 
     return l, leftovers
 
+class PacketBuffer(object):
+    """
+    A buffer of incoming bytes, from which packets are parsed as soon as they
+    are complete.
+
+    Bytes are appended to a bytearray, and parsing resumes from the end of
+    the last whole packet. Incomplete packets aren't parsed again until
+    enough bytes have arrived to get past the point where the last parse
+    ran out, so a large packet arriving in many pieces is only parsed a
+    handful of times, rather than once per piece.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offset = 0
+        self.wanted = 0
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def feed(self, data):
+        """
+        Add some bytes to the buffer.
+
+        :returns: a list of tuples of headers and payloads of all of the
+            packets completed by the new bytes
+        """
+
+        self.data.extend(data)
+
+        l = []
+
+        if len(self.data) < self.wanted:
+            return l
+
+        while True:
+            header, payload, end = parse_packet(self.data, self.offset)
+            if header is None:
+                self.wanted = end
+                break
+
+            l.append((header, payload))
+            self.offset = end
+
+        # Forget about parsed bytes once they're the bulk of the buffer. In
+        # the common case, everything has been parsed, and this is cheap.
+        if self.offset and self.offset * 2 >= len(self.data):
+            del self.data[:self.offset]
+            self.wanted = max(self.wanted - self.offset, 0)
+            self.offset = 0
+
+        if DUMP_ALL_PACKETS:
+            for header, payload in l:
+                print "Parsed packet 0x%.2x" % header
+                print payload
+
+        return l
+
 incremental_packet_stream = Struct("incremental_packet_stream",
     Struct("full_packet",
         UBInt8("header"),
@@ -1057,9 +1351,31 @@ def make_packet(packet, *args, **kwargs):
     if DUMP_ALL_PACKETS:
         print "Making packet <%s> (0x%.2x)" % (packet, header)
         print container
+
+    if header in fixed_packets:
+        try:
+            return chr(header) + fixed_packets[header].build(container)
+        except (AttributeError, TypeError, StructError, ConstructError):
+            # Let the construct explain what went wrong.
+            pass
+
     payload = packets[header].build(container)
     return chr(header) + payload
 
+def make_chunk_packet(x, z, primary, data, level=6):
+    """
+    Constructs a full chunk packet bytestream from uncompressed chunk data.
+
+    This gives the same bytes as ``make_packet("chunk", ...)`` does for a
+    continuous chunk with no add data, but lets the caller choose the zlib
+    compression level. It also doesn't touch any shared state, so it can be
+    called from other threads.
+    """
+
+    data = compress(data, level)
+    return pack(">BiiBHHI", 0x33, x, z, True, primary, 0x0,
+                len(data)) + data
+
 def make_error_packet(message):
     """
     Convenience method to generate an error packet bytestream.
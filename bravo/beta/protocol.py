@@ -1,6 +1,6 @@
 # vim: set fileencoding=utf8 :
 
-from itertools import product, chain
+from itertools import chain
 import json
 from time import time
 from urlparse import urlunparse
@@ -28,7 +28,8 @@ from bravo.infini.factory import InfiniClientFactory
 from bravo.inventory.windows import InventoryWindow
 from bravo.location import Location, Orientation, Position
 from bravo.motd import get_motd
-from bravo.beta.packets import parse_packets, make_packet, make_error_packet
+from bravo.beta.outbound import PacketQueue
+from bravo.beta.packets import PacketBuffer, make_packet, make_error_packet
 from bravo.plugin import retrieve_plugins
 from bravo.policy.dig import dig_policies
 from bravo.utilities.coords import adjust_coords_for_face, split_coords
@@ -54,7 +55,7 @@ class BetaServerProtocol(object, Protocol, TimeoutMixin):
 
     state = STATE_UNAUTHENTICATED
 
-    buf = ""
+    buf = None
     parser = None
     handler = None
 
@@ -67,6 +68,7 @@ class BetaServerProtocol(object, Protocol, TimeoutMixin):
     _latency = 0
 
     def __init__(self):
+        self.buf = PacketBuffer()
         self.chunks = dict()
         self.windows = {}
         self.wid = 1
@@ -378,10 +380,16 @@ class BetaServerProtocol(object, Protocol, TimeoutMixin):
     # Please don't override these needlessly, as they are pretty solid and
     # shouldn't need to be touched.
 
-    def dataReceived(self, data):
-        self.buf += data
+    def makeConnection(self, transport):
+        """
+        Connect to a transport, gathering up everything written to it during
+        each turn of the reactor.
+        """
 
-        packets, self.buf = parse_packets(self.buf)
+        Protocol.makeConnection(self, PacketQueue(transport))
+
+    def dataReceived(self, data):
+        packets = self.buf.feed(data)
 
         if packets:
             self.resetTimeout()
@@ -705,6 +713,12 @@ class BravoProtocol(BetaServerProtocol):
 
     time_loop = None
 
+    disconnected = False
+    """
+    Whether the connection has been lost. Chunks which finish loading after
+    this are dropped.
+    """
+
     eid = 0
 
     last_dig = None
@@ -773,6 +787,7 @@ class BravoProtocol(BetaServerProtocol):
 
         # *Now* we are in our factory's list of protocols. Be aware.
         self.factory.protocols[self.username] = self
+        self.factory.world.player_index.add(self)
 
         # Announce our presence.
         self.factory.chat("%s is joining the game..." % self.username)
@@ -850,26 +865,18 @@ class BravoProtocol(BetaServerProtocol):
         """
         Obtain the entities within a radius of this player.
 
-        Radius is measured in blocks.
-        """
-
-        chunk_radius = int(radius // 16 + 1)
-        chunkx, chunkz = self.location.pos.to_chunk()
-
-        minx = chunkx - chunk_radius
-        maxx = chunkx + chunk_radius + 1
-        minz = chunkz - chunk_radius
-        maxz = chunkz + chunk_radius + 1
+        Radius is measured in blocks. Only entities in chunks which this
+        player has loaded are included.
 
-        for x, z in product(xrange(minx, maxx), xrange(minz, maxz)):
-            if (x, z) not in self.chunks:
-                continue
-            chunk = self.chunks[x, z]
+        :returns: list of entities
+        """
 
-            yieldables = [entity for entity in chunk.entities
-                if self.location.distance(entity.location) <= (radius * 32)]
-            for i in yieldables:
-                yield i
+        # Callers destroy entities as they go, so don't hand them a view of
+        # the index.
+        index = self.factory.world.entity_index
+        return [entity for entity in index.iternear(self.location.pos,
+                                                    radius * 32)
+                if entity.location.pos.to_chunk() in self.chunks]
 
     def chat(self, container):
         # data = json.loads(container.data)
@@ -1319,6 +1326,7 @@ class BravoProtocol(BetaServerProtocol):
 
         # Remove the chunk from cache.
         chunk = self.chunks.pop(key)
+        self.factory.unwatch_chunk(self, x, z)
 
         eids = [e.eid for e in chunk.entities]
 
@@ -1335,8 +1343,8 @@ class BravoProtocol(BetaServerProtocol):
         This function will asynchronously obtain the chunk, and send it on the
         wire.
 
-        :returns: `Deferred` that will be fired when the chunk is obtained,
-                  with no arguments
+        :returns: `Deferred` that will be fired when the chunk has been
+                  written to the transport, with no arguments
         """
 
         log.msg("Enabling chunk %d, %d" % (x, z))
@@ -1349,27 +1357,56 @@ class BravoProtocol(BetaServerProtocol):
 
         @d.addCallback
         def cb(chunk):
+            # The client might have left while the chunk was loading.
+            if self.disconnected:
+                return None
+
             self.chunks[x, z] = chunk
-            return chunk
-        d.addCallback(self.send_chunk)
+            self.factory.watch_chunk(self, x, z)
+            return self.send_chunk(chunk)
 
         return d
 
     def send_chunk(self, chunk):
+        """
+        Send a chunk, along with its entities and signs.
+
+        The chunk's packet may be compressed in the background, so the chunk
+        is only sent if it is still loaded once its packet is ready. Chunks
+        which changed while their packet was being built are built again,
+        since the client drops changes to chunks it doesn't have yet.
+
+        :returns: `Deferred` that will be fired when the chunk has been
+                  written to the transport, with no arguments
+        """
+
         log.msg("Sending chunk %d, %d" % (chunk.x, chunk.z))
 
-        packet = chunk.save_to_packet()
-        self.transport.write(packet)
+        d = self.factory.compressor.packet(chunk)
+
+        @d.addCallback
+        def write(result):
+            packet, serial = result
+            if (self.disconnected or
+                self.chunks.get((chunk.x, chunk.z)) is not chunk):
+                return
+
+            if serial != chunk.packet_serial:
+                return self.send_chunk(chunk)
 
-        for entity in chunk.entities:
-            packet = entity.save_to_packet()
             self.transport.write(packet)
 
-        for entity in chunk.tiles.itervalues():
-            if entity.name == "Sign":
+            for entity in chunk.entities:
                 packet = entity.save_to_packet()
                 self.transport.write(packet)
 
+            for entity in chunk.tiles.itervalues():
+                if entity.name == "Sign":
+                    packet = entity.save_to_packet()
+                    self.transport.write(packet)
+
+        return d
+
     def send_initial_chunk_and_location(self):
         """
         Send the initial chunks and location.
@@ -1489,6 +1526,7 @@ class BravoProtocol(BetaServerProtocol):
             self.factory.chat("%s has left the game." % self.username)
 
         self.factory.teardown_protocol(self)
+        self.disconnected = True
 
         # We are now torn down. After this point, there will be no more
         # factory stuff, just our own personal stuff.
@@ -581,6 +581,54 @@ softblocks.add(31)  # Tall grass
 softblocks.add(70)  # Snow
 softblocks.add(106) # Vines
 
+# Entities can move through these; everything else is solid
+nonsolids = set()
+nonsolids.add(0)   # Air
+nonsolids.add(6)   # Sapling
+nonsolids.add(8)   # Water
+nonsolids.add(9)   # Spring
+nonsolids.add(10)  # Lava
+nonsolids.add(11)  # Lava spring
+nonsolids.add(27)  # Powered rail
+nonsolids.add(28)  # Detector rail
+nonsolids.add(30)  # Cobweb
+nonsolids.add(31)  # Tall grass
+nonsolids.add(32)  # Shrub
+nonsolids.add(37)  # Yellow Flowers
+nonsolids.add(38)  # Red Flowers
+nonsolids.add(39)  # Brown Mushrooms
+nonsolids.add(40)  # Red Mushrooms
+nonsolids.add(50)  # Torch
+nonsolids.add(51)  # Fire
+nonsolids.add(55)  # Redstone (Wire)
+nonsolids.add(59)  # Crops
+nonsolids.add(63)  # Sign
+nonsolids.add(65)  # Ladder
+nonsolids.add(66)  # Rails
+nonsolids.add(68)  # Sign (on wall)
+nonsolids.add(69)  # Lever
+nonsolids.add(70)  # Stone Pressure Plate
+nonsolids.add(72)  # Wood Pressure Plate
+nonsolids.add(75)  # Redstone Torch (off)
+nonsolids.add(76)  # Redstone Torch (on)
+nonsolids.add(77)  # Stone Button
+nonsolids.add(78)  # Snow
+nonsolids.add(83)  # Sugar Cane
+nonsolids.add(90)  # Portal
+nonsolids.add(104) # Pumpkin stem
+nonsolids.add(105) # Melon stem
+nonsolids.add(106) # Vines
+nonsolids.add(111) # Lily Pad
+
+nonsolid_bytes = "".join(chr(i) for i in sorted(nonsolids))
+"""
+The non-solid block slots, as a string of bytes.
+
+Passing this to ``str.translate()`` as the characters to delete leaves only
+the solid blocks behind, which makes it a quick way to test a whole run of
+blocks at once.
+"""
+
 dims = {}
 
 dims[0]  = 0 # Air
@@ -1,15 +1,14 @@
 from array import array
 from functools import wraps
-from itertools import product
 from struct import pack
 from warnings import warn
 
-from bravo.blocks import blocks, glowing_blocks
-from bravo.beta.packets import make_packet
-from bravo.geometry.section import Section
+from bravo.blocks import blocks, glowing_blocks, nonsolid_bytes
+from bravo.beta.packets import make_chunk_packet, make_packet
+from bravo.geometry.section import empty_section, si
 from bravo.utilities.bits import pack_nibbles
-from bravo.utilities.coords import CHUNK_HEIGHT, XZ, iterchunk
-from bravo.utilities.maths import clamp
+from bravo.utilities.coords import CHUNK_HEIGHT, XZ
+from bravo.utilities.light import BlockLight, SkyLight, dims, unlit_bytes
 
 class ChunkWarning(Warning):
     """
@@ -70,118 +69,6 @@ def segment_array(a):
 
     return l
 
-def make_glows():
-    """
-    Set up glow tables.
-
-    These tables provide glow maps for illuminated points.
-    """
-
-    glow = [None] * 16
-    for i in range(16):
-        dim = 2 * i + 1
-        glow[i] = array("b", [0] * (dim**3))
-        for x, y, z in product(xrange(dim), repeat=3):
-            distance = abs(x - i) + abs(y - i) + abs(z - i)
-            glow[i][(x * dim + y) * dim + z] = i + 1 - distance
-        glow[i] = array("B", [clamp(x, 0, 15) for x in glow[i]])
-    return glow
-
-glow = make_glows()
-
-def composite_glow(target, strength, x, y, z):
-    """
-    Composite a light source onto a lightmap.
-
-    The exact operation is not quite unlike an add.
-    """
-
-    ambient = glow[strength]
-
-    xbound, zbound, ybound = 16, CHUNK_HEIGHT, 16
-
-    sx = x - strength
-    sy = y - strength
-    sz = z - strength
-
-    ex = x + strength
-    ey = y + strength
-    ez = z + strength
-
-    si, sj, sk = 0, 0, 0
-    ei, ej, ek = strength * 2, strength * 2, strength * 2
-
-    if sx < 0:
-        sx, si = 0, -sx
-
-    if sy < 0:
-        sy, sj = 0, -sy
-
-    if sz < 0:
-        sz, sk = 0, -sz
-
-    if ex > xbound:
-        ex, ei = xbound, ei - ex + xbound
-
-    if ey > ybound:
-        ey, ej = ybound, ej - ey + ybound
-
-    if ez > zbound:
-        ez, ek = zbound, ek - ez + zbound
-
-    adim = 2 * strength + 1
-
-    # Composite! Apologies for the loops.
-    for (tx, ax) in zip(range(sx, ex), range(si, ei)):
-        for (tz, az) in zip(range(sz, ez), range(sk, ek)):
-            for (ty, ay) in zip(range(sy, ey), range(sj, ej)):
-                ambient_index = (ax * adim + az) * adim + ay
-                target[ci(tx, ty, tz)] += ambient[ambient_index]
-
-def iter_neighbors(coords):
-    """
-    Iterate over the chunk-local coordinates surrounding the given
-    coordinates.
-
-    All coordinates are chunk-local.
-
-    Coordinates which are not valid chunk-local coordinates will not be
-    generated.
-    """
-
-    x, z, y = coords
-
-    for dx, dz, dy in (
-        (1, 0, 0),
-        (-1, 0, 0),
-        (0, 1, 0),
-        (0, -1, 0),
-        (0, 0, 1),
-        (0, 0, -1)):
-        nx = x + dx
-        nz = z + dz
-        ny = y + dy
-
-        if not (0 <= nx < 16 and
-            0 <= nz < 16 and
-            0 <= ny < CHUNK_HEIGHT):
-            continue
-
-        yield nx, nz, ny
-
-def neighboring_light(glow, block):
-    """
-    Calculate the amount of light that should be shone on a block.
-
-    ``glow`` is the brighest neighboring light. ``block`` is the slot of the
-    block being illuminated.
-
-    The return value is always a valid light value.
-    """
-
-    return clamp(glow - blocks[block].dim, 0, 15)
-
-
 class Chunk(object):
     """
     A chunk of blocks.
@@ -204,12 +91,40 @@ class Chunk(object):
     Optional hook to be called when this chunk becomes dirty.
     """
 
+    neighbors = None
+    """
+    Optional hook to be called with the coordinates of another chunk, to look
+    it up so that light can spread into it. It should return None for chunks
+    which aren't loaded.
+    """
+
     _dirty = True
     """
     Internal flag describing whether the chunk is dirty. Don't touch directly;
     use the ``dirty`` property instead.
     """
 
+    _packet = None
+    """
+    The most recently built chunk packet, or None if the chunk has changed
+    since. Don't touch directly; use ``save_to_packet()`` and
+    ``invalidate_packet()`` instead.
+    """
+
+    packet_serial = 0
+    """
+    A count of how many times this chunk's packet has been invalidated, so
+    that packets built in the background can tell whether they are still
+    current.
+    """
+
+    packet_hits = 0
+    packet_misses = 0
+    """
+    Counts of chunk packets which were served from, and built for, the
+    packet caches of all chunks.
+    """
+
     def __init__(self, x, z):
         """
         :param int x: X coordinate in chunk coords
@@ -229,7 +144,8 @@ class Chunk(object):
         self.heightmap = array("B", [0] * (16 * 16))
         self.blocklight = array("B", [0] * (16 * 16 * CHUNK_HEIGHT))
 
-        self.sections = [Section() for i in range(16)]
+        # Sections are only made when something is put in them.
+        self.sections = [empty_section] * 16
 
         self.entities = set()
         self.tiles = {}
@@ -239,6 +155,73 @@ class Chunk(object):
     def __repr__(self):
         return "Chunk(%d, %d)" % (self.x, self.z)
 
+    def neighbor(self, x, z):
+        """
+        Look up a chunk near this one, using the ``neighbors`` hook.
+
+        :param int x: X coordinate in chunk coords
+        :param int z: Z coordinate in chunk coords
+        :returns: the chunk, or None if it can't be looked up
+        """
+
+        if x == self.x and z == self.z:
+            return self
+        elif self.neighbors is not None:
+            return self.neighbors((x, z))
+        return None
+
+    def unshare(self, index):
+        """
+        Get a section of this chunk which can be changed.
+
+        Shared sections, like ``empty_section``, are copied first, and the
+        copy takes their place in this chunk.
+
+        :param int index: the index of the section
+        :returns: the section
+        """
+
+        section = self.sections[index]
+        if section.shared:
+            section = self.sections[index] = section.copy()
+        return section
+
+    def pack(self):
+        """
+        Pack this chunk's sections, to save memory.
+
+        Sections with few enough kinds of blocks in them are turned into
+        ``PackedSection``s. They are unpacked again by themselves when they
+        need to be.
+        """
+
+        for index, section in enumerate(self.sections):
+            if not section.shared:
+                packed = section.pack()
+                if packed is not None:
+                    self.sections[index] = packed
+
+    def _trim(self, index):
+        """
+        Give back a section which has become blank, so that it can be shared
+        again.
+        """
+
+        section = self.sections[index]
+        if not section.shared and section.is_blank():
+            self.sections[index] = empty_section
+
+    def _spread_light(self, engine):
+        """
+        Finish spreading light, and let any other chunks whose light changed
+        know about it.
+        """
+
+        for chunk in engine.run():
+            if chunk is not self:
+                chunk.invalidate_packet()
+                chunk.dirty = True
+
     __str__ = __repr__
 
     @property
@@ -253,32 +236,140 @@ class Chunk(object):
                 self.dirtied(self)
         self._dirty = value
 
+    def invalidate_packet(self):
+        """
+        Throw away this chunk's cached packet.
+
+        This must be called whenever anything which is sent in the packet,
+        such as blocks, metadata, or lighting, is changed. The methods of
+        this class already do so; code which changes the chunk's arrays
+        directly must do it by hand.
+        """
+
+        self._packet = None
+        self.packet_serial += 1
+
+    def cached_packet(self):
+        """
+        Get this chunk's cached packet, if it has one.
+
+        :returns: the packet, or None
+        """
+
+        if self._packet is not None:
+            Chunk.packet_hits += 1
+        return self._packet
+
+    def cache_packet(self, packet, serial):
+        """
+        Cache a packet which was built elsewhere.
+
+        The packet is only kept if the chunk hasn't changed since the packet's
+        data was taken from it.
+
+        :param str packet: the packet
+        :param int serial: the value of ``packet_serial`` when the packet's
+            data was taken
+        """
+
+        if serial == self.packet_serial:
+            self._packet = packet
+
     def regenerate_heightmap(self):
         """
         Regenerate the height map array.
 
         The height map is merely the position of the tallest block in any
         xz-column.
+
+        Sections are scanned from the top down, a layer at a time, skipping
+        empty sections and layers. Each column is finished as soon as its
+        tallest block is found.
         """
 
-        for x in range(16):
-            for z in range(16):
-                column = x * 16 + z
-                for y in range(255, -1, -1):
-                    if self.get_block((x, y, z)):
-                        break
+        heightmap = array("B", [0] * (16 * 16))
+
+        # Columns which haven't been topped out yet, indexed like the layers
+        # of a section, by z * 16 + x.
+        columns = range(16 * 16)
+
+        for index in range(15, -1, -1):
+            section = self.sections[index]
+            if not section:
+                continue
+
+            for y in range(15, -1, -1):
+                layer = section.get_layer(y)
+                if layer.count(0) == 256:
+                    continue
+
+                height = index * 16 + y
+                remaining = []
+                for i in columns:
+                    if layer[i]:
+                        heightmap[(i & 0xf) * 16 + (i >> 4)] = height
+                    else:
+                        remaining.append(i)
+                columns = remaining
+
+                if not columns:
+                    break
 
-                self.heightmap[column] = y
+            if not columns:
+                break
+
+        self.heightmap = heightmap
 
     def regenerate_blocklight(self):
-        lightmap = array("L", [0] * (16 * 16 * CHUNK_HEIGHT))
+        """
+        Regenerate the block light map.
 
-        for x, z, y in iterchunk():
-            block = self.get_block((x, y, z))
-            if block in glowing_blocks:
-                composite_glow(lightmap, glowing_blocks[block], x, y, z)
+        The light from every glowing block in this chunk is spread again,
+        including into any neighboring chunks which can be looked up. Light
+        from those chunks is pulled back in across the borders.
+        """
 
-        self.blocklight = array("B", [clamp(x, 0, 15) for x in lightmap])
+        self.blocklight = array("B", [0] * (16 * 16 * CHUNK_HEIGHT))
+        engine = BlockLight(self.neighbor)
+
+        for index, section in enumerate(self.sections):
+            if not section:
+                continue
+
+            # Most sections have nothing glowing in them at all.
+            blocks = section.block_string()
+            if not blocks.translate(None, unlit_bytes):
+                continue
+
+            for i, block in enumerate(array("B", blocks)):
+                if block in glowing_blocks:
+                    engine.add(self.x * 16 + (i & 0xf), (i >> 8) + index * 16,
+                               self.z * 16 + (i >> 4 & 0xf),
+                               glowing_blocks[block])
+
+        for dx, dz in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            chunk = self.neighbor(self.x + dx, self.z + dz)
+            if chunk is None:
+                continue
+
+            # Spread from the neighbor's column which touches each of the
+            # columns along this side.
+            for i in range(16):
+                if dx:
+                    x, z = (0 if dx > 0 else 15), i
+                else:
+                    x, z = i, (0 if dz > 0 else 15)
+                wx = chunk.x * 16 + x
+                wz = chunk.z * 16 + z
+
+                offset = (x * 16 + z) * CHUNK_HEIGHT
+                column = chunk.blocklight[offset:offset + CHUNK_HEIGHT]
+                for y, level in enumerate(column):
+                    if level > 1:
+                        engine.increase.append((wx, y, wz))
+
+        self._spread_light(engine)
+        self.invalidate_packet()
 
     def regenerate_skylight(self):
         """
@@ -287,47 +378,104 @@ class Chunk(object):
         Each block's individual light comes from two sources. The ambient
         light comes from the sky.
 
+        Sunlight is first shone straight down every column, a layer at a time.
+        Sections above the tallest block are simply filled with full light,
+        and any which are left blank are shared again.
+        Then the light is spread sideways into overhangs and caves, starting
+        only from the blocks next to taller columns, and crossing into any
+        neighboring chunks which can be looked up.
+
         The height map must be valid for this method to produce valid results.
         """
 
-        # Create an array of skylights, and a mask of dimming blocks.
-        lights = [0xf] * (16 * 16)
-        mask = [0x0] * (16 * 16)
-
-        # For each y-level, we're going to update the mask, apply it to the
-        # lights, apply the lights to the section, and then blur the lights
-        # and move downwards. Since empty sections are full of air, and air
-        # doesn't ever dim, ignoring empty sections should be a correct way
-        # to speed things up. Another optimization is that the process ends
-        # early if the entire slice of lights is dark.
-        for section in reversed(self.sections):
+        self.invalidate_packet()
+
+        top = max(self.heightmap) // 16
+
+        for index in range(top + 1, 16):
+            section = self.sections[index]
             if not section:
+                self.sections[index] = empty_section
+            elif section.shaded:
+                section.skylight = array("B", [0xf] * (16 * 16 * 16))
+                section.shaded = 0
+
+        # Shine the sunlight down. The lights are indexed like the layers of
+        # a section, by z * 16 + x.
+        lights = [0xf] * (16 * 16)
+        for index in range(top, -1, -1):
+            section = self.sections[index]
+
+            if not any(lights):
+                skylight = array("B", [0x0] * (16 * 16 * 16))
+            else:
+                layers = []
+                for y in range(15, -1, -1):
+                    layer = section.get_layer(y)
+                    lights = [max(light - dims[block], 0)
+                              for light, block in zip(lights, layer)]
+                    layers.append(lights)
+
+                skylight = array("B")
+                for layer in reversed(layers):
+                    skylight.extend(layer)
+
+            shaded = len(skylight) - skylight.count(0xf)
+            if not (section or shaded):
+                self.sections[index] = empty_section
                 continue
 
-            for y in range(15, -1, -1):
-                # Early-out if there's no more light left.
-                if not any(lights):
-                    break
+            section = self.unshare(index)
+            section.skylight = skylight
+            section.shaded = shaded
+
+        # And spread it sideways, from each column into any taller columns
+        # beside it. Light from neighboring chunks is pulled in as well.
+        engine = SkyLight(self.neighbor)
+        bottoms = [self._lit_bottom(x, z) for x, z in XZ]
+
+        for x, z in XZ:
+            height = self.heightmap[x * 16 + z]
+            bottom = bottoms[x * 16 + z]
+
+            for dx, dz in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                nx = x + dx
+                nz = z + dz
+
+                if 0 <= nx < 16 and 0 <= nz < 16:
+                    spill = self.heightmap[nx * 16 + nz]
+                else:
+                    chunk = self.neighbor(self.x + (nx >> 4),
+                                          self.z + (nz >> 4))
+                    if chunk is None:
+                        continue
 
-                # Update the mask.
-                for x, z in XZ:
-                    offset = x * 16 + z
-                    block = section.get_block((x, y, z))
-                    mask[offset] = blocks[block].dim
+                    spill = chunk.heightmap[(nx & 0xf) * 16 + (nz & 0xf)]
 
-                # Apply the mask to the lights.
-                for i, dim in enumerate(mask):
-                    # Keep it positive.
-                    lights[i] = max(0, lights[i] - dim)
+                    wx = chunk.x * 16 + (nx & 0xf)
+                    wz = chunk.z * 16 + (nz & 0xf)
+                    for y in range(chunk._lit_bottom(nx & 0xf, nz & 0xf),
+                                   min(height, CHUNK_HEIGHT - 1) + 1):
+                        engine.increase.append((wx, y, wz))
 
-                # Apply the lights to the section.
-                for x, z in XZ:
-                    offset = x * 16 + z
-                    section.set_skylight((x, y, z), lights[offset])
+                wx = self.x * 16 + x
+                wz = self.z * 16 + z
+                for y in range(bottom, min(spill, CHUNK_HEIGHT - 1) + 1):
+                    engine.increase.append((wx, y, wz))
 
-                # XXX blur the lights
+        self._spread_light(engine)
 
-                # And continue moving downward.
+    def _lit_bottom(self, x, z):
+        """
+        Find the lowest block in a column which is lit straight from the sky
+        with enough light to spread.
+        """
+
+        height = self.heightmap[x * 16 + z]
+        y = height
+        while y >= 0 and self.get_skylight((x, y, z)) > 1:
+            y -= 1
+        return y + 1
 
     def regenerate(self):
         """
@@ -444,6 +592,31 @@ class Chunk(object):
     def save_to_packet(self):
         """
         Generate a chunk packet.
+
+        Packets are cached until the chunk changes, so that many players
+        loading the same chunk only cost one packet build and compression.
+        """
+
+        packet = self.cached_packet()
+        if packet is None:
+            Chunk.packet_misses += 1
+            packet = self._packet = self.build_packet()
+        return packet
+
+    def build_packet(self):
+        """
+        Build a fresh chunk packet, bypassing the cache.
+        """
+
+        mask, data = self.packet_data()
+        return make_chunk_packet(self.x, self.z, mask, data)
+
+    def packet_data(self):
+        """
+        Gather this chunk's data for a chunk packet, without compressing it.
+
+        :returns: tuple of the bitmask of sections included, and the
+            uncompressed data
         """
 
         mask = 0
@@ -452,13 +625,13 @@ class Chunk(object):
         ls = segment_array(self.blocklight)
 
         for i, section in enumerate(self.sections):
-            if any(section.blocks):
+            if section:
                 mask |= 1 << i
-                packed.append(section.blocks.tostring())
+                packed.append(section.block_string())
 
         for i, section in enumerate(self.sections):
             if mask & 1 << i:
-                packed.append(pack_nibbles(section.metadata))
+                packed.append(section.metadata_nibbles())
 
         for i, l in enumerate(ls):
             if mask & 1 << i:
@@ -471,9 +644,7 @@ class Chunk(object):
         # Fake the biome data.
         packed.append("\x00" * 256)
 
-        packet = make_packet("chunk", x=self.x, z=self.z, continuous=True,
-                primary=mask, add=0x0, data="".join(packed))
-        return packet
+        return mask, "".join(packed)
 
     @check_bounds
     def get_block(self, coords):
@@ -490,6 +661,101 @@ class Chunk(object):
 
         return self.sections[index].get_block((x, y, z))
 
+    def get_block_index(self, i):
+        """
+        Look up a block value by index, without checking bounds.
+
+        Indices run in YZX order through the whole chunk, so the index for
+        some coordinates is ``si(x, y, z)``. This is meant for callers which
+        have already made sure that their coordinates are inside the chunk.
+
+        :param int i: index
+        :rtype: int
+        :returns: int representing block type
+        """
+
+        return self.sections[i >> 12].get_block_index(i & 0xfff)
+
+    def get_column(self, x, z):
+        """
+        Look up an xz-column of blocks, without checking bounds.
+
+        :param int x: X coordinate
+        :param int z: Z coordinate
+        :rtype: array
+        :returns: the blocks in the column, from the bottom up
+        """
+
+        column = array("B")
+        for section in self.sections:
+            column.extend(section.get_column(x, z))
+        return column
+
+    def get_slice(self, y):
+        """
+        Look up a horizontal layer of blocks, without checking bounds.
+
+        :param int y: Y coordinate
+        :rtype: array
+        :returns: the blocks in the layer, indexed by ``z * 16 + x``
+        """
+
+        return self.sections[y >> 4].get_layer(y & 0xf)
+
+    def get_blocks(self, lower, upper):
+        """
+        Look up a box of blocks.
+
+        The box includes ``lower`` and excludes ``upper``, and must lie
+        within the chunk.
+
+        :param tuple lower: coordinate triplet
+        :param tuple upper: coordinate triplet
+        :rtype: str
+        :returns: block types, one per byte, in YZX order
+        """
+
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+
+        return "".join(section.get_blocks((x1, sy1, z1), (x2, sy2, z2))
+                       for section, sy1, sy2 in self._sections_in(y1, y2))
+
+    def any_solid(self, lower, upper, passable=nonsolid_bytes):
+        """
+        Check whether a box contains any solid blocks.
+
+        The box includes ``lower`` and excludes ``upper``, and must lie
+        within the chunk.
+
+        :param tuple lower: coordinate triplet
+        :param tuple upper: coordinate triplet
+        :param str passable: the blocks which don't count as solid, one per
+            byte; defaults to the non-solid blocks
+        :rtype: bool
+        """
+
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+
+        for section, sy1, sy2 in self._sections_in(y1, y2):
+            box = section.get_blocks((x1, sy1, z1), (x2, sy2, z2))
+            if box.translate(None, passable):
+                return True
+
+        return False
+
+    def _sections_in(self, y1, y2):
+        """
+        Yield the sections overlapping a range of heights, along with the
+        part of the range inside each section.
+        """
+
+        for index in xrange(y1 // 16, (y2 + 15) // 16):
+            base = index * 16
+            yield (self.sections[index], max(y1 - base, 0),
+                   min(y2 - base, 16))
+
     @check_bounds
     def set_block(self, coords, block):
         """
@@ -504,10 +770,14 @@ class Chunk(object):
 
         column = x * 16 + z
 
-        if self.get_block(coords) != block:
-            self.sections[index].set_block((x, section_y, z), block)
+        section = self.sections[index]
+
+        if section.get_block_index(si(x, section_y, z)) != block:
+            self.unshare(index).set_block((x, section_y, z), block)
+            self.invalidate_packet()
 
             if not self.populated:
+                self._trim(index)
                 return
 
             # Regenerate heightmap at this coordinate.
@@ -516,24 +786,18 @@ class Chunk(object):
             else:
                 # If we replace the highest block with air, we need to go
                 # through all blocks below it to find the new top block.
-                height = self.heightmap[column]
-                if y == height:
-                    for y in range(height, -1, -1):
-                        if self.get_block((x, y, z)):
-                            break
-                    self.heightmap[column] = y
-
-            # Do the blocklight at this coordinate, if appropriate.
-            if block in glowing_blocks:
-                composite_glow(self.blocklight, glowing_blocks[block],
-                    x, y, z)
-                bl = [clamp(light, 0, 15) for light in self.blocklight]
-                self.blocklight = array("B", bl)
-
-            # And the skylight.
-            glow = max(self.get_skylight((nx, ny, nz))
-                       for nx, nz, ny in iter_neighbors((x, z, y)))
-            self.set_skylight((x, y, z), neighboring_light(glow, block))
+                if y == self.heightmap[column]:
+                    below = self.get_column(x, z)[:y].tostring()
+                    self.heightmap[column] = max(len(below.rstrip("\x00")) - 1,
+                                                 0)
+
+            # Relight this coordinate, and anything lit through it.
+            for engine in (BlockLight(self.neighbor),
+                           SkyLight(self.neighbor)):
+                engine.update(self.x * 16 + x, y, self.z * 16 + z)
+                self._spread_light(engine)
+
+            self._trim(index)
 
             self.dirty = True
             self.damage(coords)
@@ -565,7 +829,8 @@ class Chunk(object):
             x, y, z = coords
             index, y = divmod(y, 16)
 
-            self.sections[index].set_metadata((x, y, z), metadata)
+            self.unshare(index).set_metadata((x, y, z), metadata)
+            self.invalidate_packet()
 
             self.dirty = True
             self.damage(coords)
@@ -593,11 +858,12 @@ class Chunk(object):
         :param int metadata:
         """
 
-        if self.get_metadata(coords) != value:
+        if self.get_skylight(coords) != value:
             x, y, z = coords
             index, y = divmod(y, 16)
 
-            self.sections[index].set_skylight((x, y, z), value)
+            self.unshare(index).set_skylight((x, y, z), value)
+            self.invalidate_packet()
 
     @check_bounds
     def destroy(self, coords):
@@ -641,9 +907,12 @@ class Chunk(object):
         :param int replace: block to use as a replacement
         """
 
-        for section in self.sections:
-            for i, block in enumerate(section.blocks):
-                if block == search:
-                    section.blocks[i] = replace
-                    self.all_damaged = True
-                    self.dirty = True
+        for index, section in enumerate(self.sections):
+            if search not in section:
+                continue
+
+            self.unshare(index).sed(search, replace)
+
+            self.all_damaged = True
+            self.dirty = True
+            self.invalidate_packet()
@@ -1,6 +1,5 @@
 from random import uniform
 
-from twisted.internet.task import LoopingCall
 from twisted.python import log
 
 from bravo.inventory import Inventory
@@ -211,7 +210,6 @@ class Mob(Entity):
         This method calls super().
         """
 
-        self.loop = None
         super(Mob, self).__init__(**kwargs)
         self.manager = None
 
@@ -229,15 +227,17 @@ class Mob(Entity):
 
     def run(self):
         """
-        Start this mob's update loop.
+        Start this mob's updates.
         """
 
-        # Save the current chunk coordinates of this mob. They will be used to
-        # track which chunk this mob belongs to.
-        self.chunk_coords = self.location.pos
+        self.manager.world.scheduler.schedule("mobs", self.update)
 
-        self.loop = LoopingCall(self.update)
-        self.loop.start(.2)
+    def stop(self):
+        """
+        Stop this mob's updates.
+        """
+
+        self.manager.world.scheduler.unschedule("mobs", self.update)
 
     def save_to_packet(self):
         """
@@ -584,7 +584,6 @@ class Furnace(Tile):
         super(Furnace, self).__init__(*args, **kwargs)
 
         self.inventory = FurnaceStorage()
-        self.burning = LoopingCall.withCount(self.burn)
 
     def changed(self, factory, coords):
         '''
@@ -612,12 +611,27 @@ class Furnace(Tile):
                 # usually means that the furnace was serialized while burning.
                 self.running = True
                 self.burn_max = self.burntime
-                self.burning.start(0.5)
+                self.start()
             elif self.has_fuel() and self.can_craft():
                 # This furnace could be burning, but isn't. Let's start it!
                 self.burntime = 0
                 self.cooktime = 0
-                self.burning.start(0.5)
+                self.start()
+
+    def start(self):
+        """
+        Start burning, every half second.
+        """
+
+        self.factory.world.scheduler.schedule("furnaces", self.burn,
+                                              count=True, now=True)
+
+    def stop(self):
+        """
+        Stop burning.
+        """
+
+        self.factory.world.scheduler.unschedule("furnaces", self.burn)
 
     def burn(self, ticks):
         '''
@@ -672,7 +686,7 @@ class Furnace(Tile):
                     update_all_windows_slot(self.factory, self.coords, 1, self.inventory.fuel[0])
                 else:
                     # We're finished burning. Turn ourselves off.
-                    self.burning.stop()
+                    self.stop()
                     self.running = False
                     furnace_on_off(self.factory, self.coords, False)
 
@@ -1,4 +1,7 @@
 from array import array
+from string import maketrans
+
+from bravo.utilities.bits import pack_nibbles, unpack_nibbles
 
 
 def si(x, y, z):
@@ -11,21 +14,188 @@ def si(x, y, z):
     return (y * 16 + z) * 16 + x
 
 
+class FrozenArray(array):
+    """
+    An array which can't be changed in place.
+    """
+
+    def _frozen(self, *args):
+        raise TypeError("Frozen arrays can't be changed")
+
+    __setitem__ = __setslice__ = __delitem__ = __delslice__ = _frozen
+    __iadd__ = __imul__ = _frozen
+    append = extend = fromlist = fromstring = insert = _frozen
+    byteswap = pop = remove = reverse = _frozen
+
+
 class Section(object):
     """
     A section of geometry.
     """
 
+    occupied = 0
+    """
+    The number of blocks in this section which aren't air.
+
+    ``set_block()`` keeps this up to date. Code which changes ``blocks``
+    directly must call ``recount()`` afterwards.
+    """
+
+    shaded = 0
+    """
+    The number of blocks in this section with less than full skylight.
+
+    ``set_skylight()`` and ``set_skylight_index()`` keep this up to date.
+    Code which changes ``skylight`` directly must call ``recount()``
+    afterwards.
+    """
+
+    shared = False
+    """
+    Whether this section is shared between chunks, and must not be changed.
+    """
+
     def __init__(self):
         self.blocks = array("B", [0] * (16 * 16 * 16))
         self.metadata = array("B", [0] * (16 * 16 * 16))
         self.skylight = array("B", [0xf] * (16 * 16 * 16))
 
+    def __nonzero__(self):
+        """
+        Sections are true if they have any blocks other than air in them.
+        """
+
+        return bool(self.occupied)
+
+    def __contains__(self, block):
+        """
+        Check whether a kind of block is anywhere in this section.
+        """
+
+        return block in self.blocks
+
+    def is_blank(self):
+        """
+        Whether this section is nothing but air in full sunlight, like a
+        freshly made section.
+
+        Blank sections don't need to be kept, since they can be replaced
+        with ``empty_section``.
+        """
+
+        return not (self.occupied or self.shaded)
+
+    def pack(self):
+        """
+        Pack this section into a ``PackedSection``, if it has few enough
+        kinds of blocks in it.
+
+        :returns: the packed section, or None
+        """
+
+        blocks = self.blocks.tostring()
+        kinds = "".join(sorted(set(blocks)))
+        if len(kinds) > 16:
+            return None
+
+        section = PackedSection.__new__(PackedSection)
+        section.palette = [ord(kind) for kind in kinds]
+        table = maketrans(kinds, "".join(chr(i) for i in range(len(kinds))))
+        section.indices = array("B", pack_nibbles(blocks.translate(table)))
+        section.packed_metadata = array("B", pack_nibbles(self.metadata))
+        section.skylight = self.skylight[:]
+        section.occupied = self.occupied
+        section.shaded = self.shaded
+        return section
+
+    def recount(self):
+        """
+        Count the blocks in this section which aren't air, and which aren't
+        in full sunlight, again.
+        """
+
+        self.occupied = len(self.blocks) - self.blocks.count(0)
+        self.shaded = len(self.skylight) - self.skylight.count(0xf)
+
+    def copy(self):
+        """
+        Make a copy of this section which can be changed.
+        """
+
+        section = Section.__new__(Section)
+        section.blocks = self.blocks[:]
+        section.metadata = self.metadata[:]
+        section.skylight = self.skylight[:]
+        section.occupied = self.occupied
+        section.shaded = self.shaded
+        return section
+
     def get_block(self, coords):
         return self.blocks[si(*coords)]
 
+    def get_block_index(self, i):
+        return self.blocks[i]
+
     def set_block(self, coords, block):
-        self.blocks[si(*coords)] = block
+        i = si(*coords)
+        old = self.blocks[i]
+        self.blocks[i] = block
+
+        if not old:
+            if block:
+                self.occupied += 1
+        elif not block:
+            self.occupied -= 1
+
+    def get_blocks(self, lower, upper):
+        """
+        Get a box of blocks, as a string in section order.
+
+        The box includes its lower corner and excludes its upper corner.
+        """
+
+        return get_box(self.blocks, lower, upper)
+
+    def get_layer(self, y):
+        """
+        Get a horizontal layer of blocks.
+
+        :returns: array of blocks, indexed by ``z * 16 + x``
+        """
+
+        return self.blocks[y * 256:y * 256 + 256]
+
+    def get_column(self, x, z):
+        """
+        Get an xz-column of blocks.
+
+        :returns: array of blocks, from the bottom up
+        """
+
+        return self.blocks[z * 16 + x::256]
+
+    def sed(self, search, replace):
+        """
+        Replace every block of one kind with another.
+        """
+
+        table = maketrans(chr(search), chr(replace))
+        self.blocks = array("B", self.blocks.tostring().translate(table))
+        self.recount()
+
+    def block_string(self):
+        """
+        Get all of the blocks in this section, as a string in section order.
+        """
+
+        return self.blocks.tostring()
+
+    def metadata_nibbles(self):
+        """
+        Get all of the metadata in this section, packed into nibbles.
+        """
+
+        return pack_nibbles(self.metadata)
 
     def get_metadata(self, coords):
         return self.metadata[si(*coords)]
@@ -37,4 +207,197 @@ class Section(object):
         return self.skylight[si(*coords)]
 
     def set_skylight(self, coords, value):
-        self.skylight[si(*coords)] = value
+        self.set_skylight_index(si(*coords), value)
+
+    def set_skylight_index(self, i, value):
+        old = self.skylight[i]
+        self.skylight[i] = value
+
+        if old == 0xf:
+            if value != 0xf:
+                self.shaded += 1
+        elif value == 0xf:
+            self.shaded -= 1
+
+
+class PackedSection(Section):
+    """
+    A section of geometry which keeps its blocks in a palette.
+
+    Most sections only have a handful of kinds of blocks in them. Packed
+    sections keep up to sixteen kinds of blocks in a palette, and each block
+    as a nibble indexing the palette. Metadata is packed into nibbles too,
+    so blocks and metadata take half as much room. Skylight is left alone.
+
+    Packed sections have the same interface as sections, and reading or
+    changing them through it leaves them packed. Putting a seventeenth kind
+    of block into one, or touching its ``blocks`` or ``metadata`` arrays,
+    unpacks it back into a plain ``Section`` in place.
+    """
+
+    @property
+    def blocks(self):
+        self.unpack()
+        return self.blocks
+
+    @property
+    def metadata(self):
+        self.unpack()
+        return self.metadata
+
+    def unpack(self):
+        """
+        Turn this section back into a plain ``Section``.
+        """
+
+        blocks = array("B", self.block_string())
+        metadata = unpack_nibbles(self.packed_metadata)
+
+        del self.palette, self.indices, self.packed_metadata
+
+        # The arrays can only be set once the properties above are gone.
+        self.__class__ = Section
+        self.blocks = blocks
+        self.metadata = metadata
+
+    def pack(self):
+        return self
+
+    def __contains__(self, block):
+        # The palette can still have kinds of blocks which were overwritten.
+        return (block in self.palette and
+                chr(block) in self.block_string())
+
+    def recount(self):
+        self.occupied = 16 * 16 * 16 - self.block_string().count("\x00")
+        self.shaded = len(self.skylight) - self.skylight.count(0xf)
+
+    def get_block(self, coords):
+        return self.get_block_index(si(*coords))
+
+    def get_block_index(self, i):
+        packed = self.indices[i >> 1]
+        return self.palette[packed >> 4 if i & 1 else packed & 0xf]
+
+    def set_block(self, coords, block):
+        i = si(*coords)
+        old = self.get_block_index(i)
+        if old == block:
+            return
+
+        palette = self.palette
+        if block in palette:
+            index = palette.index(block)
+        elif len(palette) < 16:
+            index = len(palette)
+            palette.append(block)
+        else:
+            self.unpack()
+            self.set_block(coords, block)
+            return
+
+        packed = self.indices[i >> 1]
+        if i & 1:
+            self.indices[i >> 1] = packed & 0xf | index << 4
+        else:
+            self.indices[i >> 1] = packed & 0xf0 | index
+
+        if not old:
+            self.occupied += 1
+        elif not block:
+            self.occupied -= 1
+
+    def get_blocks(self, lower, upper):
+        return get_box(array("B", self.block_string()), lower, upper)
+
+    def get_layer(self, y):
+        return array("B", self._decode(self.indices[y * 128:y * 128 + 128]))
+
+    def get_column(self, x, z):
+        offset = z * 16 + x
+        palette = self.palette
+        if offset & 1:
+            column = [palette[packed >> 4]
+                      for packed in self.indices[offset >> 1::128]]
+        else:
+            column = [palette[packed & 0xf]
+                      for packed in self.indices[offset >> 1::128]]
+        return array("B", column)
+
+    def sed(self, search, replace):
+        # Only the palette needs changing. Repeated kinds of blocks in the
+        # palette are harmless.
+        self.palette = [replace if block == search else block
+                        for block in self.palette]
+        self.recount()
+
+    def block_string(self):
+        return self._decode(self.indices)
+
+    def _decode(self, indices):
+        """
+        Turn packed indices into a string of blocks.
+        """
+
+        table = "".join(chr(block) for block in self.palette).ljust(256,
+                                                                    "\x00")
+        return unpack_nibbles(indices).tostring().translate(table)
+
+    def metadata_nibbles(self):
+        return self.packed_metadata.tostring()
+
+    def get_metadata(self, coords):
+        i = si(*coords)
+        packed = self.packed_metadata[i >> 1]
+        return packed >> 4 if i & 1 else packed & 0xf
+
+    def set_metadata(self, coords, metadata):
+        i = si(*coords)
+        packed = self.packed_metadata[i >> 1]
+        if i & 1:
+            packed = packed & 0xf | (metadata & 0xf) << 4
+        else:
+            packed = packed & 0xf0 | metadata & 0xf
+        self.packed_metadata[i >> 1] = packed
+
+
+def get_box(blocks, lower, upper):
+    """
+    Get a box out of an array of blocks in section order, as a string in
+    section order.
+
+    The box includes its lower corner and excludes its upper corner.
+    Boxes which span whole rows or layers are sliced out in one go.
+    """
+
+    x1, y1, z1 = lower
+    x2, y2, z2 = upper
+
+    if x1 == 0 and x2 == 16:
+        if z1 == 0 and z2 == 16:
+            return blocks[si(0, y1, 0):si(0, y2, 0)].tostring()
+        rows = [blocks[si(0, y, z1):si(0, y, z2)]
+                for y in xrange(y1, y2)]
+    else:
+        rows = [blocks[si(x1, y, z):si(x2, y, z)]
+                for y in xrange(y1, y2) for z in xrange(z1, z2)]
+
+    return "".join(row.tostring() for row in rows)
+
+
+def _make_empty_section():
+    section = Section()
+    section.blocks = FrozenArray("B", section.blocks)
+    section.metadata = FrozenArray("B", section.metadata)
+    section.skylight = FrozenArray("B", section.skylight)
+    section.shared = True
+    return section
+
+empty_section = _make_empty_section()
+"""
+A section of nothing but air in full sunlight, shared by every chunk which
+hasn't got anything in that section yet.
+
+Its arrays can't be changed. Chunks copy it before writing to it; see
+``Chunk.unshare()``.
+"""
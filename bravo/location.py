@@ -122,6 +122,14 @@ class Location(object):
     The position and orientation of an entity.
     """
 
+    tracker = None
+    """
+    Optional object with a ``moved()`` method, to be called with this
+    location whenever its position changes.
+
+    Trackers are not copied along with locations.
+    """
+
     def __init__(self):
         # Position in pixels.
         self.pos = Position(0, 0, 0)
@@ -135,6 +143,21 @@ class Location(object):
         # Whether we are in the air.
         self.grounded = False
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("tracker", None)
+        return state
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        self._pos = value
+        if self.tracker is not None:
+            self.tracker.moved(self)
+
     @classmethod
     def at_block(cls, x, y, z):
         """
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
+from collections import defaultdict
 from sys import maxint
 
 from bravo.errors import ChunkNotLoaded
+from bravo.location import Position
 from bravo.simplex import dot3
 
 class MobManager(object):
@@ -9,18 +11,108 @@ class MobManager(object):
     """
     Provides an interface for outside sources to manage mobs, and mobs to
     contact outside sources
+
+    Mobs only run while some player has their chunk loaded; nobody would see
+    them anyway. Mobs in other chunks are put to sleep, and woken up when a
+    player loads their chunk again.
     """
 
+    world = None
+
+    def __init__(self):
+        # Managed mobs, by chunk coordinates.
+        self.mobs = defaultdict(set)
+
+        self.sleeping = set()
+
+    def watched(self, coords):
+        """
+        Whether any player has a chunk loaded.
+
+        :param tuple coords: chunk coordinates
+        """
+
+        factory = self.world.factory
+        if factory is None:
+            return False
+        return bool(factory.protocols_for_chunk(*coords))
+
     def start_mob(self, mob):
         """
         Add a mob to this manager, and start it.
 
         This is here to mainly provide a uniform way for outside sources to
         start mobs.
+
+        Mobs in chunks which nobody has loaded start out asleep.
         """
 
         mob.manager = self
-        mob.run()
+        mob.chunk_coords = mob.location.pos.to_chunk()
+        self.mobs[mob.chunk_coords].add(mob)
+
+        if self.watched(mob.chunk_coords):
+            mob.run()
+        else:
+            self.sleeping.add(mob)
+
+    def stop_mob(self, mob):
+        """
+        Stop a mob which was started by this manager, and forget about it.
+        """
+
+        mobs = self.mobs.get(mob.chunk_coords)
+        if mobs is not None:
+            mobs.discard(mob)
+            if not mobs:
+                del self.mobs[mob.chunk_coords]
+
+        if mob in self.sleeping:
+            self.sleeping.discard(mob)
+        else:
+            mob.stop()
+
+    def sleep_mob(self, mob):
+        if mob not in self.sleeping:
+            mob.stop()
+            self.sleeping.add(mob)
+
+    def wake_mob(self, mob):
+        if mob in self.sleeping:
+            self.sleeping.discard(mob)
+            mob.run()
+
+    def sleep_chunk(self, x, z):
+        """
+        Put all of the mobs in a chunk to sleep.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        for mob in self.mobs.get((x, z), ()):
+            self.sleep_mob(mob)
+
+    def wake_chunk(self, x, z):
+        """
+        Wake up all of the mobs in a chunk.
+
+        `x` and `z` are chunk coordinates, not block coordinates.
+        """
+
+        for mob in self.mobs.get((x, z), ()):
+            self.wake_mob(mob)
+
+    def stats(self):
+        """
+        Get a summary of the managed mobs.
+
+        :returns: dict of statistics
+        """
+
+        return {
+            "mobs": sum(len(mobs) for mobs in self.mobs.itervalues()),
+            "sleeping": len(self.sleeping),
+        }
 
     def closest_player(self, position, threshold=maxint):
         """
@@ -29,32 +121,25 @@ class MobManager(object):
         Returns None if no players were found within the threshold.
         """
 
-        closest = None
-
-        # Loop through all players. Check each one's distance, and adjust our
-        # idea of "closest".
-        for player in self.world.factory.protocols.itervalues():
-            distance = position.distance(player.location.pos)
-            if distance < threshold:
-                threshold = distance
-                closest = player
-
-        return closest
+        # Distances are whole pixels, and the threshold is exclusive.
+        closest = self.world.player_index.nearest(position, 1, threshold - 1)
+        return closest[0] if closest else None
 
     def check_block_collision(self, position, minvec, maxvec):
-        min_point = position + minvec
-        max_point = position + maxvec
+        """
+        Check whether a box around a position is clear of blocks.
 
-        min_block = min_point.to_block()
-        max_block = max_point.to_block()
+        The corners of the box are given in pixels, relative to the position.
+        Any block other than air is in the way. The whole box is checked with
+        a single query per chunk section.
 
-        for x in xrange(min_block[0],max_block[0]):
-            for y in xrange(min_block[1],max_block[1]):
-                for z in xrange(min_block[2],max_block[2]):
-                    if self.world.sync_get_block((x,y,z)):
-                        return False
+        :returns: whether the box is clear
+        """
 
-        return True
+        lower = (position + Position(*minvec)).to_block()
+        upper = (position + Position(*maxvec)).to_block()
+
+        return not self.world.sync_any_solid(lower, upper, passable="\x00")
 
     def calculate_slide(vector,normal):
         dot = dot3(vector,normal)
@@ -68,17 +153,34 @@ class MobManager(object):
 
         As entities move, the chunk they reside in may not match up with their
         location. This method will correctly reassign the mob to its chunk.
+
+        Mobs which wander off into chunks that nobody has loaded go to sleep.
         """
 
+        coords = mob.location.pos.to_chunk()
+        if coords == mob.chunk_coords:
+            return
+
         try:
-            old = self.world.sync_request_chunk(mob.chunk_coords)
-            new = self.world.sync_request_chunk(mob.location.pos)
+            old = self.world.sync_request_chunk((mob.chunk_coords[0] * 16, 0,
+                                                 mob.chunk_coords[1] * 16))
+            new = self.world.sync_request_chunk((coords[0] * 16, 0,
+                                                 coords[1] * 16))
         except ChunkNotLoaded:
             pass
         else:
             new.entities.add(mob)
             old.entities.discard(mob)
 
+            self.mobs[mob.chunk_coords].discard(mob)
+            if not self.mobs[mob.chunk_coords]:
+                del self.mobs[mob.chunk_coords]
+            self.mobs[coords].add(mob)
+            mob.chunk_coords = coords
+
+            if not self.watched(coords):
+                self.sleep_mob(mob)
+
     def broadcast(self, packet):
         """
         Broadcasts a packet to factories
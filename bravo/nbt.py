@@ -1,5 +1,6 @@
 from struct import Struct, error as StructError
 from gzip import GzipFile
+from StringIO import StringIO
 from UserDict import DictMixin
 
 from bravo.errors import MalformedFileError
@@ -335,6 +336,351 @@ class NBTFile(TAG_Compound):
         if filename and 'close' in dir(self.file):
             self.file.close()
 
+# Fast, lazy parsing of NBT data which is already in memory. Instead of
+# building a TAG_* object for every value, compounds are indexed by name, and
+# values are only unpacked when they are looked up.
+
+_list_header = Struct(">bi")
+_array_length = Struct(">i")
+_string_length = Struct(">h")
+
+_numeric_formats = {
+    TAG_BYTE: TAG_Byte.fmt,
+    TAG_SHORT: TAG_Short.fmt,
+    TAG_INT: TAG_Int.fmt,
+    TAG_LONG: TAG_Long.fmt,
+    TAG_FLOAT: TAG_Float.fmt,
+    TAG_DOUBLE: TAG_Double.fmt,
+}
+
+_numeric_sizes = dict((k, v.size) for k, v in _numeric_formats.iteritems())
+
+def _skip_payload(data, type, offset):
+    """
+    Find the end of the payload of a tag, without unpacking it.
+    """
+
+    if type in _numeric_sizes:
+        return offset + _numeric_sizes[type]
+    elif type == TAG_BYTE_ARRAY:
+        return offset + 4 + _array_length.unpack_from(data, offset)[0]
+    elif type == TAG_STRING:
+        return offset + 2 + _string_length.unpack_from(data, offset)[0]
+    elif type == TAG_LIST:
+        type, length = _list_header.unpack_from(data, offset)
+        offset += 5
+        if type in _numeric_sizes:
+            return offset + length * _numeric_sizes[type]
+        for i in xrange(length):
+            offset = _skip_payload(data, type, offset)
+        return offset
+    elif type == TAG_COMPOUND:
+        return LazyCompound(data, offset).end
+
+    raise MalformedFileError("Unrecognised tag type %r" % type)
+
+def _read_payload(data, type, offset):
+    """
+    Unpack the payload of a tag into a native Python value.
+    """
+
+    if type in _numeric_formats:
+        return _numeric_formats[type].unpack_from(data, offset)[0]
+    elif type == TAG_BYTE_ARRAY:
+        length = _array_length.unpack_from(data, offset)[0]
+        return buffer(data, offset + 4, length)
+    elif type == TAG_STRING:
+        length = _string_length.unpack_from(data, offset)[0]
+        return unicode(data[offset + 2:offset + 2 + length], "utf-8")
+    elif type == TAG_LIST:
+        type, length = _list_header.unpack_from(data, offset)
+        offset += 5
+        if type in _numeric_formats:
+            fmt = _numeric_formats[type]
+            return [fmt.unpack_from(data, offset + i * fmt.size)[0]
+                    for i in xrange(length)]
+        values = []
+        for i in xrange(length):
+            values.append(_read_payload(data, type, offset))
+            offset = _skip_payload(data, type, offset)
+        return values
+    elif type == TAG_COMPOUND:
+        return LazyCompound(data, offset)
+
+    raise MalformedFileError("Unrecognised tag type %r" % type)
+
+def _read_compounds(data, offset):
+    """
+    Index a list of compounds.
+
+    :returns: a list of `LazyCompound`, or None if the list doesn't hold
+        compounds, and the end of the list
+    """
+
+    type, length = _list_header.unpack_from(data, offset)
+    if type != TAG_COMPOUND:
+        return None, _skip_payload(data, TAG_LIST, offset)
+
+    offset += 5
+    compounds = []
+    for i in xrange(length):
+        compound = LazyCompound(data, offset)
+        compounds.append(compound)
+        offset = compound.end
+    return compounds, offset
+
+class LazyCompound(object):
+    """
+    A compound tag which is parsed on demand.
+
+    The compound's entries are indexed by name when it is created, skipping
+    over their payloads. Nested compounds, and lists of compounds, have to be
+    walked to be skipped, so they are indexed along the way instead of being
+    walked again later.
+
+    Each payload is only unpacked when it is looked up: numbers and strings
+    become Python numbers and strings, lists become lists, compounds become
+    further lazy compounds, and byte arrays become ``buffer`` slices of the
+    original data, without being copied.
+    """
+
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+        self.entries = {}
+        self.indexed = {}
+
+        type = ord(data[offset])
+        while type != TAG_END:
+            length = _string_length.unpack_from(data, offset + 1)[0]
+            name = data[offset + 3:offset + 3 + length]
+            offset += 3 + length
+            self.entries[name] = type, offset
+
+            if type == TAG_COMPOUND:
+                compound = LazyCompound(data, offset)
+                self.indexed[name] = compound
+                offset = compound.end
+            elif type == TAG_LIST:
+                compounds, offset = _read_compounds(data, offset)
+                if compounds is not None:
+                    self.indexed[name] = compounds
+            else:
+                offset = _skip_payload(data, type, offset)
+
+            type = ord(data[offset])
+
+        self.end = offset + 1
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        if name in self.indexed:
+            value = self.indexed[name]
+            if isinstance(value, list):
+                value = value[:]
+            return value
+
+        type, offset = self.entries[name]
+        return _read_payload(self.data, type, offset)
+
+    def get(self, name, default=None):
+        if name in self.entries:
+            return self[name]
+        return default
+
+    def keys(self):
+        return self.entries.keys()
+
+    def tag(self, name):
+        """
+        Fully parse one of this compound's entries into TAG objects, for code
+        which still wants them.
+        """
+
+        type, offset = self.entries[name]
+        end = _skip_payload(self.data, type, offset)
+        tag = TAGLIST[type](buffer=StringIO(self.data[offset:end]))
+        tag.name = name
+        return tag
+
+    def __repr__(self):
+        return "<LazyCompound: %d entries>" % len(self.entries)
+
+def read_nbt(data):
+    """
+    Lazily parse uncompressed NBT data.
+
+    This is much faster than `NBTFile` when only some of the data is needed,
+    which is the case for chunks.
+
+    :param data: a ``str`` or ``buffer`` holding the NBT data
+    :returns: a `LazyCompound` for the root tag
+    :raises MalformedFileError: if the data is truncated or corrupt
+    """
+
+    data = buffer(data)
+
+    try:
+        if ord(data[0]) != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        length = _string_length.unpack_from(data, 1)[0]
+        compound = LazyCompound(data, 3 + length)
+    except (StructError, IndexError):
+        raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+    # Payloads at the end of the data might have been cut short without
+    # tripping over anything while skipping them.
+    if compound.end > len(data):
+        raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+    return compound
+
+# Fast writing of NBT data straight into a buffer, without building a tree of
+# TAG_* objects first.
+
+_tag_header = Struct(">bh")
+
+class NBTWriter(object):
+    """
+    A writer which renders NBT directly into a bytearray.
+
+    Tags are written one after another, in the order that they are added.
+    Compounds are opened with `compound()` and must be closed with `end()`;
+    lists are opened with `list()`, after which exactly as many payloads as
+    promised must be written, using the ``payload`` methods for compounds
+    and the other methods with ``name=None``.
+
+    The output is exactly what `NBTFile.write_file()` would produce for the
+    same tree.
+    """
+
+    def __init__(self, size=4096):
+        """
+        :param int size: the expected size of the output; the buffer grows
+            if more is written, but preallocating avoids copying
+        """
+
+        self.data = bytearray(size)
+        self.offset = 0
+
+    def _reserve(self, size):
+        needed = self.offset + size - len(self.data)
+        if needed > 0:
+            self.data.extend("\x00" * max(needed, len(self.data)))
+
+    def _header(self, type, name):
+        if name is None:
+            return
+
+        name = name.encode("utf-8")
+        self._reserve(3 + len(name))
+        _tag_header.pack_into(self.data, self.offset, type, len(name))
+        self.offset += 3
+        self.data[self.offset:self.offset + len(name)] = name
+        self.offset += len(name)
+
+    def _numeric(self, type, name, value):
+        self._header(type, name)
+        fmt = _numeric_formats[type]
+        self._reserve(fmt.size)
+        fmt.pack_into(self.data, self.offset, value)
+        self.offset += fmt.size
+
+    def byte(self, name, value):
+        self._numeric(TAG_BYTE, name, value)
+
+    def short(self, name, value):
+        self._numeric(TAG_SHORT, name, value)
+
+    def int(self, name, value):
+        self._numeric(TAG_INT, name, value)
+
+    def long(self, name, value):
+        self._numeric(TAG_LONG, name, value)
+
+    def float(self, name, value):
+        self._numeric(TAG_FLOAT, name, value)
+
+    def double(self, name, value):
+        self._numeric(TAG_DOUBLE, name, value)
+
+    def byte_array(self, name, value):
+        """
+        Write a byte array.
+
+        :param value: a ``str``, ``buffer``, or ``array`` of unsigned bytes
+        """
+
+        self._header(TAG_BYTE_ARRAY, name)
+
+        # Arrays would be copied into the bytearray one item at a time;
+        # buffers of them are copied all at once.
+        if not isinstance(value, str):
+            value = buffer(value)
+
+        length = len(value)
+        self._reserve(4 + length)
+        _array_length.pack_into(self.data, self.offset, length)
+        self.offset += 4
+        self.data[self.offset:self.offset + length] = value
+        self.offset += length
+
+    def string(self, name, value):
+        self._header(TAG_STRING, name)
+        value = value.encode("utf-8")
+        self._reserve(2 + len(value))
+        _string_length.pack_into(self.data, self.offset, len(value))
+        self.offset += 2
+        self.data[self.offset:self.offset + len(value)] = value
+        self.offset += len(value)
+
+    def list(self, name, type, length):
+        """
+        Start a list of ``length`` payloads of the given tag type.
+        """
+
+        self._header(TAG_LIST, name)
+        self._reserve(5)
+        _list_header.pack_into(self.data, self.offset, type, length)
+        self.offset += 5
+
+    def compound(self, name=None):
+        """
+        Start a compound. Leave out the name for compounds inside lists.
+        """
+
+        self._header(TAG_COMPOUND, name)
+
+    def end(self):
+        """
+        Close the innermost open compound.
+        """
+
+        self._reserve(1)
+        self.data[self.offset] = TAG_END
+        self.offset += 1
+
+    def payload(self, tag):
+        """
+        Write the payload of an existing tag, such as an entry in a list.
+        """
+
+        b = StringIO()
+        tag._render_buffer(b)
+        value = b.getvalue()
+        self._reserve(len(value))
+        self.data[self.offset:self.offset + len(value)] = value
+        self.offset += len(value)
+
+    def getvalue(self):
+        """
+        Get everything written so far, as a string.
+        """
+
+        return str(self.data[:self.offset])
+
 # Useful utility functions for handling large NBT structures elegantly and
 # Pythonically.
 
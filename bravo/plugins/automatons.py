@@ -96,15 +96,14 @@ class Grass(object):
 
         self.r = Random()
         self.tracked = deque()
-        self.loop = LoopingCall(self.process)
 
     def start(self):
-        if not self.loop.running:
-            self.loop.start(self.step, now=False)
+        scheduler = self.factory.world.scheduler
+        scheduler.add_subsystem(self.name, self.step)
+        scheduler.schedule(self.name, self.process)
 
     def stop(self):
-        if self.loop.running:
-            self.loop.stop()
+        self.factory.world.scheduler.unschedule(self.name, self.process)
 
     def process(self):
         if not self.tracked:
@@ -2,6 +2,8 @@ import json
 from textwrap import wrap
 
 from twisted.internet import reactor
+from twisted.python import log
+from twisted.python.failure import Failure
 from zope.interface import implements
 
 from bravo.beta.packets import make_packet
@@ -257,11 +259,17 @@ class Quit(object):
         self.factory.broadcast(packet)
 
         yield "Saving all chunks to disk..."
-        for chunk in self.factory.world._cache.iterdirty():
-            yield self.factory.world.save_chunk(chunk)
+        d = self.factory.world.flusher.flush_all()
 
         yield "Halting."
-        reactor.stop()
+
+        # Stop even if some chunks couldn't be saved; there's nothing more
+        # that can be done for them.
+        @d.addBoth
+        def stop(result):
+            if isinstance(result, Failure):
+                log.err(result, "Couldn't save all chunks")
+            reactor.stop()
 
     name = "quit"
     aliases = ("exit",)
@@ -278,12 +286,20 @@ class SaveAll(object):
         self.factory = factory
 
     def console_command(self, parameters):
-        yield "Flushing all chunks..."
+        flusher = self.factory.world.flusher
+        yield "Flushing %d chunks..." % flusher.backlog
+
+        d = flusher.flush_all()
+
+        @d.addCallback
+        def cb(count):
+            log.msg("Save complete! Flushed %d chunks." % count)
 
-        for chunk in self.factory.world._cache.iterdirty():
-            yield self.factory.world.save_chunk(chunk)
+        @d.addErrback
+        def eb(failure):
+            log.err(failure, "Couldn't save all chunks")
 
-        yield "Save complete!"
+        yield "Saving in the background; completion will be logged."
 
     name = "save-all"
     aliases = tuple()
@@ -1,5 +1,7 @@
 from __future__ import division
 from zope.interface import implements
+from bravo.beta.outbound import PacketQueue
+from bravo.chunk import Chunk
 from bravo.utilities.coords import polar_round_vector
 from bravo.ibravo import IConsoleCommand, IChatCommand
 
@@ -64,10 +66,38 @@ class Status(object):
             dirty = len([i for i in protocol.chunks.values() if i.dirty])
             yield "%s: %d chunks (%d dirty)" % (name, count, dirty)
 
-        chunk_count = 0 # len(self.factory.world.chunk_cache)
-        dirty = len(self.factory.world._cache._dirty)
-        chunk_count += dirty
-        yield "World cache: %d chunks (%d dirty)" % (chunk_count, dirty)
+        stats = self.factory.world._cache.stats()
+        yield "World cache: %d chunks (%d dirty), %d/%d recent (%d parked)" % (
+            stats["chunks"], stats["dirty"], stats["recent"], stats["size"],
+            stats["parked"])
+        yield "Cache: %d hits, %d misses, %d evictions" % (stats["hits"],
+            stats["misses"], stats["evictions"])
+
+        hits, misses = Chunk.packet_hits, Chunk.packet_misses
+        rate = 100 * hits / (hits + misses) if hits + misses else 0
+        yield "Chunk packets: %d hits, %d builds (%d%% hit rate)" % (hits,
+            misses, rate)
+
+        yield "Outbound packets: %d superseded, %d merged" % (
+            PacketQueue.superseded, PacketQueue.merged)
+
+        stats = self.factory.world.flusher.stats()
+        yield "Flusher: %d dirty, oldest %ds, last batch %d, %d saved" % (
+            stats["backlog"], stats["age"], stats["batch"], stats["flushed"])
+
+        stats = self.factory.world.mob_manager.stats()
+        yield "Mobs: %d awake, %d asleep" % (stats["mobs"] - stats["sleeping"],
+                                             stats["sleeping"])
+
+        stats = self.factory.world.scheduler.stats()
+        yield ("Ticks: %d run, %d skipped, %d overruns, last %.1fms, "
+               "longest %.1fms" % (stats["ticks"], stats["skipped"],
+                                   stats["overruns"], stats["duration"],
+                                   stats["longest"]))
+        for name, subsystem in sorted(stats["subsystems"].iteritems()):
+            yield "%s: %d scheduled, last %.1fms, %d deferred" % (name,
+                subsystem["tickables"], subsystem["duration"],
+                subsystem["deferred"])
 
     name = "status"
     aliases = tuple()
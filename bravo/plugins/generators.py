@@ -1,15 +1,16 @@
 from __future__ import division
 
 from array import array
-from itertools import combinations, product
+from itertools import combinations
 from random import Random
 
 from zope.interface import implements
 
 from bravo.blocks import blocks
-from bravo.chunk import CHUNK_HEIGHT, XZ, iterchunk
+from bravo.chunk import CHUNK_HEIGHT, XZ
 from bravo.ibravo import ITerrainGenerator
 from bravo.simplex import octaves2, octaves3, set_seed
+from bravo.utilities.coords import iterchunk
 from bravo.utilities.maths import morton2
 
 R = Random()
@@ -30,8 +31,10 @@ class BoringGenerator(object):
 
         # Optimized fill. Fill the bottom eight sections with stone.
         stone = array("B", [blocks["stone"].slot] * 16 * 16 * 16)
-        for section in chunk.sections[:8]:
+        for index in range(8):
+            section = chunk.unshare(index)
             section.blocks[:] = stone[:]
+            section.recount()
 
     name = "boring"
 
@@ -128,9 +131,13 @@ class WaterTableGenerator(object):
         Generate a flat water table halfway up the map.
         """
 
-        for x, z, y in product(xrange(16), xrange(16), xrange(62)):
-            if chunk.get_block((x, y, z)) == blocks["air"].slot:
-                chunk.set_block((x, y, z), blocks["spring"].slot)
+        air = blocks["air"].slot
+        spring = blocks["spring"].slot
+
+        for y in xrange(62):
+            for i, block in enumerate(chunk.get_slice(y)):
+                if block == air:
+                    chunk.set_block((i & 0xf, y, i >> 4), spring)
 
     name = "watertable"
 
@@ -406,8 +413,10 @@ class CaveGenerator(object):
             magx = (chunk.x * 16 + x) * xzfactor
             magz = (chunk.z * 16 + z) * xzfactor
 
+            column = chunk.get_column(x, z)
+
             for y in range(CHUNK_HEIGHT):
-                if not chunk.get_block((x, y, z)):
+                if not column[y]:
                     continue
 
                 magy = y * yfactor
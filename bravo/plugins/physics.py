@@ -1,7 +1,6 @@
 from itertools import chain
 
 from twisted.internet.defer import inlineCallbacks
-from twisted.internet.task import LoopingCall
 from zope.interface import implements
 
 from bravo.blocks import blocks
@@ -39,15 +38,13 @@ class Fluid(object):
         self.tracked = set()
         self.new = set()
 
-        self.loop = LoopingCall(self.process)
-
     def start(self):
-        if not self.loop.running:
-            self.loop.start(self.step)
+        scheduler = self.factory.world.scheduler
+        scheduler.add_subsystem(self.name, self.step)
+        scheduler.schedule(self.name, self.process, now=True)
 
     def stop(self):
-        if self.loop.running:
-            self.loop.stop()
+        self.factory.world.scheduler.unschedule(self.name, self.process)
 
     def schedule(self):
         if self.tracked:
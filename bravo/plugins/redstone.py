@@ -1,4 +1,3 @@
-from twisted.internet.task import LoopingCall
 from zope.interface import implements
 
 from bravo.blocks import blocks
@@ -45,15 +44,13 @@ class Redstone(object):
         self.asic = Asic()
         self.active_circuits = set()
 
-        self.loop = LoopingCall(self.process)
-
     def start(self):
-        if not self.loop.running:
-            self.loop.start(self.step)
+        scheduler = self.factory.world.scheduler
+        scheduler.add_subsystem(self.name, self.step)
+        scheduler.schedule(self.name, self.process, now=True)
 
     def stop(self):
-        if self.loop.running:
-            self.loop.stop()
+        self.factory.world.scheduler.unschedule(self.name, self.process)
 
     def schedule(self):
         if self.asic.circuits:
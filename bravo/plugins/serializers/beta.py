@@ -2,11 +2,14 @@ from __future__ import division
 
 from array import array
 import os
-from StringIO import StringIO
 from urlparse import urlparse
 
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock
+from twisted.internet.threads import deferToThreadPool
 from twisted.python import log
 from twisted.python.filepath import FilePath
+from twisted.python.threadpool import ThreadPool
 from zope.interface import implements
 
 from bravo.beta.structures import Level, Slot
@@ -16,10 +19,10 @@ from bravo.errors import SerializerReadException, SerializerWriteException
 from bravo.geometry.section import Section
 from bravo.ibravo import ISerializer
 from bravo.location import Location, Orientation, Position
-from bravo.nbt import NBTFile
+from bravo.nbt import NBTFile, NBTWriter, read_nbt, TAG_COMPOUND
 from bravo.nbt import TAG_Compound, TAG_List, TAG_Byte_Array, TAG_String
 from bravo.nbt import TAG_Double, TAG_Long, TAG_Short, TAG_Int, TAG_Byte
-from bravo.region import MissingChunk, Region
+from bravo.region import MissingChunk, RegionCache
 from bravo.utilities.bits import unpack_nibbles, pack_nibbles
 from bravo.utilities.paths import name_for_anvil
 
@@ -34,7 +37,19 @@ class Anvil(object):
 
     name = "anvil"
 
+    threadpool = None
+    """
+    The pool of threads used for chunk I/O, if any.
+
+    When no pool is running, chunks are loaded and saved synchronously.
+    """
+
     def __init__(self):
+        self._region_locks = {}
+
+        self._regions = RegionCache()
+        self._regions.busy = self._region_busy
+
         self._entity_loaders = {
             "Chicken": lambda entity, tag: None,
             "Cow": lambda entity, tag: None,
@@ -100,6 +115,80 @@ class Anvil(object):
     def _write_tag(self, fp, tag):
         tag.write_file(fileobj=fp.open("w"))
 
+    # Threaded I/O helpers.
+
+    def start_threads(self, size):
+        """
+        Start loading and saving chunks in a pool of threads.
+
+        :param int size: the largest number of threads to use
+        """
+
+        if self.threadpool is not None:
+            return
+
+        self.threadpool = ThreadPool(1, size, "anvil")
+        self.threadpool.start()
+
+    def stop_threads(self):
+        """
+        Stop the thread pool, waiting for any pending chunk I/O to finish.
+        """
+
+        if self.threadpool is None:
+            return
+
+        self.threadpool.stop()
+        self.threadpool = None
+
+    def map_regions(self):
+        """
+        Read chunks from memory-mapped region files.
+
+        Regions which are already open keep their current read mode until
+        they are closed.
+        """
+
+        self._regions.mapped = True
+
+    def _region_busy(self, region):
+        return region.fp.basename() in self._region_locks
+
+    def close(self):
+        """
+        Stop any I/O threads and close all open regions.
+        """
+
+        self.stop_threads()
+        self._regions.close()
+
+    def _run_in_region(self, name, f, *args):
+        """
+        Run a function which touches a region file.
+
+        If threads are enabled, the function is run in the thread pool and a
+        ``Deferred`` is returned. Calls which touch the same region are run
+        one at a time, since concurrent writes would clobber each other's
+        updates to the region's header.
+        """
+
+        if self.threadpool is None:
+            return f(*args)
+
+        lock = self._region_locks.get(name)
+        if lock is None:
+            lock = self._region_locks[name] = DeferredLock()
+
+        d = lock.run(deferToThreadPool, reactor, self.threadpool, f, *args)
+
+        @d.addBoth
+        def cleanup(result):
+            if not lock.locked and not lock.waiting:
+                self._region_locks.pop(name, None)
+            return result
+
+        return d
+
     # Entity serializers.
 
     def _load_entity_from_tag(self, tag):
@@ -276,6 +365,11 @@ class Anvil(object):
         """
         Load a chunk from a tag.
 
+        The tag should be a lazily parsed compound from ``read_nbt()``, so
+        that only the parts of the chunk which are actually used get
+        unpacked. Entities and tiles are rare enough that they are still
+        turned into full tags.
+
         We cannot instantiate chunks, ever, so pass it in from above.
         """
 
@@ -285,25 +379,24 @@ class Anvil(object):
         # issues, but still be speedy.
 
         # Loop through the sections and unpack anything that we find.
-        for tag in level["Sections"].tags:
-            index = tag["Y"].value
+        for tag in level["Sections"]:
+            index = tag["Y"]
             section = Section()
             section.blocks = array("B")
-            section.blocks.fromstring(tag["Blocks"].value)
-            section.metadata = array("B", unpack_nibbles(tag["Data"].value))
-            section.skylight = array("B",
-                                     unpack_nibbles(tag["SkyLight"].value))
+            section.blocks.fromstring(tag["Blocks"])
+            section.metadata = unpack_nibbles(tag["Data"])
+            section.skylight = unpack_nibbles(tag["SkyLight"])
+            section.recount()
             chunk.sections[index] = section
 
         chunk.heightmap = array("B")
-        chunk.heightmap.fromstring(level["HeightMap"].value)
-        chunk.blocklight = array("B",
-            unpack_nibbles(level["BlockLight"].value))
+        chunk.heightmap.fromstring(level["HeightMap"])
+        chunk.blocklight = unpack_nibbles(level["BlockLight"])
 
         chunk.populated = bool(level["TerrainPopulated"])
 
         if "Entities" in level:
-            for tag in level["Entities"].tags:
+            for tag in level.tag("Entities").tags:
                 try:
                     entity = self._load_entity_from_tag(tag)
                     chunk.entities.add(entity)
@@ -313,7 +406,7 @@ class Anvil(object):
                     log.msg(tag.pretty_tree())
 
         if "TileEntities" in level:
-            for tag in level["TileEntities"].tags:
+            for tag in level.tag("TileEntities").tags:
                 try:
                     tile = self._load_tile_from_tag(tag)
                     chunk.tiles[tile.x, tile.y, tile.z] = tile
@@ -340,14 +433,14 @@ class Anvil(object):
 
         level["Sections"] = TAG_List(type=TAG_Compound)
         for i, s in enumerate(chunk.sections):
-            if s:
+            if not s.is_blank():
                 section = TAG_Compound()
                 section.name = ""
                 section["Y"] = TAG_Byte(i)
                 section["Blocks"] = TAG_Byte_Array()
-                section["Blocks"].value = s.blocks.tostring()
+                section["Blocks"].value = s.block_string()
                 section["Data"] = TAG_Byte_Array()
-                section["Data"].value = pack_nibbles(s.metadata)
+                section["Data"].value = s.metadata_nibbles()
                 section["SkyLight"] = TAG_Byte_Array()
                 section["SkyLight"].value = pack_nibbles(s.skylight)
                 level["Sections"].tags.append(section)
@@ -375,6 +468,72 @@ class Anvil(object):
 
         return tag
 
+    def _render_chunk(self, chunk):
+        """
+        Render a chunk straight to NBT data.
+
+        The chunk's arrays are written directly into a single buffer, without
+        building any tags for them. Only entities and tiles are turned into
+        tags first. The output is identical to rendering the tag from
+        ``_save_chunk_to_tag()``.
+        """
+
+        # Blank sections are what missing sections load as, so they needn't
+        # be saved. Sections of air can still be in shadow, though.
+        sections = [(i, s) for i, s in enumerate(chunk.sections)
+                    if not s.is_blank()]
+
+        entities = []
+        for entity in chunk.entities:
+            try:
+                entities.append(self._save_entity_to_tag(entity))
+            except KeyError:
+                log.msg("Unknown entity %s" % entity.name)
+
+        tiles = []
+        for tile in chunk.tiles.itervalues():
+            try:
+                tiles.append(self._save_tile_to_tag(tile))
+            except KeyError:
+                log.msg("Unknown tile entity %s" % tile.name)
+
+        # Each section is a little over 8KiB of arrays, and the heightmap and
+        # blocklight are another 2.25KiB.
+        w = NBTWriter(3072 + len(sections) * 8400)
+
+        w.compound("")
+        w.compound("Level")
+
+        w.int("xPos", chunk.x)
+        w.int("zPos", chunk.z)
+
+        w.byte_array("HeightMap", chunk.heightmap)
+        w.byte_array("BlockLight", pack_nibbles(chunk.blocklight))
+        w.byte_array("SkyLight", "")
+
+        w.list("Sections", TAG_COMPOUND, len(sections))
+        for i, s in sections:
+            w.byte("Y", i)
+            w.byte_array("Blocks", s.block_string())
+            w.byte_array("Data", s.metadata_nibbles())
+            w.byte_array("SkyLight", pack_nibbles(s.skylight))
+            w.end()
+
+        w.byte("TerrainPopulated", chunk.populated)
+
+        w.list("Entities", TAG_COMPOUND, len(entities))
+        for tag in entities:
+            w.payload(tag)
+
+        w.list("TileEntities", TAG_COMPOUND, len(tiles))
+        for tag in tiles:
+            w.payload(tag)
+
+        w.end()
+        w.end()
+
+        return w.getvalue()
+
     def _load_inventory_from_tag(self, inventory, tag):
         """
         Load an inventory from a tag.
@@ -444,15 +603,13 @@ class Anvil(object):
             except os.error:
                 raise Exception("Could not create world in %s" % self.folder)
 
-    def load_chunk(self, x, z):
-        name = name_for_anvil(x, z)
-        fp = self.folder.child("region").child(name)
-        region = Region(fp)
+    def _load_chunk(self, fp, x, z):
         chunk = Chunk(x, z)
 
         try:
+            region = self._regions.get(fp)
             data = region.get_chunk(x, z)
-            tag = NBTFile(buffer=StringIO(data))
+            tag = read_nbt(data)
             self._load_chunk_from_tag(chunk, tag)
         except MissingChunk:
             raise SerializerReadException("No chunk %r in region" % chunk)
@@ -462,25 +619,31 @@ class Anvil(object):
 
         return chunk
 
-    def save_chunk(self, chunk):
-        tag = self._save_chunk_to_tag(chunk)
+    def _write_chunk(self, fp, x, z, data):
+        # Allocate the region and put the chunk into it. The region is created
+        # if needed, but never trashed if it already exists.
+        try:
+            region = self._regions.get(fp, create=True)
+            region.put_chunk(x, z, data)
+        except IOError, e:
+            raise SerializerWriteException("Couldn't write to region: %r" % e)
 
-        b = StringIO()
-        tag.write_file(buffer=b)
-        data = b.getvalue()
+    def load_chunk(self, x, z):
+        name = name_for_anvil(x, z)
+        fp = self.folder.child("region").child(name)
+
+        return self._run_in_region(name, self._load_chunk, fp, x, z)
+
+    def save_chunk(self, chunk):
+        # The chunk is always rendered right away, since that copies the
+        # chunk's data; the chunk could change while it is being written out.
+        data = self._render_chunk(chunk)
 
         name = name_for_anvil(chunk.x, chunk.z)
         fp = self.folder.child("region").child(name)
 
-        # Allocate the region and put the chunk into it. Use ensure() instead
-        # of create() so that we don't trash the region.
-        region = Region(fp)
-
-        try:
-            region.ensure()
-            region.put_chunk(chunk.x, chunk.z, data)
-        except IOError, e:
-            raise SerializerWriteException("Couldn't write to region: %r" % e)
+        return self._run_in_region(name, self._write_chunk, fp, chunk.x,
+                                   chunk.z, data)
 
     def load_level(self):
         fp = self.folder.child("level.dat")
@@ -1,47 +1,230 @@
+from bisect import bisect_left
 from gzip import GzipFile
+from mmap import mmap, ACCESS_READ
 from StringIO import StringIO
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
+from threading import Lock
+from zlib import decompress
 
 class MissingChunk(Exception):
     """
     The requested chunk isn't in this region.
     """
 
+class FreeList(object):
+    """
+    The free pages of a region, kept as a sorted list of runs.
+
+    Each run is a ``[start, length]`` pair. Runs never overlap or touch;
+    freeing pages next to an existing run grows that run instead of adding a
+    new one, so a region with thousands of free pages usually only has a
+    handful of runs to search.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(length for start, length in self.runs)
+
+    def __iter__(self):
+        for start, length in self.runs:
+            for page in xrange(start, start + length):
+                yield page
+
+    def __contains__(self, page):
+        i = bisect_left(self.runs, [page + 1]) - 1
+        if i < 0:
+            return False
+        start, length = self.runs[i]
+        return page < start + length
+
+    def free(self, start, length):
+        """
+        Mark a run of pages as free.
+
+        The pages must not already be free.
+        """
+
+        if not length:
+            return
+
+        i = bisect_left(self.runs, [start])
+
+        # Merge with the following run, if we touch it.
+        if i < len(self.runs) and self.runs[i][0] == start + length:
+            length += self.runs.pop(i)[1]
+
+        # Merge with the preceding run, if it touches us.
+        if i and sum(self.runs[i - 1]) == start:
+            self.runs[i - 1][1] += length
+        else:
+            self.runs.insert(i, [start, length])
+
+    def allocate(self, length):
+        """
+        Take the first run of free pages which is long enough.
+
+        :returns: the first page of the run, or None if no run is long enough
+        """
+
+        for i, run in enumerate(self.runs):
+            start, available = run
+            if available >= length:
+                if available == length:
+                    del self.runs[i]
+                else:
+                    run[0] += length
+                    run[1] -= length
+                return start
+
+        return None
+
+    def truncate(self, end):
+        """
+        Remove the run touching ``end``, if there is one, and return where it
+        started.
+
+        This lets the caller grow a file into its trailing free pages instead
+        of leaving them behind.
+        """
+
+        if self.runs and sum(self.runs[-1]) == end:
+            return self.runs.pop()[0]
+        return end
+
 class Region(object):
     """
     An MCRegion-style paged chunk file.
+
+    Regions keep their file open, along with an in-memory copy of the
+    location table and the list of free pages, from the first time that they
+    are used until they are closed. Reading a chunk only needs a single read
+    from the file, and writing a chunk only needs one write for the chunk and
+    one for its entry in the location table.
+
+    Regions may also be memory-mapped for reading. Chunks are then sliced
+    straight out of the mapping and handed to zlib without being copied, so
+    loading a chunk doesn't need any system calls at all once its pages are
+    in the page cache. Writes still go through the file, and the mapping is
+    redone whenever the file has grown past it.
     """
 
     free_pages = None
     positions = None
+    handle = None
+    map = None
+
+    writable = False
+    """
+    Whether the open file can be written to.
+    """
+
+    end = 2
+    """
+    The number of pages in the file, including the header.
+    """
+
+    def __init__(self, fp, mapped=False):
+        """
+        :param `FilePath` fp: the region's file
+        :param bool mapped: whether to read chunks through a memory mapping
+        """
 
-    def __init__(self, fp):
         self.fp = fp
+        self.mapped = mapped
+
+    def open(self, writable=False):
+        """
+        Open this region's file, and keep it open.
+
+        The file is opened for reading only, so that regions on read-only
+        files can still be read, and is reopened the first time that it needs
+        to be written to. It is opened unbuffered, since every read and write
+        is already a complete page-sized operation.
+
+        :param bool writable: whether the file needs to be written to
+        """
+
+        if self.handle is not None and writable and not self.writable:
+            self.handle.close()
+            self.handle = None
+
+        if self.handle is None:
+            self.handle = open(self.fp.path, "r+b" if writable else "rb", 0)
+            self.writable = writable
+
+    def close(self):
+        """
+        Close this region's file.
+
+        The region can still be used afterwards; the file will be reopened on
+        demand.
+        """
+
+        self.unmap()
+
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+            self.writable = False
+
+    def remap(self):
+        """
+        Map the entire file into memory, replacing any older mapping.
+        """
+
+        self.unmap()
+        self.open()
+        self.map = mmap(self.handle.fileno(), 0, access=ACCESS_READ)
+
+    def unmap(self):
+        """
+        Drop this region's memory mapping, if it has one.
+        """
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
 
     def load_pages(self):
         """
         Prefetch the pages of a region.
         """
 
-        with self.fp.open("r") as handle:
-            page = handle.read(4096)
-
-        # The + 1 is not gratuitous. Remember that range/xrange won't include
-        # the upper index, but we want it, so we need to increase our upper
-        # bound. Additionally, the first page is off-limits.
-        self.free_pages = set(xrange(2, (self.fp.getsize() // 4096) + 1))
+        if self.mapped:
+            self.remap()
+            size = len(self.map)
+            locations = unpack_from(">1024L", self.map)
+        else:
+            self.open()
+            self.handle.seek(0, 2)
+            size = self.handle.tell()
+            self.handle.seek(0)
+            locations = unpack(">1024L", self.handle.read(4096))
+
+        # The header is two pages long, and is off-limits.
+        self.end = max(2, (size + 4095) // 4096)
+        self.free_pages = FreeList()
         self.positions = {}
 
         for x in xrange(32):
             for z in xrange(32):
-                offset = 4 * (x + z * 32)
-                position = unpack(">L", page[offset:offset+4])[0]
+                position = locations[x + z * 32]
                 pages = position & 0xff
                 position >>= 8
                 if position and pages:
                     self.positions[x, z] = position, pages
-                    for i in xrange(pages):
-                        self.free_pages.discard(position + i)
+
+        # Everything between the used extents is free. Overlapping extents
+        # only happen in damaged files, but shouldn't free anything twice.
+        used = 2
+        for position, pages in sorted(self.positions.itervalues()):
+            if position > used:
+                self.free_pages.free(used, position - used)
+            used = max(used, position + pages)
+        if self.end > used:
+            self.free_pages.free(used, self.end - used)
 
     def create(self):
         """
@@ -50,12 +233,15 @@ class Region(object):
         If the region already exists, this will zero it out.
         """
 
+        self.close()
+
         # Create the file and zero out the header, plus a spare page for
         # Notchian software.
         self.fp.setContent("\x00" * 8192)
 
-        self.free_pages = set()
+        self.free_pages = FreeList()
         self.positions = {}
+        self.end = 2
 
     def ensure(self):
         """
@@ -68,9 +254,9 @@ class Region(object):
     def get_chunk_header(self, x, z):
         position, pages = self.positions[x, z]
 
-        with self.fp.open("r") as handle:
-            handle.seek(position * 4096)
-            header = handle.read(5)
+        self.open()
+        self.handle.seek(position * 4096)
+        header = self.handle.read(5)
 
         length = unpack(">L", header[:4])[0] - 1
         version = ord(header[4])
@@ -81,33 +267,62 @@ class Region(object):
         x %= 32
         z %= 32
 
-        if not self.positions:
+        self.open()
+        if self.positions is None:
             self.load_pages()
 
         if (x, z) not in self.positions:
             raise MissingChunk((x, z))
 
         position, pages = self.positions[x, z]
-        length, version = self.get_chunk_header(x, z)
 
-        with self.fp.open("r") as handle:
-            handle.seek(position * 4096 + 5)
-            data = handle.read(length)
+        if self.mapped:
+            data, version = self._map_chunk(position, pages)
+        else:
+            # Read the header and the payload in one go; the header says how
+            # much of the chunk's pages are actually used.
+            self.handle.seek(position * 4096)
+            data = self.handle.read(pages * 4096)
+
+            length = unpack(">L", data[:4])[0] - 1
+            version = ord(data[4])
+            data = data[5:5 + length]
 
         if version == 1:
-            fileobj = GzipFile(fileobj=StringIO(data))
+            fileobj = GzipFile(fileobj=StringIO(str(data)))
             data = fileobj.read()
         elif version == 2:
-            data = data.decode("zlib")
+            data = decompress(data)
 
         return data
 
+    def _map_chunk(self, position, pages):
+        """
+        Slice a chunk's payload out of the mapping, without copying it.
+        """
+
+        offset = position * 4096
+
+        # The chunk might have been written after the file was last mapped.
+        if self.map is None or len(self.map) < offset + 5:
+            self.remap()
+
+        length, version = unpack_from(">LB", self.map, offset)
+        length -= 1
+        offset += 5
+
+        if len(self.map) < offset + length:
+            self.remap()
+
+        return buffer(self.map, offset, length), version
+
     def put_chunk(self, x, z, data):
         x %= 32
         z %= 32
         data = data.encode("zlib")
 
-        if not self.positions:
+        self.open(writable=True)
+        if self.positions is None:
             self.load_pages()
 
         if (x, z) in self.positions:
@@ -128,43 +343,173 @@ class Region(object):
         # method we *will* be blocking, makes it worthwhile computationally.
         # This is a lot cheaper than an explicit vacuum, by the way!
         if not position or not pages or pages != needed_pages:
-            # Deallocate our current home.
-            for i in xrange(pages):
-                self.free_pages.add(position + i)
-
-            # Find a new home for us.
-            found = False
-            for candidate in sorted(self.free_pages):
-                if all(candidate + i in self.free_pages
-                    for i in range(needed_pages)):
-                        # Excellent.
-                        position = candidate
-                        found = True
-                        break
+            # Deallocate our current home, and find a new one.
+            self.free_pages.free(position, pages)
+            position = self.free_pages.allocate(needed_pages)
 
             # If we couldn't find a reusable run of pages, we should just go
-            # to the end of the file.
-            if not found:
-                position = (self.fp.getsize() + 4095) // 4096
+            # to the end of the file, starting in any free pages left there.
+            if position is None:
+                position = self.free_pages.truncate(self.end)
 
-            # And allocate our new home.
-            for i in xrange(needed_pages):
-                self.free_pages.discard(position + i)
+            # Grow the file, if we went past its end.
+            self.end = max(self.end, position + needed_pages)
 
         pages = needed_pages
 
         self.positions[x, z] = position, pages
 
         # Write our payload.
-        with self.fp.open("r+") as handle:
-            handle.seek(position * 4096)
-            handle.write(data)
+        self.handle.seek(position * 4096)
+        self.handle.write(data)
 
         # And now update the count page, as a separate operation, for some
         # semblance of consistency.
-        with self.fp.open("r+") as handle:
-            # Write our position and page count.
-            offset = 4 * (x + z * 32)
-            position = position << 8 | pages
-            handle.seek(offset)
-            handle.write(pack(">L", position))
+        offset = 4 * (x + z * 32)
+        position = position << 8 | pages
+        self.handle.seek(offset)
+        self.handle.write(pack(">L", position))
+
+    def compact(self):
+        """
+        Rewrite this region with its chunks packed together at the start of
+        the file, and without any free pages.
+
+        Chunks are copied as they are, without being decompressed. The new
+        file is written next to the old one and then moved over it, so this
+        should only be done while nothing else is using the region.
+
+        :returns: the number of bytes reclaimed
+        """
+
+        self.open()
+        if self.positions is None:
+            self.load_pages()
+
+        self.handle.seek(0, 2)
+        before = self.handle.tell()
+        self.handle.seek(4096)
+        timestamps = self.handle.read(4096).ljust(4096, "\x00")
+
+        locations = [0] * 1024
+        positions = {}
+        position = 2
+
+        temp = self.fp.temporarySibling()
+        with temp.open("w") as out:
+            out.seek(8192)
+            extents = sorted(self.positions.iteritems(),
+                key=lambda item: item[1])
+            for (x, z), (start, pages) in extents:
+                self.handle.seek(start * 4096)
+                out.write(self.handle.read(pages * 4096).ljust(pages * 4096,
+                    "\x00"))
+
+                positions[x, z] = position, pages
+                locations[x + z * 32] = position << 8 | pages
+                position += pages
+
+            out.seek(0)
+            out.write(pack(">1024L", *locations))
+            out.write(timestamps)
+
+        self.close()
+        temp.moveTo(self.fp)
+
+        self.positions = positions
+        self.free_pages = FreeList()
+        self.end = position
+
+        return before - position * 4096
+
+class RegionCache(object):
+    """
+    A bounded cache of open regions.
+
+    Regions are evicted, and closed, least recently used first. Regions which
+    are reported as busy by the ``busy`` hook are passed over, even if this
+    means that the cache grows beyond its size.
+
+    This cache may be used from multiple threads at once.
+    """
+
+    busy = None
+    """
+    Optional hook to be called with a region, which should return whether
+    the region is still in use and must not be closed.
+    """
+
+    mapped = False
+    """
+    Whether newly opened regions should be memory-mapped for reading.
+    """
+
+    def __init__(self, size=16):
+        """
+        :param int size: the number of regions to keep open
+        """
+
+        self.size = size
+
+        self._regions = {}
+        self._order = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._regions)
+
+    def get(self, fp, create=False):
+        """
+        Get an open region.
+
+        :param `FilePath` fp: the region's file
+        :param bool create: whether to create the region's file if it doesn't
+            already exist
+        :raises IOError: if the file can't be opened
+        """
+
+        key = fp.path
+
+        with self._lock:
+            region = self._regions.get(key)
+
+            if region is None:
+                region = Region(fp, self.mapped)
+                if create:
+                    region.ensure()
+                region.open()
+
+                self._regions[key] = region
+                self._order.append(key)
+                self._evict()
+            else:
+                self._order.remove(key)
+                self._order.append(key)
+
+            return region
+
+    def _evict(self):
+        # Never evict the most recently used region; it is about to be used.
+        for key in self._order[:-1]:
+            if len(self._regions) <= self.size:
+                break
+
+            region = self._regions[key]
+            if self.busy is not None and self.busy(region):
+                continue
+
+            self._order.remove(key)
+            del self._regions[key]
+            region.close()
+
+    def close(self):
+        """
+        Close every region.
+        """
+
+        with self._lock:
+            for region in self._regions.itervalues():
+                region.close()
+
+            self._regions.clear()
+            del self._order[:]
@@ -0,0 +1,132 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from bravo.beta.compression import ChunkCompressor
+from bravo.beta.packets import make_packet, make_chunk_packet
+from bravo.chunk import Chunk
+
+class TestMakeChunkPacket(TestCase):
+
+    def test_same_as_make_packet(self):
+        data = "chunk data" * 100
+        self.assertEqual(make_chunk_packet(-3, 5, 0x7, data),
+            make_packet("chunk", x=-3, z=5, continuous=True, primary=0x7,
+                        add=0x0, data=data))
+
+class TestChunkCompressor(TestCase):
+
+    def setUp(self):
+        self.compressor = ChunkCompressor()
+        self.chunk = Chunk(1, 2)
+        self.chunk.set_block((1, 2, 3), 1)
+
+    def tearDown(self):
+        self.compressor.stop()
+
+    @inlineCallbacks
+    def test_packet(self):
+        packet, serial = yield self.compressor.packet(self.chunk)
+        self.assertEqual(packet, self.chunk.build_packet())
+        self.assertEqual(serial, self.chunk.packet_serial)
+
+    @inlineCallbacks
+    def test_packet_threaded(self):
+        self.compressor.start(2)
+        packet, serial = yield self.compressor.packet(self.chunk)
+        self.assertEqual(packet, self.chunk.build_packet())
+
+    @inlineCallbacks
+    def test_packet_cached(self):
+        packet, serial = yield self.compressor.packet(self.chunk)
+        self.assertIs(self.chunk.save_to_packet(), packet)
+
+        cached = yield self.compressor.packet(self.chunk)
+        self.assertEqual(cached, (packet, serial))
+
+    @inlineCallbacks
+    def test_packet_shared(self):
+        """
+        Requests for a packet which is already being built share the build.
+        """
+
+        self.compressor.start(2)
+        misses = Chunk.packet_misses
+
+        first = self.compressor.packet(self.chunk)
+        second = self.compressor.packet(self.chunk)
+        self.assertEqual(self.compressor.pending, 1)
+
+        first = yield first
+        second = yield second
+        self.assertIs(first, second)
+        self.assertEqual(Chunk.packet_misses, misses + 1)
+        self.assertEqual(self.compressor.pending, 0)
+
+    @inlineCallbacks
+    def test_packet_changed_while_building(self):
+        """
+        Packets built from stale data are not cached.
+        """
+
+        self.compressor.start(2)
+
+        d = self.compressor.packet(self.chunk)
+        self.chunk.set_block((1, 2, 3), 2)
+        second = self.compressor.packet(self.chunk)
+
+        stale, stale_serial = yield d
+        fresh, fresh_serial = yield second
+        self.assertNotEqual(stale, fresh)
+        self.assertNotEqual(stale_serial, self.chunk.packet_serial)
+        self.assertEqual(fresh_serial, self.chunk.packet_serial)
+        self.assertEqual(fresh, self.chunk.build_packet())
+        self.assertIs(self.chunk.save_to_packet(), fresh)
+
+    @inlineCallbacks
+    def test_packet_queued(self):
+        """
+        Chunks waiting for their turn don't have their data gathered until
+        their turn comes.
+        """
+
+        self.compressor = ChunkCompressor(backlog=1)
+        self.compressor.start(1)
+        other = Chunk(3, 4)
+
+        first = self.compressor.packet(self.chunk)
+        second = self.compressor.packet(other)
+        other.set_block((1, 2, 3), 2)
+
+        yield first
+        packet, serial = yield second
+        self.assertEqual(packet, other.build_packet())
+        self.assertEqual(serial, other.packet_serial)
+
+    @inlineCallbacks
+    def test_packet_queued_shared(self):
+        """
+        Builds which are still waiting their turn are shared even if the chunk
+        changes, since they will gather its newer data.
+        """
+
+        self.compressor = ChunkCompressor(backlog=1)
+        self.compressor.start(1)
+        other = Chunk(3, 4)
+
+        first = self.compressor.packet(self.chunk)
+        second = self.compressor.packet(other)
+        other.set_block((1, 2, 3), 2)
+        third = self.compressor.packet(other)
+        self.assertEqual(self.compressor.pending, 2)
+
+        yield first
+        second = yield second
+        third = yield third
+        self.assertIs(second, third)
+
+    @inlineCallbacks
+    def test_level(self):
+        self.compressor.level = 1
+        packet, serial = yield self.compressor.packet(self.chunk)
+        data = self.chunk.packet_data()[1]
+        self.assertEqual(packet, make_chunk_packet(1, 2, 1, data, 1))
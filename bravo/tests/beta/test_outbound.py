@@ -0,0 +1,199 @@
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from bravo.beta.outbound import PacketQueue
+from bravo.beta.packets import make_packet, parse_packets
+
+def teleport(eid, x):
+    return make_packet("teleport", eid=eid, x=x, y=0, z=0, yaw=0, pitch=0)
+
+def move(eid, dx):
+    return make_packet("entity-position", eid=eid, dx=dx, dy=0, dz=0)
+
+def move_look(eid, dx, yaw):
+    return make_packet("entity-location", eid=eid, dx=dx, dy=0, dz=0,
+                       yaw=yaw, pitch=0)
+
+def look(eid, yaw):
+    return make_packet("entity-orientation", eid=eid, yaw=yaw, pitch=0)
+
+class SequenceTransport(StringTransport):
+    """
+    A transport which remembers each call to ``writeSequence()``.
+    """
+
+    def __init__(self):
+        StringTransport.__init__(self)
+        self.sequences = []
+
+    def writeSequence(self, data):
+        self.sequences.append(list(data))
+        StringTransport.writeSequence(self, data)
+
+class TestPacketQueue(TestCase):
+
+    def setUp(self):
+        self.transport = SequenceTransport()
+        self.clock = Clock()
+        self.q = PacketQueue(self.transport, self.clock)
+
+    def packets(self):
+        """
+        Run the clock, and get the packets which were written.
+        """
+
+        self.clock.advance(0)
+        packets, leftovers = parse_packets(self.transport.value())
+        self.assertEqual(leftovers, "")
+        return packets
+
+    def test_trivial(self):
+        pass
+
+    def test_registered(self):
+        self.assertTrue(self.transport.producer is self.q)
+        self.assertTrue(self.transport.streaming)
+
+    def test_coalesce(self):
+        """
+        Packets written in one turn of the reactor go out in a single
+        sequence.
+        """
+
+        self.q.write(make_packet("ping", pid=1))
+        self.q.write(make_packet("ping", pid=2))
+        self.assertEqual(self.transport.value(), "")
+
+        self.clock.advance(0)
+        self.assertEqual(self.transport.sequences,
+            [[make_packet("ping", pid=1), make_packet("ping", pid=2)]])
+
+    def test_next_turn(self):
+        self.q.write(make_packet("ping", pid=1))
+        self.clock.advance(0)
+        self.q.write(make_packet("ping", pid=2))
+        self.clock.advance(0)
+        self.assertEqual(len(self.transport.sequences), 2)
+
+    def test_passthrough(self):
+        self.assertEqual(self.q.getPeer(), self.transport.getPeer())
+
+    def test_teleport_supersedes(self):
+        self.q.write(teleport(1, 32))
+        self.q.write(move(1, 4))
+        self.q.write(look(1, 8))
+        self.q.write(teleport(2, 64))
+        self.q.write(teleport(1, 96))
+
+        packets = self.packets()
+        self.assertEqual([(h, payload.eid) for h, payload in packets],
+                         [(0x22, 2), (0x22, 1)])
+        self.assertEqual(packets[1][1].x, 96)
+
+    def test_look_supersedes(self):
+        self.q.write(look(1, 8))
+        self.q.write(look(1, 16))
+
+        packets = self.packets()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0][1].yaw, 16)
+
+    def test_look_keeps_move_look(self):
+        self.q.write(move_look(1, 4, 8))
+        self.q.write(look(1, 16))
+        self.assertEqual(len(self.packets()), 2)
+
+    def test_merge_moves(self):
+        self.q.write(move(1, 4))
+        self.q.write(move(2, 8))
+        self.q.write(move(1, -12))
+
+        packets = self.packets()
+        self.assertEqual([(payload.eid, payload.dx)
+                          for header, payload in packets], [(2, 8), (1, -8)])
+
+    def test_merge_move_look(self):
+        self.q.write(move(1, 4))
+        self.q.write(move_look(1, 4, 16))
+
+        packets = self.packets()
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0][0], 0x21)
+        self.assertEqual(packets[0][1].dx, 8)
+        self.assertEqual(packets[0][1].yaw, 16)
+
+    def test_merge_move_after_look(self):
+        """
+        A move without a look isn't added to an earlier move with a look,
+        since that could undo a look in between.
+        """
+
+        self.q.write(move_look(1, 4, 16))
+        self.q.write(look(1, 32))
+        self.q.write(move(1, 4))
+        self.assertEqual(len(self.packets()), 3)
+
+    def test_merge_overflow(self):
+        self.q.write(move(1, 100))
+        self.q.write(move(1, 100))
+        self.assertEqual(len(self.packets()), 2)
+
+    def test_merge_barrier(self):
+        """
+        Moves aren't added across other packets.
+        """
+
+        self.q.write(move(1, 4))
+        self.q.write(make_packet("destroy", count=1, eid=[1]))
+        self.q.write(move(1, 4))
+        self.assertEqual(len(self.packets()), 3)
+
+    def test_several_packets(self):
+        """
+        Writes with several packets in them are left alone.
+        """
+
+        self.q.write(teleport(1, 32) + teleport(1, 64))
+        self.q.write(teleport(1, 96))
+        self.assertEqual(len(self.packets()), 3)
+
+    def test_paused(self):
+        self.q.pauseProducing()
+        self.q.write(make_packet("ping", pid=1))
+        self.q.write(teleport(1, 32))
+        self.clock.advance(0)
+        self.assertEqual(self.transport.value(), "")
+
+        self.q.write(teleport(1, 64))
+        self.q.resumeProducing()
+        self.assertEqual(len(self.packets()), 2)
+
+    def test_paused_limit(self):
+        self.patch(PacketQueue, "limit", 100)
+        self.q.pauseProducing()
+        for i in range(30):
+            self.q.write(make_packet("ping", pid=i))
+
+        self.assertTrue(self.transport.disconnecting)
+        self.assertTrue(self.q.stopped)
+        self.assertEqual(len(self.q), 0)
+
+    def test_lose_connection(self):
+        """
+        Queued packets are written before the connection is lost, even if
+        the transport is paused.
+        """
+
+        self.q.pauseProducing()
+        self.q.write(make_packet("error", message=u"Bye"))
+        self.q.loseConnection()
+
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(len(self.packets()), 1)
+
+    def test_stopped(self):
+        self.q.stopProducing()
+        self.q.write(make_packet("ping", pid=1))
+        self.clock.advance(0)
+        self.assertEqual(self.transport.value(), "")
@@ -1,7 +1,12 @@
-from unittest import TestCase
+from twisted.trial.unittest import TestCase
 
-from bravo.beta.packets import simple, parse_packets, make_packet
+from construct import Container, ConstructError, MappingAdapter, Struct
+
+import bravo.beta.packets
+from bravo.beta.packets import simple, parse_packet, parse_packets, make_packet
+from bravo.beta.packets import PacketBuffer
 from bravo.beta.packets import Speed, Slot, slot
+from bravo.beta.packets import fixed_packets, packets, packets_by_name
 
 class TestPacketBuilder(TestCase):
 
@@ -125,3 +130,292 @@ class TestBuildPackets(TestParsePacketsBase):
                        1: ('short', 300),
                        10: ('slot', Slot(262, 2))
                    }))
+
+
+def sample(construct):
+    """
+    Make a container for a fixed packet, with a valid value in every field.
+    """
+
+    container = Container()
+
+    for sc in construct.subcons:
+        if sc.conflags & sc.FLAG_EMBED:
+            container.update(sample(sc.subcon))
+        elif isinstance(sc, Struct):
+            container[sc.name] = sample(sc)
+        elif isinstance(sc, MappingAdapter):
+            container[sc.name] = sorted(sc.encoding)[-1]
+        elif sc.packer.format[-1] in "fd":
+            container[sc.name] = -1.5
+        elif sc.packer.format[-1].islower():
+            container[sc.name] = -2
+        else:
+            container[sc.name] = 2
+
+    return container
+
+class TestFixedPackets(TestCase):
+    """
+    Fixed packets give exactly the same containers and bytes as their
+    constructs.
+    """
+
+    def test_compiled(self):
+        """
+        The hot client packets are all compiled.
+        """
+
+        for name in ("ping", "grounded", "position", "orientation",
+                     "location", "digging", "equip", "animate", "action"):
+            self.assertTrue(packets_by_name[name] in fixed_packets, name)
+
+    def test_not_compiled(self):
+        for header in (0x01, 0x05, 0x33, 0xff):
+            self.assertFalse(header in fixed_packets)
+
+    def test_build(self):
+        for header, fixed in fixed_packets.iteritems():
+            container = sample(packets[header])
+            self.assertEqual(fixed.build(container),
+                             packets[header].build(container), fixed.name)
+
+    def test_parse(self):
+        for header, fixed in fixed_packets.iteritems():
+            data = "\x00" + packets[header].build(sample(packets[header]))
+            payload, offset = fixed.parse(data, 1)
+            self.assertEqual(payload, packets[header].parse(data[1:]),
+                             fixed.name)
+            self.assertEqual(offset, len(data))
+
+    def test_parse_nested(self):
+        data = make_packet("location",
+            position=Container(x=1.0, y=2.0, stance=3.5, z=4.0),
+            orientation=Container(rotation=90.0, pitch=0.0),
+            grounded=Container(grounded=1))
+        payload, offset = fixed_packets[0x0d].parse(data, 1)
+        self.assertEqual(payload.position.stance, 3.5)
+        self.assertEqual(payload.orientation.rotation, 90.0)
+        self.assertEqual(payload.grounded.grounded, 1)
+
+    def test_parse_enum(self):
+        payload, offset = fixed_packets[0x0e].parse(
+            "\x00\x00\x00\x00\x01\x02\x00\x00\x00\x03\x05", 0)
+        self.assertEqual(payload.state, "started")
+        self.assertEqual(payload.face, "+x")
+
+    def test_parse_bad_enum(self):
+        self.assertRaises(ConstructError, fixed_packets[0x0e].parse,
+            "\x09\x00\x00\x00\x01\x02\x00\x00\x00\x03\x05", 0)
+
+    def test_parse_short(self):
+        payload, needed = fixed_packets[0x0d].parse("\x0d\x00\x00", 1)
+        self.assertEqual(payload, None)
+        self.assertEqual(needed, 39)
+
+
+class TestParsePacketsRoundTrip(TestCase):
+    """
+    Every packet survives a trip through `make_packet()` and
+    `parse_packets()`, coming out the same as its construct parses it.
+    """
+
+    # Samples of the packets which aren't fixed.
+    samples = {
+        0x01: dict(eid=1, leveltype=u"default", mode="survival",
+                   dimension="earth", difficulty="peaceful", unused=0,
+                   maxplayers=8),
+        0x02: dict(protocol=61, username=u"bravo", host=u"localhost",
+                   port=25565),
+        0x03: dict(data=u"Hello, world!"),
+        0x05: dict(eid=1, slot=2, primary=3, count=4, secondary=5),
+        0x09: dict(dimension="nether", difficulty="hard", mode="creative",
+                   height=256, leveltype=u"flat"),
+        0x0f: dict(x=1, y=2, z=3, face="+y", primary=-1, cursorx=4,
+                   cursory=5, cursorz=6),
+        0x14: dict(eid=1, username=u"bravo", x=1, y=2, z=3, yaw=4, pitch=5,
+                   item=6, metadata={0: ("byte", 0)}),
+        0x17: dict(eid=1, type="arrow", x=1, y=2, z=3, pitch=4, yaw=5,
+                   data=6, speed=Speed(7, 8, 9)),
+        0x18: dict(eid=1, type="Pig", x=1, y=2, z=3, yaw=4, pitch=5,
+                   head_yaw=6, vx=7, vy=8, vz=9,
+                   metadata={0: ("byte", 0), 1: ("short", 300)}),
+        0x19: dict(eid=1, title=u"Kebab", x=1, y=2, z=3, face="-z"),
+        0x1d: dict(count=2, eid=[1, 2]),
+        0x28: dict(eid=1, metadata={10: ("slot", Slot(262, 2))}),
+        0x33: dict(x=1, z=2, continuous=True, primary=3, add=0,
+                   data="chunk"),
+        0x34: dict(x=1, z=2, count=3, data="batch"),
+        0x38: dict(count=1, length=3, sky_light=1, data="abc",
+                   metadata=[Container(chunk_x=1, chunk_z=2,
+                                       bitmap_primary=3,
+                                       bitmap_secondary=4)]),
+        0x3c: dict(x=1.0, y=2.0, z=3.0, radius=4.0, count=1,
+                   blocks="\x01\x02\x03", motionx=5.0, motiony=6.0,
+                   motionz=7.0),
+        0x3e: dict(name=u"random.bow", x=1, y=2, z=3, volume=1.0,
+                   pitch=63),
+        0x3f: dict(name=u"smoke", x=1.0, y=2.0, z=3.0, x_offset=0.5,
+                   y_offset=0.5, z_offset=0.5, speed=1.0, count=4),
+        0x64: dict(wid=1, type="furnace", title=u"Furnace", slots=3,
+                   use_title=0),
+        0x66: dict(wid=1, slot=2, button=0, token=3, shift=0, primary=-1),
+        0x67: dict(wid=1, slot=2, primary=3, count=4, secondary=5),
+        0x68: dict(wid=1, length=2,
+                   items=[Container(primary=-1),
+                          Container(primary=3, count=4, secondary=5)]),
+        0x6b: dict(slot=2, primary=-1),
+        0x82: dict(x=1, y=2, z=3, line1=u"One", line2=u"Two",
+                   line3=u"Three", line4=u"Four"),
+        0x83: dict(type=1, itemid=2, data="map"),
+        0x84: dict(x=1, y=2, z=3, action=4, nbt_data="nbt"),
+        0xc9: dict(name=u"bravo", online=True, ping=100),
+        0xcb: dict(autocomplete=u"/he"),
+        0xcc: dict(locale=u"en_US", distance=2, chat=0, difficulty="easy",
+                   cape=True),
+        0xce: dict(name=u"item", value=u"score", action="update"),
+        0xcf: dict(item_name=u"item", remove=0, score_name=u"score",
+                   value=5),
+        0xd0: dict(position="sidebar", score_name=u"score"),
+        0xd1: dict(name=u"team", mode="team_removed"),
+        0xfa: dict(channel=u"MC|Brand", data="bravo"),
+        0xfc: dict(key="key", token="token"),
+        0xfd: dict(server=u"-", key="key", token="token"),
+        0xfe: dict(data="ping"),
+        0xff: dict(message=u"Goodbye"),
+    }
+
+    def test_every_packet(self):
+        for header, construct in packets.iteritems():
+            if header in fixed_packets:
+                kwargs = sample(construct)
+            else:
+                self.assertTrue(header in self.samples, hex(header))
+                kwargs = self.samples[header]
+
+            data = make_packet(construct.name, **kwargs)
+            self.assertEqual(data[0], chr(header))
+
+            parsed, leftovers = parse_packets(data + "\x00")
+            self.assertEqual(parsed,
+                [(header, construct.parse(data[1:]))], construct.name)
+            self.assertEqual(leftovers, "\x00", construct.name)
+
+            self.assertEqual(make_packet(construct.name, parsed[0][1]), data,
+                             construct.name)
+
+    def test_several_packets(self):
+        data = (make_packet("ping", pid=1) + make_packet("error",
+                message=u"Bye") + make_packet("equip", slot=3))
+        parsed, leftovers = parse_packets(data)
+        self.assertEqual([header for header, payload in parsed],
+                         [0x00, 0xff, 0x10])
+        self.assertEqual(parsed[1][1].message, u"Bye")
+        self.assertEqual(leftovers, "")
+
+    def test_partial_fixed(self):
+        data = make_packet("ping", pid=1) + make_packet("equip", slot=3)
+        parsed, leftovers = parse_packets(data[:-1])
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(leftovers, data[5:-1])
+
+    def test_partial_construct(self):
+        data = make_packet("ping", pid=1) + make_packet("error",
+                                                        message=u"Bye")
+        parsed, leftovers = parse_packets(data[:-1])
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(leftovers, data[5:-1])
+
+    def test_unknown_header(self):
+        parsed, leftovers = parse_packets("\x00\x00\x00\x00\x01\xee\x00")
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(leftovers, "\xee\x00")
+
+    def test_make_packet_falls_back(self):
+        """
+        Bad payloads for fixed packets fail the same way as they always
+        have.
+        """
+
+        self.assertRaises(AttributeError, make_packet, "location")
+        self.assertRaises(ConstructError, make_packet, "digging",
+                          state="sleeping", x=1, y=2, z=3, face="+x")
+
+
+class TestPacketBuffer(TestCase):
+
+    def setUp(self):
+        self.b = PacketBuffer()
+
+    def test_trivial(self):
+        pass
+
+    def test_feed_whole(self):
+        parsed = self.b.feed(make_packet("ping", pid=1))
+        self.assertEqual(parsed, [(0x00, Container(pid=1))])
+        self.assertEqual(len(self.b), 0)
+
+    def test_feed_several(self):
+        parsed = self.b.feed(make_packet("ping", pid=1) +
+                             make_packet("error", message=u"Bye"))
+        self.assertEqual([header for header, payload in parsed],
+                         [0x00, 0xff])
+
+    def test_feed_partial(self):
+        data = make_packet("ping", pid=1) + make_packet("equip", slot=3)
+        self.assertEqual(len(self.b.feed(data[:-1])), 1)
+        self.assertEqual(len(self.b), 2)
+        self.assertEqual(self.b.feed(data[-1:]),
+                         [(0x10, Container(slot=3))])
+        self.assertEqual(len(self.b), 0)
+
+    def test_feed_garbage(self):
+        self.assertEqual(self.b.feed("\xee\x00"), [])
+        self.assertEqual(self.b.feed(make_packet("ping", pid=1)), [])
+        self.assertEqual(len(self.b), 7)
+
+    def test_fragments(self):
+        """
+        Every packet can be fed in a byte at a time.
+        """
+
+        samples = TestParsePacketsRoundTrip.samples
+        expected = []
+        data = ""
+        for header, construct in sorted(packets.iteritems()):
+            if header in fixed_packets:
+                kwargs = sample(construct)
+            else:
+                kwargs = samples[header]
+            packet = make_packet(construct.name, **kwargs)
+            expected.append((header, construct.parse(packet[1:])))
+            data += packet
+
+        parsed = []
+        for c in data:
+            parsed.extend(self.b.feed(c))
+
+        self.assertEqual(parsed, expected)
+        self.assertEqual(len(self.b), 0)
+
+    def test_fragments_parse_count(self):
+        """
+        A large packet fed in a byte at a time isn't parsed again for every
+        byte.
+        """
+
+        calls = []
+        def counting(bytestream, offset=0):
+            calls.append(offset)
+            return parse_packet(bytestream, offset)
+        self.patch(bravo.beta.packets, "parse_packet", counting)
+
+        data = make_packet("plugin-message", channel=u"MC|Brand",
+                           data="x" * 10000)
+        parsed = []
+        for c in data:
+            parsed.extend(self.b.feed(c))
+
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(parsed[0][1].data, "x" * 10000)
+        self.assertTrue(len(calls) < 30, len(calls))
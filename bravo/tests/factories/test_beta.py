@@ -1,17 +1,32 @@
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.internet.task import Clock
 from twisted.trial import unittest
 
+from bravo.chunk import Chunk
 from bravo.config import BravoConfigParser
 from bravo.beta.factory import BravoFactory
+from bravo.entity import Chuck
+from bravo.location import Location
+
+class MockTransport(object):
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
 
 class MockProtocol(object):
 
     username = None
+    host = "127.0.0.1"
 
     def __init__(self, player):
         self.player = player
         self.location = player.location if player else None
+        self.chunks = {}
+        self.transport = MockTransport()
 
 class TestBravoFactory(unittest.TestCase):
 
@@ -156,6 +171,82 @@ class TestBravoFactory(unittest.TestCase):
 
         self.assertFalse(self.f.set_username(p, "Hurp"))
 
+    def test_watch_chunk(self):
+        p = MockProtocol(None)
+        self.f.watch_chunk(p, 1, 2)
+        self.assertEqual(self.f.protocols_for_chunk(1, 2), set([p]))
+        self.assertFalse(self.f.protocols_for_chunk(2, 1))
+
+    def test_unwatch_chunk(self):
+        p = MockProtocol(None)
+        self.f.watch_chunk(p, 1, 2)
+        self.f.unwatch_chunk(p, 1, 2)
+        self.assertFalse(self.f.protocols_for_chunk(1, 2))
+        self.assertEqual(self.f.watchers, {})
+
+    def test_unwatch_chunk_unwatched(self):
+        self.f.unwatch_chunk(MockProtocol(None), 1, 2)
+
+    def test_watch_chunk_wakes_mobs(self):
+        """
+        Mobs sleep while nobody has their chunk loaded.
+        """
+
+        mob = Chuck(location=Location.at_block(17, 64, 33))
+        manager = self.f.world.mob_manager
+        manager.start_mob(mob)
+        self.assertTrue(mob in manager.sleeping)
+
+        first, second = MockProtocol(None), MockProtocol(None)
+        self.f.watch_chunk(first, 1, 2)
+        self.f.watch_chunk(second, 1, 2)
+        self.assertFalse(mob in manager.sleeping)
+
+        self.f.unwatch_chunk(first, 1, 2)
+        self.assertFalse(mob in manager.sleeping)
+        self.f.unwatch_chunk(second, 1, 2)
+        self.assertTrue(mob in manager.sleeping)
+
+    def test_broadcast_for_chunk(self):
+        first, second = MockProtocol(None), MockProtocol(None)
+        self.f.protocols["first"] = first
+        self.f.protocols["second"] = second
+        self.f.watch_chunk(first, 1, 2)
+        self.f.watch_chunk(second, 2, 1)
+
+        self.f.broadcast_for_chunk("packet", 1, 2)
+        self.assertEqual(first.transport.data, ["packet"])
+        self.assertEqual(second.transport.data, [])
+
+    def test_teardown_protocol_unwatches(self):
+        p = MockProtocol(None)
+        p.username = "Hurp"
+        p.chunks[1, 2] = None
+        self.f.protocols["Hurp"] = p
+        self.f.watch_chunk(p, 1, 2)
+
+        self.f.teardown_protocol(p)
+        self.assertFalse(self.f.protocols_for_chunk(1, 2))
+
+    def test_chunk_in_use(self):
+        p = MockProtocol(None)
+        self.f.watch_chunk(p, 1, 2)
+        self.assertTrue(self.f.world.chunk_in_use((1, 2)))
+        self.assertFalse(self.f.world.chunk_in_use((2, 1)))
+
+    def test_unwatch_chunk_releases(self):
+        """
+        Chunks which nobody has loaded anymore can be evicted again.
+        """
+
+        released = []
+        self.patch(self.f.world, "release_chunk", released.append)
+
+        p = MockProtocol(None)
+        self.f.watch_chunk(p, 1, 2)
+        self.f.unwatch_chunk(p, 1, 2)
+        self.assertEqual(released, [(1, 2)])
+
 class TestBravoFactoryStarted(unittest.TestCase):
     """
     Tests which require ``startFactory()`` to be called.
@@ -194,6 +285,36 @@ class TestBravoFactoryStarted(unittest.TestCase):
         self.assertEqual(entity.eid, 2)
         self.assertEqual(self.f.eid, 2)
 
+    def test_shutdown_waits_for_saves(self):
+        """
+        Reactor shutdown waits for writes which are still queued when the
+        factory stops.
+        """
+
+        writing = Deferred()
+        saved = []
+
+        def save_chunk(chunk):
+            saved.append(chunk)
+            return writing
+        self.patch(self.f.world.serializer, "save_chunk", save_chunk)
+
+        chunk = Chunk(0, 0)
+        self.f.world._cache.dirtied(chunk)
+        self.assertNotEqual(self.f._shutdown_trigger, None)
+
+        # Listening ports are stopped first, and then the shutdown trigger
+        # fires.
+        stopping = self.f.stopFactory()
+        d = self.f.shutdown()
+        self.assertIs(d, stopping)
+        self.assertEqual(saved, [chunk])
+        self.assertFalse(d.called)
+
+        writing.callback(None)
+        self.assertTrue(d.called)
+        self.assertEqual(self.f._shutdown_trigger, None)
+
     def test_create_entity_player(self):
         entity = self.f.create_entity(0, 0, 0, "Player", username="unittest")
         self.assertEqual(entity.eid, 2)
@@ -232,6 +353,7 @@ class TestBravoFactoryStarted(unittest.TestCase):
 
         for i, player in enumerate(players):
             self.f.protocols[i] = MockProtocol(player)
+            self.f.world.player_index.add(self.f.protocols[i])
 
         # List of tests (player in the center, radius, expected eids).
         expected_results = [
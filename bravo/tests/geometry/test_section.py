@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from bravo.geometry.section import Section
+from bravo.geometry.section import PackedSection, Section, empty_section, si
 
 class TestSectionInternals(TestCase):
 
@@ -26,3 +26,150 @@ class TestSectionInternals(TestCase):
         self.assertEqual(self.s.blocks[1], 1)
         self.assertEqual(self.s.blocks[256], 2)
         self.assertEqual(self.s.blocks[16], 3)
+
+    def test_empty(self):
+        self.assertFalse(self.s)
+        self.assertEqual(self.s.occupied, 0)
+
+    def test_set_block_occupied(self):
+        self.s.set_block((0, 0, 0), 1)
+        self.s.set_block((1, 0, 0), 1)
+        self.s.set_block((1, 0, 0), 2)
+        self.assertTrue(self.s)
+        self.assertEqual(self.s.occupied, 2)
+
+        self.s.set_block((0, 0, 0), 0)
+        self.s.set_block((0, 0, 0), 0)
+        self.assertEqual(self.s.occupied, 1)
+
+    def test_recount(self):
+        self.s.blocks[100] = 1
+        self.s.blocks[200] = 1
+        self.s.recount()
+        self.assertEqual(self.s.occupied, 2)
+
+    def test_set_skylight_shaded(self):
+        self.s.set_skylight((0, 0, 0), 3)
+        self.s.set_skylight((0, 0, 0), 0)
+        self.s.set_skylight((1, 0, 0), 14)
+        self.assertEqual(self.s.shaded, 2)
+
+        self.s.set_skylight((0, 0, 0), 0xf)
+        self.assertEqual(self.s.shaded, 1)
+
+    def test_recount_shaded(self):
+        self.s.skylight[100] = 0
+        self.s.recount()
+        self.assertEqual(self.s.shaded, 1)
+
+    def test_is_blank(self):
+        self.assertTrue(self.s.is_blank())
+        self.s.set_skylight((0, 0, 0), 0)
+        self.assertFalse(self.s.is_blank())
+
+    def test_copy(self):
+        self.s.set_block((1, 2, 3), 4)
+        copy = self.s.copy()
+        copy.set_block((1, 2, 3), 0)
+        self.assertEqual(self.s.get_block((1, 2, 3)), 4)
+        self.assertEqual(self.s.occupied, 1)
+        self.assertEqual(copy.occupied, 0)
+
+    def test_get_block_index(self):
+        self.s.set_block((1, 2, 3), 4)
+        self.assertEqual(self.s.get_block_index(si(1, 2, 3)), 4)
+
+    def test_get_blocks(self):
+        self.s.set_block((1, 0, 0), 1)
+        self.s.set_block((2, 0, 1), 2)
+        self.s.set_block((1, 1, 1), 3)
+        self.assertEqual(self.s.get_blocks((1, 0, 0), (3, 2, 2)),
+                         "\x01\x00\x00\x02\x00\x00\x03\x00")
+
+    def test_get_blocks_layers(self):
+        self.s.set_block((15, 2, 15), 1)
+        blocks = self.s.get_blocks((0, 1, 0), (16, 3, 16))
+        self.assertEqual(len(blocks), 512)
+        self.assertEqual(blocks[-1], "\x01")
+
+class TestEmptySection(TestCase):
+
+    def test_blank(self):
+        self.assertTrue(empty_section.shared)
+        self.assertTrue(empty_section.is_blank())
+
+    def test_frozen(self):
+        self.assertRaises(TypeError, empty_section.set_block, (0, 0, 0), 1)
+        self.assertRaises(TypeError, empty_section.set_skylight, (0, 0, 0), 0)
+        self.assertEqual(empty_section.get_block((0, 0, 0)), 0)
+        self.assertEqual(empty_section.get_skylight((0, 0, 0)), 0xf)
+        self.assertTrue(empty_section.is_blank())
+
+    def test_copy(self):
+        section = empty_section.copy()
+        self.assertFalse(section.shared)
+        section.set_block((0, 0, 0), 1)
+        self.assertEqual(section.get_block((0, 0, 0)), 1)
+
+class TestPackedSection(TestCase):
+
+    def setUp(self):
+        self.s = Section()
+        for i in range(16):
+            self.s.set_block((i, i, 15 - i), i)
+            self.s.set_metadata((i, i, 15 - i), 15 - i)
+        self.p = self.s.pack()
+
+    def test_pack(self):
+        self.assertTrue(isinstance(self.p, PackedSection))
+        self.assertEqual(self.p.occupied, 15)
+        self.assertEqual(self.p.get_block((3, 3, 12)), 3)
+        self.assertEqual(self.p.get_metadata((3, 3, 12)), 12)
+        self.assertEqual(self.p.get_block_index(si(4, 4, 11)), 4)
+
+    def test_pack_too_many(self):
+        self.s.set_block((0, 1, 0), 16)
+        self.assertEqual(self.s.pack(), None)
+
+    def test_strings(self):
+        self.assertEqual(self.p.block_string(), self.s.block_string())
+        self.assertEqual(self.p.metadata_nibbles(),
+                         self.s.metadata_nibbles())
+
+    def test_get_blocks(self):
+        self.assertEqual(self.p.get_blocks((1, 0, 0), (5, 6, 16)),
+                         self.s.get_blocks((1, 0, 0), (5, 6, 16)))
+
+    def test_set_block(self):
+        self.p.set_block((0, 0, 0), 7)
+        self.p.set_block((3, 3, 12), 0)
+        self.assertTrue(isinstance(self.p, PackedSection))
+        self.assertEqual(self.p.get_block((0, 0, 0)), 7)
+        self.assertEqual(self.p.get_block((3, 3, 12)), 0)
+        self.assertEqual(self.p.occupied, 15)
+
+    def test_set_metadata(self):
+        self.p.set_metadata((1, 0, 0), 9)
+        self.p.set_metadata((2, 0, 0), 6)
+        self.assertEqual(self.p.get_metadata((1, 0, 0)), 9)
+        self.assertEqual(self.p.get_metadata((2, 0, 0)), 6)
+        self.assertEqual(self.p.get_metadata((0, 0, 15)), 15)
+
+    def test_set_block_promotes(self):
+        self.p.set_block((0, 1, 0), 16)
+        self.assertFalse(isinstance(self.p, PackedSection))
+        self.assertEqual(self.p.get_block((0, 1, 0)), 16)
+        self.assertEqual(self.p.get_block((3, 3, 12)), 3)
+        self.assertEqual(self.p.get_metadata((3, 3, 12)), 12)
+        self.assertEqual(self.p.occupied, 16)
+
+    def test_arrays_unpack(self):
+        self.p.blocks[0] = 5
+        self.assertFalse(isinstance(self.p, PackedSection))
+        self.assertEqual(self.p.get_block((0, 0, 0)), 5)
+        self.assertEqual(self.p.metadata, self.s.metadata)
+
+    def test_recount(self):
+        self.p.recount()
+        self.assertEqual(self.p.occupied, 15)
+        self.assertTrue(isinstance(self.p, PackedSection))
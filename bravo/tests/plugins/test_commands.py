@@ -1,9 +1,12 @@
+from twisted.internet.defer import fail
 from twisted.trial.unittest import TestCase
 
 import bravo.blocks
 import bravo.ibravo
 import bravo.plugin
 from bravo.entity import Player
+from bravo.errors import SerializerWriteException
+from bravo.plugins.commands import common
 
 class CommandsMockFactory(object):
 
@@ -107,3 +110,55 @@ class TestTime(PluginMixin, TestCase):
         self.hook.chat_command("unittest", ["0", "1"])
 
         self.assertEqual(self.f.day, 1)
+
+class TestQuit(TestCase):
+
+    def setUp(self):
+        self.f = CommandsMockFactory()
+        self.f.broadcast = lambda packet: None
+
+        class MockReactor(object):
+            stopped = False
+
+            def stop(self):
+                self.stopped = True
+
+        self.reactor = MockReactor()
+        self.patch(common, "reactor", self.reactor)
+
+    def test_quit_failed_save(self):
+        """
+        The server still stops if saving the world fails.
+        """
+
+        class MockFlusher(object):
+            def flush_all(self):
+                return fail(IOError("Disk on fire"))
+
+        self.f.world.flusher = MockFlusher()
+
+        list(common.Quit(self.f).console_command([]))
+        self.assertTrue(self.reactor.stopped)
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+class TestSaveAll(TestCase):
+
+    def setUp(self):
+        self.f = CommandsMockFactory()
+
+    def test_save_all_failed(self):
+        """
+        Failing to save everything is logged, rather than reported as done.
+        """
+
+        class MockFlusher(object):
+            backlog = 5
+
+            def flush_all(self):
+                return fail(SerializerWriteException("Couldn't save 5 chunks"))
+
+        self.f.world.flusher = MockFlusher()
+
+        list(common.SaveAll(self.f).console_command([]))
+        self.assertEqual(len(self.flushLoggedErrors(SerializerWriteException)),
+                         1)
@@ -1,11 +1,15 @@
+from StringIO import StringIO
 import unittest
 import shutil
 import tempfile
 import platform
 
+from twisted.internet.defer import DeferredList, inlineCallbacks
 from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase
 
 from bravo.chunk import Chunk
+from bravo.entity import Sign
 from bravo.errors import SerializerReadException
 from bravo.ibravo import ISerializer
 from bravo.nbt import TAG_Compound, TAG_List, TAG_String
@@ -98,6 +102,84 @@ class TestAnvilSerializer(unittest.TestCase):
         self.assertEqual(tag["Level"]["xPos"].value, 1)
         self.assertEqual(tag["Level"]["zPos"].value, 2)
 
+    def test_render_chunk(self):
+        """
+        Rendering a chunk directly gives exactly the same data as rendering
+        its tag.
+        """
+
+        chunk = Chunk(1, 2)
+        chunk.set_block((3, 4, 5), 6)
+        chunk.set_metadata((3, 4, 5), 2)
+        chunk.set_block((3, 40, 5), 7)
+        chunk.heightmap[17] = 40
+        chunk.blocklight[100] = 9
+        sign = Sign(3, 41, 5)
+        sign.text1 = "Hello"
+        chunk.tiles[3, 41, 5] = sign
+        chunk.populated = True
+
+        b = StringIO()
+        self.s._save_chunk_to_tag(chunk).write_file(buffer=b)
+        self.assertEqual(self.s._render_chunk(chunk), b.getvalue())
+
+    def test_render_packed_chunk(self):
+        chunk = Chunk(1, 2)
+        chunk.set_block((3, 4, 5), 6)
+        chunk.set_metadata((3, 4, 5), 2)
+        rendered = self.s._render_chunk(chunk)
+
+        chunk.pack()
+        self.assertEqual(self.s._render_chunk(chunk), rendered)
+
+    def test_save_load_chunk(self):
+        self.folder.child("region").makedirs()
+        self.addCleanup(self.s.close)
+
+        chunk = Chunk(1, 2)
+        chunk.set_block((3, 4, 5), 6)
+        chunk.set_block((3, 20, 5), 7)
+        sign = Sign(3, 21, 5)
+        sign.text1 = "Hello"
+        chunk.tiles[3, 21, 5] = sign
+        chunk.populated = True
+
+        self.s.save_chunk(chunk)
+        loaded = self.s.load_chunk(1, 2)
+        self.assertEqual(loaded.get_block((3, 4, 5)), 6)
+        self.assertEqual(loaded.get_block((3, 20, 5)), 7)
+        self.assertEqual(loaded.tiles[3, 21, 5].text1, "Hello")
+        self.assertTrue(loaded.populated)
+        self.assertEqual([section.occupied for section in loaded.sections],
+                         [1, 1] + [0] * 14)
+
+    def test_save_load_chunk_shaded(self):
+        """
+        Sections of air in shadow are saved along with their skylight.
+        """
+
+        self.folder.child("region").makedirs()
+        self.addCleanup(self.s.close)
+
+        chunk = Chunk(1, 2)
+        chunk.set_block((3, 4, 5), 6)
+        chunk.set_skylight((3, 20, 5), 2)
+        chunk.populated = True
+
+        self.s.save_chunk(chunk)
+        loaded = self.s.load_chunk(1, 2)
+        self.assertEqual(loaded.get_skylight((3, 20, 5)), 2)
+        self.assertEqual(loaded.get_skylight((3, 21, 5)), 0xf)
+        self.assertEqual(loaded.sections[1].shaded, 1)
+        self.assertTrue(loaded.sections[2].shared)
+
+    def test_save_load_chunk_unpopulated(self):
+        self.folder.child("region").makedirs()
+        self.addCleanup(self.s.close)
+
+        self.s.save_chunk(Chunk(1, 2))
+        self.assertFalse(self.s.load_chunk(1, 2).populated)
+
     def test_save_plugin_data(self):
         data = 'Foo\nbar'
         self.s.save_plugin_data('plugin1', data)
@@ -134,3 +216,68 @@ class TestAnvilSerializer(unittest.TestCase):
 
         self.assertRaises(SerializerReadException, self.s.load_player,
                           "unittest")
+
+class TestAnvilSerializerThreaded(TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.folder = FilePath(self.d).child("world")
+
+        plugins = retrieve_plugins(ISerializer)
+        if "anvil" not in plugins:
+            raise unittest.SkipTest("Plugin not present")
+
+        self.s = plugins["anvil"]
+        self.s.connect("file://" + self.folder.path)
+        self.s.start_threads(4)
+
+    def tearDown(self):
+        self.s.close()
+        shutil.rmtree(self.d)
+
+    @inlineCallbacks
+    def test_save_load_chunk(self):
+        chunk = Chunk(1, 2)
+        chunk.set_block((3, 4, 5), 6)
+        yield self.s.save_chunk(chunk)
+        loaded = yield self.s.load_chunk(1, 2)
+        self.assertEqual(loaded.get_block((3, 4, 5)), 6)
+
+    @inlineCallbacks
+    def test_load_chunk_first(self):
+        try:
+            yield self.s.load_chunk(0, 0)
+        except SerializerReadException:
+            pass
+        else:
+            self.fail("Missing chunk was loaded")
+
+    @inlineCallbacks
+    def test_save_same_region_concurrently(self):
+        """
+        Concurrent saves to a single region don't clobber each other.
+        """
+
+        chunks = []
+        for i in range(16):
+            chunk = Chunk(i, 0)
+            chunk.set_block((0, 0, 0), i + 1)
+            chunks.append(chunk)
+
+        yield DeferredList([self.s.save_chunk(c) for c in chunks],
+                           fireOnOneErrback=True)
+
+        for i in range(16):
+            loaded = yield self.s.load_chunk(i, 0)
+            self.assertEqual(loaded.get_block((0, 0, 0)), i + 1)
+
+class TestAnvilSerializerMapped(TestAnvilSerializerThreaded):
+
+    def setUp(self):
+        TestAnvilSerializerThreaded.setUp(self)
+        self.s.map_regions()
+
+    def tearDown(self):
+        # The plugin is shared between tests, so put it back the way it was.
+        self.s._regions.mapped = False
+        TestAnvilSerializerThreaded.tearDown(self)
@@ -3,13 +3,21 @@ from twisted.trial.unittest import TestCase
 import warnings
 
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 from twisted.internet.task import deferLater
+from twisted.test.proto_helpers import StringTransport
 
+from bravo.beta.compression import ChunkCompressor
+from bravo.beta.outbound import PacketQueue
+from bravo.beta.packets import make_packet
 from bravo.beta.protocol import (BetaServerProtocol, BravoProtocol,
                                  STATE_LOCATED)
 from bravo.chunk import Chunk
 from bravo.config import BravoConfigParser
+from bravo.entity import Pickup
 from bravo.errors import BetaClientError
+from bravo.location import Location
+from bravo.utilities.spatial import EntityIndex
 
 class FakeTransport(object):
 
@@ -22,8 +30,17 @@ class FakeTransport(object):
     def loseConnection(self):
         self.lost = True
 
+class FakeWorld(object):
+
+    def __init__(self):
+        self.entity_index = EntityIndex()
+
 class FakeFactory(object):
 
+    def __init__(self):
+        self.compressor = ChunkCompressor()
+        self.world = FakeWorld()
+
     def broadcast(self, packet):
         pass
 
@@ -87,6 +104,30 @@ class TestBetaServerProtocol(TestCase):
         d = deferLater(reactor, 31, cb)
         return d
 
+    def test_make_connection(self):
+        """
+        Writes to the transport are gathered up in a packet queue.
+        """
+
+        p = BetaServerProtocol()
+        self.addCleanup(p.setTimeout, None)
+        p.makeConnection(StringTransport())
+        self.assertTrue(isinstance(p.transport, PacketQueue))
+
+    def test_data_received_fragments(self):
+        """
+        Packets split across several reads are handled once they're whole.
+        """
+
+        pings = []
+        self.p.handlers[0x00] = pings.append
+
+        data = make_packet("ping", pid=42) * 2
+        for i in range(0, len(data), 3):
+            self.p.dataReceived(data[i:i + 3])
+
+        self.assertEqual([ping.pid for ping in pings], [42, 42])
+
     def test_latency_overflow(self):
         """
         Massive latencies should not cause exceptions to be raised.
@@ -123,8 +164,34 @@ class TestBravoProtocol(TestCase):
         Reported by brachiel on IRC.
         """
 
+        self.p.factory = FakeFactory()
         list(self.p.entities_near(2))
 
+    def test_entities_near(self):
+        self.p.factory = FakeFactory()
+        near = Pickup(location=Location.at_block(1, 0, 1))
+        far = Pickup(location=Location.at_block(3, 0, 3))
+        self.p.factory.world.entity_index.add(near)
+        self.p.factory.world.entity_index.add(far)
+        self.p.chunks[0, 0] = Chunk(0, 0)
+
+        self.assertEqual(self.p.entities_near(2), [near])
+
+    def test_entities_near_unloaded(self):
+        """
+        Entities in chunks which the player hasn't loaded aren't near.
+        """
+
+        self.p.factory = FakeFactory()
+        self.p.location = Location.at_block(15, 0, 1)
+        near = Pickup(location=Location.at_block(16, 0, 1))
+        self.p.factory.world.entity_index.add(near)
+        self.p.chunks[0, 0] = Chunk(0, 0)
+        self.assertEqual(self.p.entities_near(2), [])
+
+        self.p.chunks[1, 0] = Chunk(1, 0)
+        self.assertEqual(self.p.entities_near(2), [near])
+
     def test_disable_chunk_invalid(self):
         """
         If invalid data is sent to disable_chunk(), no error should happen.
@@ -145,6 +212,85 @@ class TestBravoProtocolChunks(TestCase):
     def test_trivial(self):
         pass
 
+    def test_send_chunk(self):
+        self.p.factory = FakeFactory()
+        self.p.transport = FakeTransport()
+        self.p.transport.data = []
+
+        c = Chunk(0, 0)
+        self.p.chunks[0, 0] = c
+        d = self.p.send_chunk(c)
+
+        @d.addCallback
+        def cb(none):
+            self.assertEqual(self.p.transport.data, [c.save_to_packet()])
+        return d
+
+    def test_send_chunk_disabled(self):
+        """
+        Chunks which were unloaded while their packet was being built are not
+        sent.
+        """
+
+        self.p.factory = FakeFactory()
+        self.p.transport = FakeTransport()
+        self.p.transport.data = []
+
+        d = self.p.send_chunk(Chunk(0, 0))
+
+        @d.addCallback
+        def cb(none):
+            self.assertEqual(self.p.transport.data, [])
+        return d
+
+    def test_send_chunk_changed(self):
+        """
+        Chunks which changed while their packet was being built are sent with
+        their newer data.
+        """
+
+        self.p.factory = FakeFactory()
+        self.p.factory.compressor.start(1)
+        self.addCleanup(self.p.factory.compressor.stop)
+        self.p.transport = FakeTransport()
+        self.p.transport.data = []
+
+        c = Chunk(0, 0)
+        self.p.chunks[0, 0] = c
+        d = self.p.send_chunk(c)
+        c.set_block((1, 2, 3), 1)
+
+        @d.addCallback
+        def cb(none):
+            self.assertEqual(self.p.transport.data, [c.build_packet()])
+        return d
+
+    def test_enable_chunk_disconnected(self):
+        """
+        Chunks which finish loading after the client has left are dropped.
+        """
+
+        loading = Deferred()
+        watched = []
+
+        self.p.factory = FakeFactory()
+        self.p.factory.world.request_chunk = lambda x, z: loading
+        self.p.factory.watch_chunk = lambda p, x, z: watched.append((x, z))
+        self.p.factory.teardown_protocol = lambda p: None
+        self.p.transport = FakeTransport()
+        self.p.transport.data = []
+
+        d = self.p.enable_chunk(0, 0)
+        self.p.connectionLost()
+        loading.callback(Chunk(0, 0))
+
+        @d.addCallback
+        def cb(none):
+            self.assertEqual(watched, [])
+            self.assertEqual(self.p.chunks, {})
+            self.assertEqual(self.p.transport.data, [])
+        return d
+
     def test_ascend_zero(self):
         """
         ``ascend()`` can take a count of zero to ensure that the client is
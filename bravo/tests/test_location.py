@@ -1,5 +1,6 @@
 from twisted.trial import unittest
 
+from copy import deepcopy
 import math
 
 from bravo.location import Location, Orientation, Position
@@ -129,6 +130,27 @@ class TestLocation(unittest.TestCase):
         self.assertEqual(other.pos.x, -32)
         self.assertEqual(other.pos.z, 0)
 
+    def test_tracker(self):
+        moved = []
+
+        class Tracker(object):
+            def moved(self, location):
+                moved.append(location.pos)
+
+        self.l.tracker = Tracker()
+        self.l.pos = Position(1, 2, 3)
+        self.assertEqual(moved, [Position(1, 2, 3)])
+
+    def test_tracker_not_copied(self):
+        """
+        Copies of a tracked location, such as those made by
+        ``in_front_of()`` and by serializers, aren't tracked.
+        """
+
+        self.l.tracker = object()
+        self.assertTrue(self.l.in_front_of(1).tracker is None)
+        self.assertTrue(deepcopy(self.l).tracker is None)
+
 class TestLocationConstructors(unittest.TestCase):
 
     def test_at_block(self):
@@ -0,0 +1,205 @@
+from twisted.trial import unittest
+
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
+from bravo.entity import Chuck
+from bravo.errors import ChunkNotLoaded
+from bravo.location import Location, Position
+from bravo.mobmanager import MobManager
+from bravo.utilities.spatial import EntityIndex
+from bravo.utilities.temporal import TickScheduler
+
+class MockFactory(object):
+
+    def __init__(self):
+        self.watchers = {}
+        self.packets = []
+
+    def protocols_for_chunk(self, x, z):
+        return self.watchers.get((x, z), frozenset())
+
+    def broadcast(self, packet):
+        self.packets.append(packet)
+
+class MockWorld(object):
+
+    def __init__(self):
+        self.factory = MockFactory()
+        self.player_index = EntityIndex()
+        self.scheduler = TickScheduler()
+        self.scheduler.add_subsystem("mobs", 0.2)
+        self.chunks = {}
+        self.boxes = []
+
+    def sync_any_solid(self, lower, upper, passable):
+        self.boxes.append((tuple(lower), tuple(upper)))
+        x, y, z = lower
+        key = x // 16, z // 16
+        if key not in self.chunks:
+            raise ChunkNotLoaded()
+        return self.chunks[key].any_solid(lower, upper, passable)
+
+    def sync_request_chunk(self, coords):
+        x, y, z = coords
+        key = x // 16, z // 16
+        if key not in self.chunks:
+            raise ChunkNotLoaded()
+        return self.chunks[key]
+
+class TestMobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.world = MockWorld()
+        self.manager = MobManager()
+        self.manager.world = self.world
+
+        self.mob = Chuck(location=Location.at_block(8, 64, 8))
+
+    def running(self, mob):
+        return self.world.scheduler.scheduled("mobs", mob.update)
+
+    def test_trivial(self):
+        pass
+
+    def test_start_watched(self):
+        self.world.factory.watchers[0, 0] = set(["player"])
+        self.manager.start_mob(self.mob)
+
+        self.assertTrue(self.running(self.mob))
+        self.assertFalse(self.mob in self.manager.sleeping)
+
+    def test_start_unwatched(self):
+        """
+        Mobs in chunks which nobody has loaded start out asleep.
+        """
+
+        self.manager.start_mob(self.mob)
+
+        self.assertFalse(self.running(self.mob))
+        self.assertTrue(self.mob in self.manager.sleeping)
+
+    def test_start_without_factory(self):
+        self.world.factory = None
+        self.manager.start_mob(self.mob)
+        self.assertFalse(self.running(self.mob))
+
+    def test_wake_chunk(self):
+        self.manager.start_mob(self.mob)
+        self.manager.wake_chunk(0, 0)
+
+        self.assertTrue(self.running(self.mob))
+        self.assertFalse(self.manager.sleeping)
+
+    def test_wake_other_chunk(self):
+        self.manager.start_mob(self.mob)
+        self.manager.wake_chunk(1, 0)
+        self.assertFalse(self.running(self.mob))
+
+    def test_sleep_chunk(self):
+        self.world.factory.watchers[0, 0] = set(["player"])
+        self.manager.start_mob(self.mob)
+        self.manager.sleep_chunk(0, 0)
+
+        self.assertFalse(self.running(self.mob))
+        self.assertTrue(self.mob in self.manager.sleeping)
+
+    def test_stop_mob(self):
+        self.world.factory.watchers[0, 0] = set(["player"])
+        self.manager.start_mob(self.mob)
+        self.manager.stop_mob(self.mob)
+
+        self.assertFalse(self.running(self.mob))
+        self.assertFalse(self.manager.mobs)
+
+    def test_stop_sleeping_mob(self):
+        self.manager.start_mob(self.mob)
+        self.manager.stop_mob(self.mob)
+
+        self.assertFalse(self.manager.sleeping)
+        self.assertFalse(self.manager.mobs)
+
+    def test_correct_origin_chunk(self):
+        first, second = Chunk(0, 0), Chunk(1, 0)
+        self.world.chunks[0, 0] = first
+        self.world.chunks[1, 0] = second
+        first.entities.add(self.mob)
+
+        self.world.factory.watchers[0, 0] = set(["player"])
+        self.world.factory.watchers[1, 0] = set(["player"])
+        self.manager.start_mob(self.mob)
+
+        self.mob.location.pos = Position(17 * 32, 64 * 32, 8 * 32)
+        self.manager.correct_origin_chunk(self.mob)
+
+        self.assertEqual(self.mob.chunk_coords, (1, 0))
+        self.assertEqual(first.entities, set())
+        self.assertEqual(second.entities, set([self.mob]))
+        self.assertTrue(self.running(self.mob))
+
+    def test_wander_into_unwatched(self):
+        """
+        Mobs which wander into chunks that nobody has loaded go to sleep.
+        """
+
+        self.world.chunks[0, 0] = Chunk(0, 0)
+        self.world.chunks[1, 0] = Chunk(1, 0)
+
+        self.world.factory.watchers[0, 0] = set(["player"])
+        self.manager.start_mob(self.mob)
+
+        self.mob.location.pos = Position(17 * 32, 64 * 32, 8 * 32)
+        self.manager.correct_origin_chunk(self.mob)
+
+        self.assertFalse(self.running(self.mob))
+        self.assertTrue(self.mob in self.manager.sleeping)
+
+        self.manager.wake_chunk(1, 0)
+        self.assertTrue(self.running(self.mob))
+
+    def test_sleeping_mob_is_quiet(self):
+        """
+        Sleeping mobs don't send any packets.
+        """
+
+        self.manager.start_mob(self.mob)
+        self.world.scheduler._tick(100)
+        self.assertEqual(self.world.factory.packets, [])
+
+    def test_stats(self):
+        self.manager.start_mob(self.mob)
+        self.assertEqual(self.manager.stats(), {"mobs": 1, "sleeping": 1})
+
+    def check_block_collision(self):
+        position = Position(8 * 32, 64 * 32, 8 * 32)
+        return self.manager.check_block_collision(position, (-10, 0, -10),
+                                                  (16, 32, 16))
+
+    def test_block_collision_box(self):
+        """
+        Collision boxes are given in pixels, and run from the block holding
+        their lower corner up to, but not including, the block holding their
+        upper corner.
+        """
+
+        chunk = self.world.chunks[0, 0] = Chunk(0, 0)
+        chunk.set_block((8, 64, 8), blocks["stone"].slot)
+
+        self.assertTrue(self.check_block_collision())
+        self.assertEqual(self.world.boxes, [((7, 64, 7), (8, 65, 8))])
+
+    def test_block_collision_solid(self):
+        chunk = self.world.chunks[0, 0] = Chunk(0, 0)
+        chunk.set_block((7, 64, 7), blocks["stone"].slot)
+        self.assertFalse(self.check_block_collision())
+
+    def test_block_collision_nonsolid(self):
+        """
+        Any block other than air is in the way, even if it isn't solid.
+        """
+
+        chunk = self.world.chunks[0, 0] = Chunk(0, 0)
+        chunk.set_block((7, 64, 7), blocks["torch"].slot)
+        self.assertFalse(self.check_block_collision())
+
+    def test_block_collision_unloaded(self):
+        self.assertRaises(ChunkNotLoaded, self.check_block_collision)
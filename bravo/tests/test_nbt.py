@@ -3,8 +3,11 @@ from StringIO import StringIO
 import tempfile
 import unittest
 
-from bravo.nbt import NBTFile, MalformedFileError
-from bravo.nbt import TAG_Compound
+from bravo.nbt import NBTFile, NBTWriter, MalformedFileError, read_nbt
+from bravo.nbt import unpack_nbt
+from bravo.nbt import TAG_Compound, TAG_List, TAG_Byte, TAG_Byte_Array
+from bravo.nbt import TAG_Double, TAG_Float, TAG_Int, TAG_Long, TAG_Short
+from bravo.nbt import TAG_String, TAG_COMPOUND, TAG_INT
 
 bigtest = """
 H4sIAAAAAAAAAO1Uz08aQRR+wgLLloKxxBBjzKu1hKXbzUIRibGIFiyaDRrYqDGGuCvDgi67Znew
@@ -97,5 +100,132 @@ class TestTAGCompound(unittest.TestCase):
         self.tag["test"] = TAG_Compound()
         self.assertTrue("test" in self.tag)
 
+def unpack_lazy(value):
+    """
+    Unpack a lazily parsed value the same way that ``unpack_nbt()`` unpacks
+    tags, for comparisons.
+    """
+
+    if isinstance(value, list):
+        return [unpack_lazy(i) for i in value]
+    elif isinstance(value, buffer):
+        return str(value)
+    elif hasattr(value, "entries"):
+        return dict((unicode(k), unpack_lazy(value[k])) for k in value.keys())
+    else:
+        return value
+
+class TestReadNBT(unittest.TestCase):
+
+    def setUp(self):
+        self.data = GzipFile(fileobj=StringIO(bigtest)).read()
+
+    def test_read_big(self):
+        compound = read_nbt(self.data)
+        expected = unpack_nbt(NBTFile(buffer=StringIO(self.data)))
+        self.assertEqual(unpack_lazy(compound), expected)
+
+    def test_read_buffer(self):
+        compound = read_nbt(buffer(self.data))
+        self.assertEqual(len(compound.keys()), 11)
+
+    def test_byte_array_slice(self):
+        compound = read_nbt(self.data)
+        for key in compound.keys():
+            value = compound[key]
+            if isinstance(value, buffer):
+                break
+        else:
+            self.fail("No byte array in test data")
+        self.assertEqual(len(value), 1000)
+
+    def test_tag(self):
+        compound = read_nbt(self.data)
+        tag = compound.tag("listTest (compound)")
+        self.assertTrue(isinstance(tag, TAG_List))
+        self.assertEqual(tag.name, "listTest (compound)")
+        self.assertEqual(len(tag.tags), 2)
+
+    def test_empty_string(self):
+        golden_value = "\x0A\0\x04Test\x08\0\x0Cempty string\0\0\0"
+        compound = read_nbt(golden_value)
+        self.assertEqual(compound["empty string"], u"")
+
+    def test_not_compound(self):
+        self.assertRaises(MalformedFileError, read_nbt, "\x08\0\0\0\0")
+
+    def test_truncated(self):
+        self.assertRaises(MalformedFileError, read_nbt, self.data[:-10])
+
+    def test_truncated_array(self):
+        data = "\x0A\0\0\x07\0\x01a\0\0\0\x10abc\0"
+        self.assertRaises(MalformedFileError, read_nbt, data)
+
+class TestNBTWriter(unittest.TestCase):
+
+    def setUp(self):
+        # Start small, to exercise growing the buffer.
+        self.w = NBTWriter(16)
+
+    def render(self, tag):
+        b = StringIO()
+        tag.write_file(buffer=b)
+        return b.getvalue()
+
+    def test_empty(self):
+        tag = NBTFile()
+        tag.name = "Test"
+        self.w.compound("Test")
+        self.w.end()
+        self.assertEqual(self.w.getvalue(), self.render(tag))
+
+    def test_values(self):
+        tag = NBTFile()
+        tag.name = ""
+        tag["byte"] = TAG_Byte(-3)
+        tag["short"] = TAG_Short(300)
+        tag["int"] = TAG_Int(70000)
+        tag["long"] = TAG_Long(2 ** 40)
+        tag["float"] = TAG_Float(0.5)
+        tag["double"] = TAG_Double(0.25)
+        tag["array"] = TAG_Byte_Array()
+        tag["array"].value = "\x00\x01\x02" * 100
+        tag["string"] = TAG_String(u"h\xe9llo")
+
+        self.w.compound("")
+        self.w.byte("byte", -3)
+        self.w.short("short", 300)
+        self.w.int("int", 70000)
+        self.w.long("long", 2 ** 40)
+        self.w.float("float", 0.5)
+        self.w.double("double", 0.25)
+        self.w.byte_array("array", "\x00\x01\x02" * 100)
+        self.w.string("string", u"h\xe9llo")
+        self.w.end()
+
+        self.assertEqual(self.w.getvalue(), self.render(tag))
+
+    def test_lists(self):
+        tag = NBTFile()
+        tag.name = ""
+        tag["ints"] = TAG_List(type=TAG_Int)
+        tag["ints"].tags = [TAG_Int(1), TAG_Int(2)]
+        tag["compounds"] = TAG_List(type=TAG_Compound)
+        inner = TAG_Compound()
+        inner["x"] = TAG_Byte(1)
+        tag["compounds"].tags = [inner, inner]
+
+        self.w.compound("")
+        self.w.list("ints", TAG_INT, 2)
+        self.w.int(None, 1)
+        self.w.int(None, 2)
+        self.w.list("compounds", TAG_COMPOUND, 2)
+        self.w.payload(inner)
+        self.w.byte("x", 1)
+        self.w.end()
+        self.w.end()
+
+        self.assertEqual(self.w.getvalue(), self.render(tag))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,21 @@
 from twisted.trial.unittest import TestCase
 
+import os
+
 from twisted.python.filepath import FilePath
 
-from bravo.region import Region
+from bravo.region import FreeList, MissingChunk, Region, RegionCache
 
 class TestRegion(TestCase):
 
+    mapped = False
+
     def setUp(self):
         self.fp = FilePath(self.mktemp())
-        self.region = Region(self.fp)
+        self.region = Region(self.fp, self.mapped)
+
+    def tearDown(self):
+        self.region.close()
 
     def test_trivial(self):
         pass
@@ -17,3 +24,251 @@ class TestRegion(TestCase):
         self.region.create()
         with self.fp.open("r") as handle:
             self.assertEqual(handle.read(), "\x00" * 8192)
+
+    def test_put_get_chunk(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "chunk data")
+        self.assertEqual(self.region.get_chunk(1, 2), "chunk data")
+
+    def test_get_chunk_missing(self):
+        self.region.create()
+        self.assertRaises(MissingChunk, self.region.get_chunk, 1, 2)
+
+    def test_open_read_only(self):
+        """
+        Regions are opened for reading only until they are written to.
+        """
+
+        self.region.create()
+        self.assertRaises(MissingChunk, self.region.get_chunk, 1, 2)
+        self.assertEqual(self.region.handle.mode, "rb")
+
+        self.region.put_chunk(1, 2, "chunk data")
+        self.assertEqual(self.region.handle.mode, "r+b")
+        self.assertEqual(self.region.get_chunk(1, 2), "chunk data")
+
+    def test_read_only_file(self):
+        """
+        Regions in read-only files can be read.
+        """
+
+        self.region.create()
+        self.region.put_chunk(1, 2, "chunk data")
+        self.region.close()
+        self.fp.chmod(0444)
+
+        region = Region(self.fp, self.mapped)
+        self.assertEqual(region.get_chunk(1, 2), "chunk data")
+        region.close()
+
+    def test_put_chunk_reopened(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "first")
+        self.region.put_chunk(2, 1, "second")
+        self.region.close()
+
+        region = Region(self.fp, self.mapped)
+        self.assertEqual(region.get_chunk(1, 2), "first")
+        self.assertEqual(region.get_chunk(2, 1), "second")
+        self.assertEqual(region.end, 4)
+        region.close()
+
+    def test_put_chunk_grow(self):
+        """
+        Chunks which outgrow their pages are moved to the end of the file.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "small")
+        self.region.put_chunk(1, 0, "small")
+        # Random data doesn't compress, so this needs two pages.
+        big = os.urandom(6000)
+        self.region.put_chunk(0, 0, big)
+        self.assertEqual(self.region.positions[0, 0][0], 4)
+        self.assertEqual(list(self.region.free_pages), [2])
+        self.assertEqual(self.region.get_chunk(0, 0), big)
+        self.assertEqual(self.region.get_chunk(1, 0), "small")
+
+    def test_put_chunk_reuse(self):
+        """
+        Freed pages are reused before the file grows.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "small")
+        self.region.put_chunk(1, 0, "small")
+        self.region.put_chunk(0, 0, os.urandom(6000))
+        self.region.put_chunk(2, 0, "small")
+        self.assertEqual(self.region.positions[2, 0][0], 2)
+        self.assertEqual(self.region.end, 6)
+
+    def test_put_chunk_grow_trailing(self):
+        """
+        Chunks growing at the end of the file grow in place.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "small")
+        self.region.put_chunk(0, 0, os.urandom(6000))
+        self.assertEqual(self.region.positions[0, 0], (2, 2))
+        self.assertEqual(len(self.region.free_pages), 0)
+
+    def test_load_pages_free(self):
+        self.region.create()
+        for x in range(4):
+            self.region.put_chunk(x, 0, "small")
+        self.region.put_chunk(1, 0, os.urandom(6000))
+        self.region.put_chunk(3, 0, os.urandom(6000))
+        self.region.close()
+
+        region = Region(self.fp, self.mapped)
+        region.load_pages()
+        self.assertEqual(region.free_pages.runs, [[3, 1], [5, 1]])
+        self.assertEqual(region.end, 10)
+        region.close()
+
+    def test_compact(self):
+        self.region.create()
+        for x in range(4):
+            self.region.put_chunk(x, 0, "chunk %d" % x)
+        big = os.urandom(6000)
+        self.region.put_chunk(1, 0, big)
+        self.region.put_chunk(3, 0, big)
+
+        before = self.fp.getsize()
+        reclaimed = self.region.compact()
+        self.fp.restat()
+        self.assertEqual(reclaimed, before - self.fp.getsize())
+        self.assertEqual(self.region.end, 8)
+        self.assertEqual(self.fp.getsize(), 8 * 4096)
+        self.assertEqual(len(self.region.free_pages), 0)
+
+        region = Region(self.fp, self.mapped)
+        self.assertEqual(region.get_chunk(0, 0), "chunk 0")
+        self.assertEqual(region.get_chunk(1, 0), big)
+        self.assertEqual(region.get_chunk(2, 0), "chunk 2")
+        self.assertEqual(region.get_chunk(3, 0), big)
+        self.assertEqual(len(region.free_pages), 0)
+        region.close()
+
+    def test_compact_empty(self):
+        self.region.create()
+        self.assertEqual(self.region.compact(), 0)
+        self.assertEqual(self.fp.getsize(), 8192)
+
+class TestRegionMapped(TestRegion):
+
+    mapped = True
+
+    def test_get_chunk_mapped(self):
+        self.region.create()
+        self.region.put_chunk(1, 2, "chunk data")
+        self.region.close()
+
+        self.assertEqual(self.region.get_chunk(1, 2), "chunk data")
+        self.assertNotEqual(self.region.map, None)
+
+    def test_get_chunk_remap(self):
+        """
+        Chunks written past the end of the mapping are still readable.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "first")
+        self.assertEqual(self.region.get_chunk(0, 0), "first")
+        size = len(self.region.map)
+
+        self.region.put_chunk(1, 0, "second")
+        self.assertEqual(self.region.get_chunk(1, 0), "second")
+        self.assertTrue(len(self.region.map) > size)
+
+    def test_get_chunk_rewritten(self):
+        """
+        Chunks rewritten in place are seen through the existing mapping.
+        """
+
+        self.region.create()
+        self.region.put_chunk(0, 0, "first")
+        self.region.put_chunk(1, 0, "second")
+        self.assertEqual(self.region.get_chunk(0, 0), "first")
+        self.region.put_chunk(0, 0, "third")
+        self.assertEqual(self.region.get_chunk(0, 0), "third")
+
+class TestFreeList(TestCase):
+
+    def setUp(self):
+        self.fl = FreeList()
+
+    def test_free_merge(self):
+        self.fl.free(2, 2)
+        self.fl.free(6, 2)
+        self.fl.free(4, 2)
+        self.assertEqual(self.fl.runs, [[2, 6]])
+
+    def test_free_separate(self):
+        self.fl.free(6, 1)
+        self.fl.free(2, 1)
+        self.assertEqual(self.fl.runs, [[2, 1], [6, 1]])
+        self.assertEqual(list(self.fl), [2, 6])
+        self.assertTrue(6 in self.fl)
+        self.assertFalse(5 in self.fl)
+
+    def test_allocate_first_fit(self):
+        self.fl.free(2, 1)
+        self.fl.free(4, 3)
+        self.fl.free(8, 2)
+        self.assertEqual(self.fl.allocate(2), 4)
+        self.assertEqual(self.fl.runs, [[2, 1], [6, 1], [8, 2]])
+
+    def test_allocate_exact(self):
+        self.fl.free(4, 2)
+        self.assertEqual(self.fl.allocate(2), 4)
+        self.assertEqual(self.fl.runs, [])
+
+    def test_allocate_none(self):
+        self.fl.free(4, 2)
+        self.assertEqual(self.fl.allocate(3), None)
+
+    def test_truncate(self):
+        self.fl.free(4, 2)
+        self.assertEqual(self.fl.truncate(6), 4)
+        self.assertEqual(self.fl.runs, [])
+        self.assertEqual(self.fl.truncate(6), 6)
+
+class TestRegionCache(TestCase):
+
+    def setUp(self):
+        self.cache = RegionCache(2)
+        self.fps = [FilePath(self.mktemp()) for i in range(3)]
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_create(self):
+        region = self.cache.get(self.fps[0], create=True)
+        self.assertTrue(self.fps[0].exists())
+        self.assertIs(self.cache.get(self.fps[0]), region)
+
+    def test_get_missing(self):
+        self.assertRaises(IOError, self.cache.get, self.fps[0])
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evict_oldest(self):
+        first = self.cache.get(self.fps[0], create=True)
+        self.cache.get(self.fps[1], create=True)
+        self.cache.get(self.fps[2], create=True)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIs(first.handle, None)
+
+    def test_get_mapped(self):
+        self.cache.mapped = True
+        region = self.cache.get(self.fps[0], create=True)
+        self.assertTrue(region.mapped)
+
+    def test_evict_busy(self):
+        first = self.cache.get(self.fps[0], create=True)
+        self.cache.busy = lambda region: region is first
+        self.cache.get(self.fps[1], create=True)
+        self.cache.get(self.fps[2], create=True)
+        self.assertIs(self.cache.get(self.fps[0]), first)
+        self.assertEqual(len(self.cache), 2)
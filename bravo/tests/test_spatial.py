@@ -1,6 +1,11 @@
 import unittest
 
-from bravo.utilities.spatial import Block2DSpatialDict, Block3DSpatialDict
+from copy import deepcopy
+
+from bravo.entity import Pickup
+from bravo.location import Location, Position
+from bravo.utilities.spatial import (Block2DSpatialDict, Block3DSpatialDict,
+                                     EntityIndex)
 
 class TestBlock2DSpatialDict(unittest.TestCase):
 
@@ -77,3 +82,135 @@ class TestBlock3DSpatialDict(unittest.TestCase):
         self.sd[0, 64, 0] = "first"
         results = list(self.sd.itervaluesnear((-3, 61, -3), 9))
         self.assertTrue("first" in results)
+
+class TestEntityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = EntityIndex()
+
+    def entity(self, x, y, z):
+        entity = Pickup(location=Location.at_block(x, y, z))
+        self.index.add(entity)
+        return entity
+
+    def test_trivial(self):
+        pass
+
+    def test_add(self):
+        entity = self.entity(1, 2, 3)
+        self.assertTrue(entity in self.index)
+        self.assertEqual(len(self.index), 1)
+        self.assertTrue(entity.location.tracker is self.index)
+
+    def test_add_twice(self):
+        entity = self.entity(1, 2, 3)
+        self.index.add(entity)
+        self.assertEqual(list(self.index), [entity])
+
+    def test_discard(self):
+        entity = self.entity(1, 2, 3)
+        self.index.discard(entity)
+        self.assertFalse(entity in self.index)
+        self.assertFalse(self.index.buckets)
+        self.assertTrue(entity.location.tracker is None)
+
+    def test_discard_missing(self):
+        self.index.discard(Pickup())
+
+    def test_moved(self):
+        entity = self.entity(1, 2, 3)
+        entity.location.pos = Position(32 * 40, 0, 32 * -20)
+        self.assertEqual(self.index.buckets.keys(), [(2, -2)])
+        self.assertEqual(list(self.index.iternear(Position(32 * 40, 0,
+            32 * -20), 1)), [entity])
+
+    def test_copy_untracked(self):
+        entity = self.entity(1, 2, 3)
+        other = deepcopy(entity)
+        other.location.pos = Position(32 * 40, 0, 0)
+        self.assertEqual(self.index.buckets.keys(), [(0, 0)])
+
+    def test_iternear(self):
+        first = self.entity(0, 0, 0)
+        second = self.entity(2, 0, 0)
+        self.entity(20, 0, 0)
+
+        near = set(self.index.iternear(Position(32, 0, 0), 32))
+        self.assertEqual(near, set([first, second]))
+
+    def test_iternear_boundary(self):
+        """
+        Entities just across a bucket boundary are found.
+        """
+
+        entity = self.entity(16, 0, 0)
+        near = list(self.index.iternear(Position(15 * 32, 0, 0), 32))
+        self.assertEqual(near, [entity])
+
+    def test_iternear_negative(self):
+        entity = self.entity(-1, 0, -1)
+        near = list(self.index.iternear(Position(0, 0, 0), 64))
+        self.assertEqual(near, [entity])
+
+    def test_iternear_huge(self):
+        entity = self.entity(1000, 0, 1000)
+        near = list(self.index.iternear(Position(0, 0, 0), 32 * 10000))
+        self.assertEqual(near, [entity])
+
+    def test_nearest(self):
+        first = self.entity(5, 0, 0)
+        second = self.entity(0, 0, 30)
+        third = self.entity(-40, 0, 0)
+
+        origin = Position(0, 0, 0)
+        self.assertEqual(self.index.nearest(origin), [first])
+        self.assertEqual(self.index.nearest(origin, 3),
+                         [first, second, third])
+
+    def test_nearest_across_buckets(self):
+        """
+        An entity in a neighboring bucket can be nearer than one in the
+        same bucket.
+        """
+
+        self.entity(1, 0, 1)
+        neighbor = self.entity(16, 0, 15)
+        self.assertEqual(self.index.nearest(Position(15 * 32, 0, 15 * 32)),
+                         [neighbor])
+
+    def test_nearest_radius(self):
+        self.entity(10, 0, 0)
+        self.assertEqual(self.index.nearest(Position(0, 0, 0), 1, 32 * 9),
+                         [])
+
+    def test_nearest_far(self):
+        """
+        Far away entities are found without searching every bucket between.
+        """
+
+        entity = self.entity(100000, 0, 100000)
+        self.assertEqual(self.index.nearest(Position(0, 0, 0)), [entity])
+
+    def test_nearest_empty(self):
+        self.assertEqual(self.index.nearest(Position(0, 0, 0)), [])
+
+    def test_nearest_brute_force(self):
+        """
+        The nearest entities are the same ones that a linear scan finds.
+        """
+
+        import random
+        r = random.Random(42)
+
+        entities = [self.entity(r.randint(-200, 200), r.randint(0, 127),
+                                r.randint(-200, 200)) for i in range(200)]
+
+        for i in range(20):
+            position = Position(r.randint(-6400, 6400), 64 * 32,
+                                r.randint(-6400, 6400))
+            expected = sorted(entities,
+                key=lambda e: position.distance(e.location.pos))[:5]
+            distances = [position.distance(e.location.pos)
+                         for e in self.index.nearest(position, 5)]
+            self.assertEqual(distances,
+                [position.distance(e.location.pos) for e in expected])
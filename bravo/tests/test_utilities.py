@@ -70,6 +70,26 @@ class TestBitTwiddling(unittest.TestCase):
 
         self.assertEqual(pack_nibbles(array("B", [0xff, 0xff])), "\xff")
 
+    def test_pack_nibbles_odd(self):
+        self.assertEqual(pack_nibbles(array("B", [1, 6, 3])), "a\x03")
+
+    def test_pack_nibbles_list(self):
+        self.assertEqual(pack_nibbles([1, 6]), "a")
+
+    def test_unpack_nibbles_buffer(self):
+        self.assertEqual(unpack_nibbles(buffer("xa", 1)), array("B", [1, 6]))
+
+    def test_unpack_nibbles_bytearray(self):
+        self.assertEqual(unpack_nibbles(bytearray("a")), array("B", [1, 6]))
+
+    def test_unpack_nibbles_array(self):
+        self.assertEqual(unpack_nibbles(array("B", [0x61])),
+                         array("B", [1, 6]))
+
+    def test_nibble_reflexivity_all_bytes(self):
+        data = "".join(chr(i) for i in range(256))
+        self.assertEqual(pack_nibbles(unpack_nibbles(data)), data)
+
 class TestStringMunging(unittest.TestCase):
 
     def test_sanitize_chat_color_control_at_end(self):
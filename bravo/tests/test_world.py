@@ -1,14 +1,18 @@
 from twisted.trial import unittest
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import Deferred, fail, inlineCallbacks
+from twisted.internet.task import Clock
 
 from array import array
 from itertools import product
 import os
 
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
 from bravo.config import BravoConfigParser
-from bravo.errors import ChunkNotLoaded
-from bravo.world import ChunkCache, World
+from bravo.errors import ChunkNotLoaded, SerializerWriteException
+from bravo.geometry.section import PackedSection
+from bravo.world import ChunkCache, ImpossibleCoordinates, World
 
 
 class MockChunk(object):
@@ -40,6 +44,132 @@ class TestChunkCache(unittest.TestCase):
         cc.unpin(chunk)
         self.assertIs(cc.get((1, 2)), chunk)
 
+    def test_put_single(self):
+        cc = ChunkCache()
+        chunk = MockChunk(1, 2)
+        cc.put(chunk)
+        self.assertIs(cc.get((1, 2)), chunk)
+
+    def test_put_evicts_oldest(self):
+        cc = ChunkCache(2)
+        first, second, third = [MockChunk(i, 0) for i in range(3)]
+        cc.put(first)
+        cc.put(second)
+        cc.put(third)
+        self.assertIs(cc.get((0, 0)), None)
+        self.assertIs(cc.get((1, 0)), second)
+        self.assertIs(cc.get((2, 0)), third)
+        self.assertEqual(cc.evictions, 1)
+
+    def test_put_second_chance(self):
+        """
+        Chunks which were looked up since the last sweep survive eviction.
+        """
+
+        cc = ChunkCache(2)
+        first, second, third = [MockChunk(i, 0) for i in range(3)]
+        cc.put(first)
+        cc.put(second)
+        cc.get((0, 0))
+        cc.put(third)
+        self.assertIs(cc.get((0, 0)), first)
+        self.assertIs(cc.get((1, 0)), None)
+
+    def test_dirty_not_evicted(self):
+        cc = ChunkCache(1)
+        first, second = MockChunk(0, 0), MockChunk(1, 0)
+        cc.put(first)
+        cc.dirtied(first)
+        cc.put(second)
+        self.assertIs(cc.get((0, 0)), first)
+
+    def test_cleaned_kept(self):
+        cc = ChunkCache()
+        chunk = MockChunk(1, 2)
+        cc.dirtied(chunk)
+        cc.cleaned(chunk)
+        self.assertIs(cc.get((1, 2)), chunk)
+
+    def test_busy_not_evicted(self):
+        cc = ChunkCache(1)
+        cc.busy = lambda coords: coords == (0, 0)
+        first, second = MockChunk(0, 0), MockChunk(1, 0)
+        cc.put(first)
+        cc.put(second)
+        self.assertIs(cc.get((0, 0)), first)
+        self.assertIs(cc.get((1, 0)), None)
+
+    def test_evicted_hook(self):
+        cc = ChunkCache(1)
+        evicted = []
+        cc.evicted = evicted.append
+        first, second = MockChunk(0, 0), MockChunk(1, 0)
+        cc.put(first)
+        cc.put(second)
+        self.assertEqual(evicted, [first])
+
+    def test_nothing_evictable(self):
+        cc = ChunkCache(1)
+        cc.busy = lambda coords: True
+        cc.put(MockChunk(0, 0))
+        cc.put(MockChunk(1, 0))
+        self.assertEqual(len(cc), 2)
+        self.assertEqual(cc.evictions, 0)
+
+    def test_busy_released(self):
+        cc = ChunkCache(1)
+        busy = set([(0, 0)])
+        cc.busy = busy.__contains__
+        first, second, third = [MockChunk(i, 0) for i in range(3)]
+        cc.put(first)
+        cc.put(second)
+
+        busy.clear()
+        cc.released((0, 0))
+        cc.put(third)
+        self.assertIs(cc.get((0, 0)), None)
+
+    def test_mostly_busy_put_cost(self):
+        """
+        Chunks which can't be evicted aren't checked again on every put.
+        """
+
+        calls = []
+
+        def busy(coords):
+            calls.append(coords)
+            return coords[0] < 1000
+
+        cc = ChunkCache(10)
+        cc.busy = busy
+        for i in range(1000):
+            cc.put(MockChunk(i, 0))
+
+        del calls[:]
+        for i in range(1000, 1100):
+            cc.put(MockChunk(i, 0))
+        self.assertTrue(len(calls) <= 100)
+        self.assertEqual(cc.evictions, 100)
+
+    def test_counters(self):
+        cc = ChunkCache()
+        cc.put(MockChunk(1, 2))
+        cc.get((1, 2))
+        cc.get((2, 1))
+        self.assertEqual(cc.hits, 1)
+        self.assertEqual(cc.misses, 1)
+
+    def test_peek(self):
+        cc = ChunkCache()
+        chunk = Chunk(1, 2)
+        cc.put(chunk)
+        cc._referenced.clear()
+
+        self.assertIs(cc.peek((1, 2)), chunk)
+        self.assertIs(cc.peek((2, 1)), None)
+        self.assertEqual((cc.hits, cc.misses), (0, 0))
+        self.assertFalse((1, 2) in cc._referenced)
+
 
 class TestWorldChunks(unittest.TestCase):
 
@@ -76,6 +206,31 @@ class TestWorldChunks(unittest.TestCase):
         second = yield self.w.request_chunk(0, 0)
         self.assertIs(first, second)
 
+    @inlineCallbacks
+    def test_request_chunk_postprocess_failed(self):
+        """
+        A chunk which fails to be brought into the world can be requested
+        again.
+        """
+
+        chunk = Chunk(1, 1)
+        chunk.populated = True
+        yield self.w.serializer.save_chunk(chunk)
+
+        def broken(chunk):
+            raise ValueError("Broken chunk")
+        self.patch(self.w, "postprocess_chunk", broken)
+
+        d = self.w.request_chunk(1, 1)
+        yield self.assertFailure(d, ValueError)
+        self.assertFalse((1, 1) in self.w._pending_chunks)
+
+        # A cached chunk would skip the pending chunks altogether.
+        self.w._cache = ChunkCache()
+        self.patch(self.w, "postprocess_chunk", lambda chunk: chunk)
+        chunk = yield self.w.request_chunk(1, 1)
+        self.assertEqual((chunk.x, chunk.z), (1, 1))
+
     @inlineCallbacks
     def test_get_block(self):
         chunk = yield self.w.request_chunk(0, 0)
@@ -204,6 +359,60 @@ class TestWorldChunks(unittest.TestCase):
     def test_sync_get_block_unloaded(self):
         self.assertRaises(ChunkNotLoaded, self.w.sync_get_block, (0, 0, 0))
 
+    @inlineCallbacks
+    def test_sync_get_block_negative(self):
+        chunk = yield self.w.request_chunk(-1, -1)
+        chunk.set_block((15, 64, 14), 1)
+        self.assertEqual(self.w.sync_get_block((-1, 64, -2)), 1)
+
+    def test_sync_get_block_impossible(self):
+        self.assertRaises(ImpossibleCoordinates, self.w.sync_get_block,
+                          (0, 256, 0))
+
+    @inlineCallbacks
+    def test_sync_get_blocks(self):
+        first = yield self.w.request_chunk(-1, 0)
+        second = yield self.w.request_chunk(0, 0)
+
+        first.set_block((15, 64, 2), 1)
+        second.set_block((0, 64, 2), 2)
+        second.set_block((1, 65, 3), 3)
+
+        blocks = self.w.sync_get_blocks((-1, 64, 2), (2, 66, 4))
+        self.assertEqual(blocks, "\x01\x02\x00" "\x00\x00\x00"
+                                 "\x00\x00\x00" "\x00\x00\x03")
+
+    def test_sync_get_blocks_unloaded(self):
+        self.assertRaises(ChunkNotLoaded, self.w.sync_get_blocks, (0, 0, 0),
+                          (1, 1, 1))
+
+    @inlineCallbacks
+    def test_sync_any_solid(self):
+        yield self.w.request_chunk(-1, 0)
+        chunk = yield self.w.request_chunk(0, 0)
+
+        chunk.set_block((0, 64, 2), blocks["stone"].slot)
+        self.assertTrue(self.w.sync_any_solid((-1, 64, 2), (1, 65, 3)))
+        self.assertFalse(self.w.sync_any_solid((-2, 64, 2), (0, 65, 3)))
+
+    @inlineCallbacks
+    def test_sync_any_solid_passable(self):
+        chunk = yield self.w.request_chunk(0, 0)
+
+        chunk.set_block((0, 64, 2), blocks["torch"].slot)
+        self.assertFalse(self.w.sync_any_solid((0, 64, 2), (1, 65, 3)))
+        self.assertTrue(self.w.sync_any_solid((0, 64, 2), (1, 65, 3),
+                                              passable="\x00"))
+
+    @inlineCallbacks
+    def test_sync_any_solid_outside_world(self):
+        yield self.w.request_chunk(0, 0)
+        self.assertFalse(self.w.sync_any_solid((0, 250, 0), (1, 300, 1)))
+
+    def test_sync_any_solid_unloaded(self):
+        self.assertRaises(ChunkNotLoaded, self.w.sync_any_solid, (0, 0, 0),
+                          (1, 1, 1))
+
     def test_sync_get_metadata_neighboring(self):
         """
         Even if a neighboring chunk is loaded, the target chunk could still be
@@ -222,6 +431,204 @@ class TestWorldChunks(unittest.TestCase):
         return d
 
 
+class TestChunkFlusher(unittest.TestCase):
+
+    def setUp(self):
+        self.name = "unittest"
+        self.bcp = BravoConfigParser()
+
+        self.bcp.add_section("world unittest")
+        self.bcp.set("world unittest", "url", "")
+        self.bcp.set("world unittest", "serializer", "memory")
+
+        self.w = World(self.bcp, self.name)
+        self.w.pipeline = []
+        self.w.start()
+
+        self.clock = Clock()
+        self.w._cache.clock = self.clock
+        self.f = self.w.flusher
+
+    def tearDown(self):
+        self.w.stop()
+
+    def dirty_chunks(self, coords):
+        for x, z in coords:
+            self.w._cache.dirtied(Chunk(x, z))
+
+    def test_batch_size_spreads_backlog(self):
+        self.dirty_chunks(product(xrange(10), xrange(9)))
+        self.f.latency = 30
+        self.assertEqual(self.f.batch_size(), 3)
+
+    def test_batch_size_overdue(self):
+        self.dirty_chunks(product(xrange(10), xrange(9)))
+        self.f.latency = 30
+        self.clock.advance(31)
+        self.assertEqual(self.f.batch_size(), 6)
+
+    def test_batch_size_empty(self):
+        self.assertEqual(self.f.batch_size(), 0)
+
+    def test_plan_groups_regions(self):
+        self.dirty_chunks([(0, 0)])
+        self.clock.advance(1)
+        self.dirty_chunks([(32, 0)])
+        self.clock.advance(1)
+        self.dirty_chunks([(1, 0)])
+
+        chunks = self.f.plan(3)
+        self.assertEqual([(c.x, c.z) for c in chunks],
+                         [(0, 0), (1, 0), (32, 0)])
+
+    def test_plan_oldest(self):
+        """
+        Only the least recently dirtied chunks are picked, even if a newer
+        chunk shares a region with them.
+        """
+
+        self.dirty_chunks([(0, 0)])
+        self.clock.advance(1)
+        self.dirty_chunks([(32, 0)])
+        self.clock.advance(1)
+        self.dirty_chunks([(1, 0)])
+
+        chunks = self.f.plan(2)
+        self.assertEqual([(c.x, c.z) for c in chunks], [(0, 0), (32, 0)])
+
+    def test_plan_redirtied(self):
+        """
+        Chunks which are cleaned and dirtied again go to the back.
+        """
+
+        self.dirty_chunks([(0, 0), (1, 0)])
+        self.w._cache.cleaned(self.w._cache.get((0, 0)))
+        self.clock.advance(1)
+        self.dirty_chunks([(0, 0)])
+
+        chunks = self.f.plan(1)
+        self.assertEqual([(c.x, c.z) for c in chunks], [(1, 0)])
+        self.assertEqual(self.w._cache.dirty_age(), 1)
+
+    @inlineCallbacks
+    def test_flush_cleans(self):
+        self.dirty_chunks([(0, 0)])
+        yield self.f.flush()
+        self.assertEqual(self.f.backlog, 0)
+        self.assertEqual(self.f.flushed, 1)
+
+        # The chunk should still be cached after it was saved.
+        self.assertTrue(self.w._cache.get((0, 0)))
+
+    @inlineCallbacks
+    def test_flush_all(self):
+        self.dirty_chunks(product(xrange(10), xrange(10)))
+        count = yield self.f.flush_all()
+        self.assertEqual(count, 100)
+        self.assertEqual(self.f.backlog, 0)
+
+    @inlineCallbacks
+    def test_flush_failed(self):
+        """
+        Chunks which fail to save for any reason stay dirty, and are saved by
+        a later flush.
+        """
+
+        def broken(chunk):
+            raise IOError("Disk on fire")
+        save_chunk = self.w.serializer.save_chunk
+        self.w.serializer.save_chunk = broken
+
+        self.dirty_chunks([(0, 0)])
+        yield self.f.flush()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertEqual(self.f.backlog, 1)
+        self.assertEqual(self.f.flushed, 0)
+        self.assertTrue(self.w._cache.get((0, 0)).dirty)
+
+        self.w.serializer.save_chunk = save_chunk
+        yield self.f.flush()
+        self.assertEqual(self.f.backlog, 0)
+        self.assertEqual(self.f.flushed, 1)
+
+    @inlineCallbacks
+    def test_flush_all_failed(self):
+        """
+        Flushing everything fails if any chunk couldn't be saved, and only
+        the chunks which were saved are counted.
+        """
+
+        def broken(chunk):
+            raise IOError("Disk on fire")
+        self.w.serializer.save_chunk = broken
+
+        self.dirty_chunks(product(xrange(5), xrange(1)))
+        d = self.f.flush_all()
+        self.assertFailure(d, SerializerWriteException)
+        yield d
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 5)
+        self.assertEqual(self.f.backlog, 5)
+        self.assertEqual(self.f.flushed, 0)
+
+        del self.w.serializer.save_chunk
+
+    def test_flush_all_waits_for_running_saves(self):
+        """
+        Chunks which are already being saved aren't counted as flushed until
+        their saves finish.
+        """
+
+        writes = []
+
+        def save_chunk(chunk):
+            d = Deferred()
+            writes.append(d)
+            return d
+        self.w.serializer.save_chunk = save_chunk
+
+        self.dirty_chunks([(0, 0)])
+        self.f.flush()
+        self.assertEqual(len(writes), 1)
+
+        d = self.f.flush_all()
+        self.assertFalse(d.called)
+        self.assertEqual(len(writes), 1)
+
+        writes[0].callback(None)
+        self.assertTrue(d.called)
+        self.assertEqual(self.f.backlog, 0)
+        self.assertEqual(self.f.flushed, 1)
+
+    def test_flush_all_changed_while_saving(self):
+        """
+        Chunks which change while they are being saved are saved again once
+        the running save finishes.
+        """
+
+        writes = []
+
+        def save_chunk(chunk):
+            d = Deferred()
+            writes.append(d)
+            return d
+        self.w.serializer.save_chunk = save_chunk
+
+        self.dirty_chunks([(0, 0)])
+        self.f.flush()
+        self.w._cache.get((0, 0)).dirty = True
+
+        d = self.f.flush_all()
+        self.assertEqual(len(writes), 1)
+
+        writes[0].callback(None)
+        self.assertEqual(len(writes), 2)
+        self.assertFalse(d.called)
+
+        writes[1].callback(None)
+        self.assertTrue(d.called)
+        self.assertEqual(self.f.backlog, 0)
+
+
 class TestWorld(unittest.TestCase):
 
     def setUp(self):
@@ -257,6 +664,46 @@ class TestWorld(unittest.TestCase):
             self.assertEqual(player.username, "unittest")
         return d
 
+    def test_stop_failed_closes(self):
+        """
+        Stopping closes the serializer even if saving fails, so that its
+        threads don't keep the process alive.
+        """
+
+        closed = []
+        self.w.serializer.close = lambda: closed.append(True)
+
+        def broken():
+            # Only fail once, so that tearDown() can stop the world again.
+            del self.w.flusher.flush_all
+            return fail(IOError("Disk on fire"))
+        self.w.flusher.flush_all = broken
+
+        d = self.w.stop()
+        self.assertFailure(d, IOError)
+        self.assertEqual(closed, [True])
+        return d
+
+
+    def test_stop_unsaved(self):
+        """
+        Stopping fails, and keeps the cache, if chunks couldn't be saved.
+        """
+
+        def broken(chunk):
+            raise IOError("Disk on fire")
+        self.w.serializer.save_chunk = broken
+        self.w._cache.dirtied(Chunk(0, 0))
+
+        d = self.w.stop()
+        self.assertFailure(d, SerializerWriteException)
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertEqual(self.w.flusher.backlog, 1)
+
+        # Let tearDown() stop the world for real.
+        del self.w.serializer.save_chunk
+        return d
+
 
 class TestWorldConfig(unittest.TestCase):
 
@@ -283,3 +730,24 @@ class TestWorldConfig(unittest.TestCase):
         self.w.start()
         self.assertEqual(self.w.level.seed, 42)
         self.w.stop()
+
+    def test_world_configured_tick_budgets(self):
+        self.bcp.set("world unittest", "tick_budgets", "mobs:10, water:2")
+        self.w.start()
+        self.assertEqual(self.w.scheduler.subsystems["mobs"].budget, 0.01)
+        self.assertEqual(self.w.scheduler.subsystems["furnaces"].budget, None)
+        self.assertEqual(self.w.scheduler.budgets["water"], 0.002)
+        self.assertTrue(self.w.scheduler.running)
+        self.w.stop()
+        self.assertFalse(self.w.scheduler.running)
+
+    def test_world_configured_pack_sections(self):
+        self.bcp.set("world unittest", "pack_sections", "yes")
+        self.w.start()
+        self.addCleanup(self.w.stop)
+
+        chunk = Chunk(0, 0)
+        chunk.set_block((1, 2, 3), 1)
+        self.w.postprocess_chunk(chunk)
+        self.assertTrue(isinstance(chunk.sections[0], PackedSection))
+        self.assertEqual(chunk.get_block((1, 2, 3)), 1)
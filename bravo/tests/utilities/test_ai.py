@@ -0,0 +1,58 @@
+import unittest
+
+from bravo.utilities.ai import check_collision
+
+class MockWorld(object):
+
+    def __init__(self):
+        self.blocks = {}
+        self.boxes = []
+
+    def sync_get_blocks(self, lower, upper):
+        self.boxes.append((lower, upper))
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+        return "".join(chr(self.blocks.get((x, y, z), 0))
+                       for y in range(y1, y2)
+                       for z in range(z1, z2)
+                       for x in range(x1, x2))
+
+class MockFactory(object):
+
+    def __init__(self):
+        self.world = MockWorld()
+
+class TestCheckCollision(unittest.TestCase):
+
+    def setUp(self):
+        self.f = MockFactory()
+
+    def test_clear(self):
+        self.assertTrue(check_collision((1, 64, 1), [(0, 0, 0), (2, 1, 2)],
+                                        self.f))
+
+    def test_blocked(self):
+        self.f.world.blocks[3, 65, 3] = 1
+        self.assertFalse(check_collision((1, 64, 1), [(0, 0, 0), (2, 1, 2)],
+                                         self.f))
+
+    def test_only_corners(self):
+        """
+        Blocks between the corners aren't checked.
+        """
+
+        self.f.world.blocks[2, 64, 2] = 1
+        self.assertTrue(check_collision((1, 64, 1), [(0, 0, 0), (2, 1, 2)],
+                                        self.f))
+
+    def test_rounds_towards_zero(self):
+        self.f.world.blocks[0, 64, 0] = 1
+        self.assertFalse(check_collision((-0.5, 64.5, 0.5), [(0, 0, 0)],
+                                         self.f))
+
+    def test_one_query_per_chunk(self):
+        check_collision((14, 64, 14), [(0, 0, 0), (1, 0, 1), (3, 0, 0)],
+                        self.f)
+        self.assertEqual(sorted(self.f.world.boxes),
+                         [((14, 64, 14), (16, 65, 16)),
+                          ((17, 64, 14), (18, 65, 15))])
@@ -8,6 +8,7 @@ from bravo.inventory import Inventory
 from bravo.entity import Furnace as FurnaceTile
 from bravo.inventory.windows import FurnaceWindow
 from bravo.utilities.furnace import update_all_windows_slot, update_all_windows_progress
+from bravo.utilities.temporal import TickScheduler
 
 class FakeChunk(object):
     def __init__(self):
@@ -20,6 +21,11 @@ class FakeWorld(object):
     def __init__(self):
         self.chunk = FakeChunk()
 
+        self.clock = Clock()
+        self.scheduler = TickScheduler(self.clock)
+        self.scheduler.add_subsystem("furnaces", 0.5)
+        self.scheduler.start()
+
     def request_chunk(self, x, z):
         return defer.succeed(self.chunk)
 
@@ -151,9 +157,7 @@ class TestFurnaceProcessCrafting(unittest.TestCase):
         Crafting one glass, from one sand, using one wood, should take 15s.
         """
 
-        # Patch the clock.
-        clock = Clock()
-        self.tile.burning.clock = clock
+        clock = self.factory.world.clock
 
         self.tile.inventory.fuel[0] = Slot(blocks['wood'].slot, 0, 1)
         self.tile.inventory.crafting[0] = Slot(blocks['sand'].slot, 0, 1)
@@ -176,9 +180,7 @@ class TestFurnaceProcessCrafting(unittest.TestCase):
         some packets.
         """
 
-        # Patch the clock.
-        clock = Clock()
-        self.tile.burning.clock = clock
+        clock = self.factory.world.clock
 
         self.tile.inventory.fuel[0] = Slot(blocks['wood'].slot, 0, 1)
         self.tile.inventory.crafting[0] = Slot(blocks['sand'].slot, 0, 1)
@@ -198,9 +200,7 @@ class TestFurnaceProcessCrafting(unittest.TestCase):
         20s and only use four saplings.
         """
 
-        # Patch the clock.
-        clock = Clock()
-        self.tile.burning.clock = clock
+        clock = self.factory.world.clock
 
         self.tile.inventory.fuel[0] = Slot(blocks['sapling'].slot, 0, 10)
         self.tile.inventory.crafting[0] = Slot(blocks['sand'].slot, 0, 2)
@@ -224,9 +224,7 @@ class TestFurnaceProcessCrafting(unittest.TestCase):
         some packets.
         """
 
-        # Patch the clock.
-        clock = Clock()
-        self.tile.burning.clock = clock
+        clock = self.factory.world.clock
 
         self.tile.inventory.fuel[0] = Slot(blocks['sapling'].slot, 0, 10)
         self.tile.inventory.crafting[0] = Slot(blocks['sand'].slot, 0, 2)
@@ -244,9 +242,7 @@ class TestFurnaceProcessCrafting(unittest.TestCase):
         self.assertEqual(headers.count('window-progress'), 81)
 
     def test_timer_mega_drift(self):
-        # Patch the clock.
-        clock = Clock()
-        self.tile.burning.clock = clock
+        clock = self.factory.world.clock
 
         # we have more wood than we need and we can process 2 blocks
         # but we have space only for one
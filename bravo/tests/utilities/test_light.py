@@ -0,0 +1,136 @@
+from unittest import TestCase
+
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
+from bravo.utilities.coords import XZ
+from bravo.utilities.light import BlockLight, SkyLight
+
+class TestBlockLight(TestCase):
+
+    def setUp(self):
+        self.chunks = {}
+        for x, z in ((0, 0), (1, 0)):
+            self.chunks[x, z] = Chunk(x, z)
+
+        self.engine = BlockLight(self.lookup)
+
+    def lookup(self, x, z):
+        return self.chunks.get((x, z))
+
+    def light(self, x, y, z):
+        chunk = self.chunks[x // 16, z // 16]
+        return chunk.blocklight[((x % 16) * 16 + z % 16) * 256 + y]
+
+    def place(self, x, y, z, block):
+        chunk = self.chunks[x // 16, z // 16]
+        chunk.unshare(y // 16).set_block((x % 16, y % 16, z % 16), block)
+        self.engine.update(x, y, z)
+
+    def test_trivial(self):
+        pass
+
+    def test_torch(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+
+        self.assertEqual(self.light(8, 64, 8), 14)
+        self.assertEqual(self.light(9, 64, 8), 13)
+        self.assertEqual(self.light(8, 60, 8), 10)
+        self.assertEqual(self.light(4, 62, 10), 6)
+        self.assertEqual(self.light(8, 51, 8), 1)
+        self.assertEqual(self.light(8, 50, 8), 0)
+
+    def test_across_chunks(self):
+        self.place(14, 64, 8, blocks["torch"].slot)
+
+        self.assertEqual(self.light(16, 64, 8), 12)
+        self.assertEqual(self.light(20, 64, 8), 8)
+        self.assertTrue(self.chunks[1, 0] in self.engine.touched)
+
+    def test_unloaded_chunk(self):
+        self.place(1, 64, 8, blocks["torch"].slot)
+
+        self.assertEqual(self.light(0, 64, 8), 13)
+        self.assertEqual(self.light(0, 64, 0), 5)
+
+    def test_opaque(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+        self.place(9, 64, 8, blocks["stone"].slot)
+
+        self.assertEqual(self.light(9, 64, 8), 0)
+        # Light goes around the stone.
+        self.assertEqual(self.light(10, 64, 8), 10)
+
+    def test_translucent(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+        self.place(9, 64, 8, blocks["water"].slot)
+
+        self.assertEqual(self.light(9, 64, 8), 10)
+
+    def test_remove(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+        self.place(8, 64, 8, blocks["air"].slot)
+
+        for chunk in self.chunks.itervalues():
+            self.assertFalse(any(chunk.blocklight))
+
+    def test_remove_one_of_two(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+        self.place(12, 64, 8, blocks["torch"].slot)
+        self.place(8, 64, 8, blocks["air"].slot)
+
+        self.assertEqual(self.light(8, 64, 8), 10)
+        self.assertEqual(self.light(4, 64, 8), 6)
+        self.assertEqual(self.light(12, 64, 8), 14)
+
+    def test_remove_stone(self):
+        self.place(8, 64, 8, blocks["torch"].slot)
+        self.place(9, 64, 8, blocks["stone"].slot)
+        self.place(9, 64, 8, blocks["air"].slot)
+
+        self.assertEqual(self.light(9, 64, 8), 13)
+        self.assertEqual(self.light(10, 64, 8), 12)
+
+class TestSkyLight(TestCase):
+
+    def setUp(self):
+        self.chunk = Chunk(0, 0)
+        for x, z in XZ:
+            self.chunk.set_block((x, 0, z), blocks["stone"].slot)
+        for y in range(1, 4):
+            self.chunk.set_block((4, y, 4), blocks["water"].slot)
+        self.chunk.regenerate()
+
+        self.engine = SkyLight(self.lookup)
+
+    def lookup(self, x, z):
+        if (x, z) == (0, 0):
+            return self.chunk
+
+    def test_trivial(self):
+        pass
+
+    def test_water(self):
+        """
+        Water is lit from the side as well as from above.
+        """
+
+        self.assertEqual(self.chunk.get_skylight((4, 3, 4)), 12)
+        self.assertEqual(self.chunk.get_skylight((4, 1, 4)), 11)
+
+    def test_source(self):
+        self.assertEqual(self.engine.source(self.chunk, 4, 4, 4), 15)
+        self.assertEqual(self.engine.source(self.chunk, 4, 2, 4), 9)
+        self.assertEqual(self.engine.source(self.chunk, 4, 0, 4), 0)
+
+    def test_update_column(self):
+        """
+        Changing the top of a column relights everything beneath it.
+        """
+
+        self.chunk.unshare(0).set_block((4, 3, 4), blocks["stone"].slot)
+        self.engine.update(4, 3, 4)
+
+        self.assertEqual(self.chunk.get_skylight((4, 3, 4)), 0)
+        # The water below is lit from the sides instead.
+        self.assertEqual(self.chunk.get_skylight((4, 2, 4)), 11)
+        self.assertEqual(self.engine.touched, set([self.chunk]))
@@ -0,0 +1,166 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from bravo.utilities.temporal import TickScheduler
+
+class FakeTimer(object):
+    """
+    A timer which moves forward every time it is read.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.now = 0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+class TestTickScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = TickScheduler(self.clock)
+        self.scheduler.add_subsystem("test", 0.2)
+        self.scheduler.start()
+
+        self.calls = []
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def tickable(self, *args):
+        self.calls.append(args)
+
+    def test_trivial(self):
+        pass
+
+    def test_interval(self):
+        self.scheduler.schedule("test", self.tickable)
+        self.clock.pump([0.05] * 3)
+        self.assertEqual(self.calls, [])
+        self.clock.advance(0.05)
+        self.assertEqual(self.calls, [()])
+        self.clock.advance(0.2)
+        self.assertEqual(self.calls, [(), ()])
+
+    def test_interval_rounded(self):
+        self.scheduler.add_subsystem("test", 0.19)
+        self.assertEqual(self.scheduler.subsystems["test"].interval, 4)
+
+    def test_now(self):
+        self.scheduler.schedule("test", self.tickable, now=True)
+        self.assertEqual(self.calls, [()])
+
+    def test_schedule_twice(self):
+        self.scheduler.schedule("test", self.tickable)
+        self.scheduler.schedule("test", self.tickable)
+        self.clock.pump([0.05] * 4)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_unschedule(self):
+        self.scheduler.schedule("test", self.tickable)
+        self.assertTrue(self.scheduler.scheduled("test", self.tickable))
+        self.scheduler.unschedule("test", self.tickable)
+        self.assertFalse(self.scheduler.scheduled("test", self.tickable))
+        self.clock.pump([0.05] * 4)
+        self.assertEqual(self.calls, [])
+
+    def test_unschedule_missing(self):
+        self.scheduler.unschedule("test", self.tickable)
+        self.scheduler.unschedule("missing", self.tickable)
+
+    def test_phase(self):
+        """
+        Tickables keep their own phase within a subsystem.
+        """
+
+        self.scheduler.schedule("test", self.tickable)
+        self.clock.advance(0.05)
+        self.scheduler.schedule("test", lambda: self.calls.append("late"))
+        self.clock.pump([0.05] * 3)
+        self.assertEqual(self.calls, [()])
+        self.clock.advance(0.05)
+        self.assertEqual(self.calls, [(), "late"])
+
+    def test_count(self):
+        self.scheduler.schedule("test", self.tickable, count=True)
+        self.clock.pump([0.05] * 4)
+        self.assertEqual(self.calls, [(1,)])
+
+    def test_catch_up(self):
+        """
+        After lag, counted tickables are told how many intervals they missed,
+        and then carry on at their usual phase.
+        """
+
+        self.scheduler.schedule("test", self.tickable, count=True)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [(5,)])
+        self.assertEqual(self.scheduler.skipped, 19)
+
+        self.clock.pump([0.05] * 4)
+        self.assertEqual(self.calls, [(5,), (1,)])
+
+    def test_catch_up_limit(self):
+        self.patch(TickScheduler, "catch_up", 1)
+        self.scheduler.schedule("test", self.tickable, count=True)
+        self.clock.advance(10)
+        self.assertEqual(self.calls, [(5,)])
+
+    def test_catch_up_uncounted(self):
+        self.scheduler.schedule("test", self.tickable)
+        self.clock.advance(1)
+        self.assertEqual(self.calls, [()])
+
+    def test_budget(self):
+        """
+        Tickables which don't fit in the budget wait for the next tick, and
+        count the intervals which they missed.
+        """
+
+        self.patch(self.scheduler, "timer", FakeTimer(0.01))
+        self.scheduler.add_subsystem("test", 0.2, 0.015)
+
+        for i in range(3):
+            self.scheduler.schedule("test",
+                lambda count, i=i: self.calls.append((i, count)), count=True)
+
+        self.clock.pump([0.05] * 4)
+        self.assertEqual(self.calls, [(0, 1), (1, 1)])
+        self.assertEqual(self.scheduler.subsystems["test"].deferred, 1)
+
+        self.clock.advance(0.05)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.calls[2][1], 1)
+
+    def test_configured_budget(self):
+        self.scheduler.budgets["other"] = 0.01
+        self.scheduler.add_subsystem("other", 1)
+        self.assertEqual(self.scheduler.subsystems["other"].budget, 0.01)
+
+    def test_failure(self):
+        """
+        Tickables which fail are logged and dropped.
+        """
+
+        def broken():
+            raise ValueError("broken")
+
+        self.scheduler.schedule("test", broken)
+        self.scheduler.schedule("test", self.tickable)
+        self.clock.pump([0.05] * 4)
+
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertFalse(self.scheduler.scheduled("test", broken))
+        self.assertEqual(self.calls, [()])
+
+    def test_overruns(self):
+        self.patch(self.scheduler, "timer", FakeTimer(0.1))
+        self.clock.advance(0.05)
+        self.assertEqual(self.scheduler.overruns, 1)
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["overruns"], 1)
+        self.assertTrue(stats["longest"] > 50)
+        self.assertEqual(stats["subsystems"]["test"]["tickables"], 0)
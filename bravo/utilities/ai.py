@@ -1,38 +1,37 @@
 """ Utilities for ai/pathfinding routines"""
-from math import sin, cos, floor, ceil
+from collections import defaultdict
+from math import sin, cos
+
 from bravo.simplex import dot3
 
 def check_collision(vector, offsetlist, factory):
-    cont = True
-    for offset_x, offset_y, offset_z in offsetlist:
-        calculated_x = vector[0] + offset_x
-        calculated_y = vector[1] + offset_y
-        calculated_z = vector[2] + offset_z
-
-        if calculated_x >= 0:
-            calculated_x = floor(calculated_x)
-        else:
-            calculated_x = ceil(calculated_x)
-
-        if calculated_y >= 0:
-            calculated_y = floor(calculated_y)
-        else:
-            calculated_y = ceil(calculated_y)
-
-        if calculated_z >= 0:
-            calculated_z = floor(calculated_z)
-        else:
-            calculated_z = ceil(calculated_z)
-
-        b = factory.world.sync_get_block((calculated_x,calculated_y,calculated_z))
-        if b == 0:
-            continue
-        else:
-            return False
-            cont = False
-            break
-    if cont:
-        return True
+    """
+    Check whether the blocks at some points around a position are all air.
+
+    Points are rounded towards zero to find their blocks. The points in each
+    chunk are checked with a single query for the box around them.
+
+    :returns: whether every block is air
+    """
+
+    chunks = defaultdict(set)
+    for offset in offsetlist:
+        x, y, z = (int(i + j) for i, j in zip(vector, offset))
+        chunks[x >> 4, z >> 4].add((x, y, z))
+
+    for points in chunks.itervalues():
+        x1, y1, z1 = (min(axis) for axis in zip(*points))
+        x2, y2, z2 = (max(axis) + 1 for axis in zip(*points))
+
+        box = factory.world.sync_get_blocks((x1, y1, z1), (x2, y2, z2))
+
+        width = x2 - x1
+        depth = z2 - z1
+        for x, y, z in points:
+            if box[((y - y1) * depth + z - z1) * width + x - x1] != "\x00":
+                return False
+
+    return True
 
 def rotate_coords_list(coords, theta, offset):
     """ Rotates a list of coordinates counterclockwise by the specified degree
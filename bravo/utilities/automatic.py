@@ -1,3 +1,5 @@
+from array import array
+
 from bravo.utilities.coords import XZ
 
 
@@ -16,7 +18,8 @@ def naive_scan(automaton, chunk):
 
     for index, section in enumerate(chunk.sections):
         if section:
-            for i, block in enumerate(section.blocks):
+            blocks = array("B", section.block_string())
+            for i, block in enumerate(blocks):
                 if block in acceptable:
                     coords = i & 0xf, (i >> 8) + index * 16, i >> 4 & 0xf
                     automaton.feed(coords)
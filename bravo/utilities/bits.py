@@ -1,4 +1,5 @@
 from array import array
+from binascii import hexlify, unhexlify
 from itertools import izip_longest
 
 def grouper(n, iterable, fillvalue=None):
@@ -10,41 +11,81 @@ def grouper(n, iterable, fillvalue=None):
 Bit-twiddling devices.
 """
 
+# Nibbles are shuffled around as hex digits, since hexlify() and unhexlify()
+# already split bytes into nibbles and join them back up, in C. These tables
+# translate between nibbles and hex digits with str.translate().
+
+_hexdigits = "0123456789abcdef"
+_nibble_to_hex = "".join(_hexdigits[i & 0xf] for i in range(256))
+_hex_to_nibble = "".join(chr(_hexdigits.find(chr(i)) & 0xf)
+                         for i in range(256))
+
+def _as_bytes(data):
+    """
+    Get the contents of a bytes-like object as a string.
+    """
+
+    if isinstance(data, str):
+        return data
+    elif isinstance(data, array):
+        if data.typecode not in "bB":
+            data = array("B", data)
+        return data.tostring()
+    elif hasattr(data, "tobytes"):
+        # memoryview
+        return data.tobytes()
+    elif isinstance(data, (buffer, bytearray)):
+        return str(data)
+    else:
+        return array("B", data).tostring()
+
+def _swap_pairs(s):
+    """
+    Swap each pair of characters in a string of even length.
+    """
+
+    swapped = bytearray(len(s))
+    swapped[0::2] = s[1::2]
+    swapped[1::2] = s[0::2]
+    return str(swapped)
+
 def unpack_nibbles(l):
     """
     Unpack bytes into pairs of nibbles.
 
     Nibbles are half-byte quantities. The nibbles unpacked by this function
-    are returned as unsigned numeric values.
+    are returned as unsigned numeric values, low nibble first.
 
     >>> unpack_nibbles("a")
-    [6, 1]
+    array('B', [1, 6])
     >>> unpack_nibbles("nibbles")
-    [6, 14, 6, 9, 6, 2, 6, 2, 6, 12, 6, 5, 7, 3]
+    array('B', [14, 6, 9, 6, 2, 6, 2, 6, 12, 6, 5, 6, 3, 7])
 
-    :param list l: bytes
+    :param l: bytes, as a ``str``, ``buffer``, ``bytearray``, ``array``, or
+        ``memoryview``
 
-    :returns: list of nibbles
+    :returns: array of nibbles
     """
 
-    data = array("B")
-    for d in l:
-        i = ord(d)
-        data.append(i & 0xf)
-        data.append(i >> 4)
-    return data
+    # hexlify() gives the high nibble of each byte first.
+    digits = hexlify(_as_bytes(l)).translate(_hex_to_nibble)
+    return array("B", _swap_pairs(digits))
 
 def pack_nibbles(a):
     """
     Pack pairs of nibbles into bytes.
 
-    Bytes are returned as characters.
+    Bytes are returned as characters. Only the low four bits of each nibble
+    are used; if there is an odd number of nibbles, the last byte's high
+    nibble is zero.
 
-    :param `array` a: nibbles to pack
+    :param a: nibbles to pack, as an ``array``, any bytes-like object, or a
+        sequence of numbers
 
     :returns: packed nibbles as a string of bytes
     """
 
-    packed = array("B",
-                   (((y & 0xf) << 4) | (x & 0xf) for x, y in grouper(2, a)))
-    return packed.tostring()
+    digits = _as_bytes(a).translate(_nibble_to_hex)
+    if len(digits) % 2:
+        digits += "0"
+    return unhexlify(_swap_pairs(digits))
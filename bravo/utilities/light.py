@@ -0,0 +1,354 @@
+from collections import deque
+
+from bravo.blocks import blocks, glowing_blocks
+from bravo.utilities.coords import CHUNK_HEIGHT
+
+attenuation = [blocks[slot].dim + 1 if slot in blocks else 16
+               for slot in range(256)]
+"""
+How much light is lost going into each kind of block, by slot.
+
+Light loses one level for each block it travels, and as much again as the
+block it goes into dims.
+"""
+
+emission = [glowing_blocks.get(slot, 0) for slot in range(256)]
+"""
+How much light each kind of block gives off, by slot.
+"""
+
+unlit_bytes = "".join(chr(slot) for slot in range(256) if not emission[slot])
+"""
+The slots of blocks which don't give off light, as a string of bytes, for
+deleting with ``str.translate()``.
+"""
+
+dims = [blocks[slot].dim if slot in blocks else 16 for slot in range(256)]
+"""
+How much sunlight is lost shining straight down into each kind of block, by
+slot.
+"""
+
+faces = (
+    (1, 0, 0),
+    (-1, 0, 0),
+    (0, 1, 0),
+    (0, -1, 0),
+    (0, 0, 1),
+    (0, 0, -1),
+)
+
+class LightEngine(object):
+    """
+    A flood-fill engine for light.
+
+    Light is spread breadth-first, one block at a time, from the blocks which
+    changed. Lowering the light somewhere is done by first clearing all of
+    the light which could have come from there, then spreading light back in
+    from the edges of the cleared area. Only the blocks whose light actually
+    changes are visited.
+
+    The engine works in world coordinates, and gets chunks from a lookup
+    function, so light spreads between chunks. Light stops at chunks which
+    can't be looked up.
+
+    Subclasses say where their light is kept, and where it comes from.
+    """
+
+    def __init__(self, lookup):
+        """
+        :param lookup: a callable taking the x and z coordinates of a chunk,
+            and returning the chunk, or None
+        """
+
+        self.lookup = lookup
+
+        self.increase = deque()
+        self.decrease = deque()
+
+        self.touched = set()
+        """
+        The chunks whose light has been changed.
+        """
+
+        self._chunks = {}
+
+    def chunk(self, x, z):
+        """
+        Get the chunk containing some world coordinates.
+        """
+
+        key = x >> 4, z >> 4
+        if key not in self._chunks:
+            self._chunks[key] = self.lookup(*key)
+        return self._chunks[key]
+
+    def locate(self, chunk, x, y, z):
+        """
+        Find the light of a block.
+
+        The array is only for reading; changes are made with ``store()``.
+
+        :returns: tuple of the array holding the light, and the index of the
+            block in it
+        """
+
+        raise NotImplementedError()
+
+    def store(self, chunk, x, y, z, i, level):
+        """
+        Change the light of a block.
+
+        :param int i: the index of the block, from ``locate()``
+        """
+
+        raise NotImplementedError()
+
+    def source(self, chunk, x, y, z):
+        """
+        Get the light which a block has of its own, without any spreading.
+        """
+
+        raise NotImplementedError()
+
+    def add(self, x, y, z, level):
+        """
+        Shine some light on a block.
+
+        The light is spread by the next call to ``run()``.
+        """
+
+        chunk = self.chunk(x, z)
+        if chunk is None:
+            return
+
+        light, i = self.locate(chunk, x, y, z)
+        if level > light[i]:
+            self.store(chunk, x, y, z, i, level)
+            self.touched.add(chunk)
+            self.increase.append((x, y, z))
+
+    def relight(self, x, y, z, level):
+        """
+        Give a block some new light of its own, replacing whatever it had.
+
+        The change is spread by the next call to ``run()``.
+        """
+
+        chunk = self.chunk(x, z)
+        if chunk is None:
+            return
+
+        light, i = self.locate(chunk, x, y, z)
+        if light[i]:
+            self.decrease.append((x, y, z, light[i]))
+            self.store(chunk, x, y, z, i, 0)
+            self.touched.add(chunk)
+
+        self.add(x, y, z, level)
+
+    def seed(self, x, y, z):
+        """
+        Spread the light next to a block, in case it can shine into it.
+        """
+
+        for dx, dy, dz in faces:
+            ny = y + dy
+            if 0 <= ny < CHUNK_HEIGHT:
+                self.increase.append((x + dx, ny, z + dz))
+
+    def update(self, x, y, z):
+        """
+        Relight a block which has changed, and everything lit through it.
+
+        :returns: the set of chunks whose light has been changed
+        """
+
+        chunk = self.chunk(x, z)
+        if chunk is None:
+            return self.touched
+
+        self.relight(x, y, z, self.source(chunk, x, y, z))
+        self.seed(x, y, z)
+
+        return self.run()
+
+    def run(self):
+        """
+        Spread all of the pending changes.
+
+        :returns: the set of chunks whose light has been changed
+        """
+
+        chunk_at = self.chunk
+        chunks = self._chunks
+        locate = self.locate
+        store = self.store
+        touched = self.touched
+        increase = self.increase
+        decrease = self.decrease
+
+        while decrease:
+            x, y, z, level = decrease.popleft()
+
+            for dx, dy, dz in faces:
+                nx = x + dx
+                ny = y + dy
+                nz = z + dz
+
+                if not 0 <= ny < CHUNK_HEIGHT:
+                    continue
+
+                key = nx >> 4, nz >> 4
+                chunk = chunks[key] if key in chunks else chunk_at(nx, nz)
+                if chunk is None:
+                    continue
+
+                light, i = locate(chunk, nx, ny, nz)
+                current = light[i]
+
+                if not current:
+                    continue
+                elif current < level:
+                    # This block could have been lit from here, so clear it,
+                    # unless it has light of its own.
+                    store(chunk, nx, ny, nz, i, 0)
+                    touched.add(chunk)
+                    decrease.append((nx, ny, nz, current))
+
+                    own = self.source(chunk, nx, ny, nz)
+                    if own:
+                        store(chunk, nx, ny, nz, i, own)
+                        increase.append((nx, ny, nz))
+                else:
+                    # This block is lit from somewhere else, and its light
+                    # will have to be spread back into the cleared blocks.
+                    increase.append((nx, ny, nz))
+
+        while increase:
+            x, y, z = increase.popleft()
+
+            chunk = chunk_at(x, z)
+            if chunk is None:
+                continue
+
+            light, i = locate(chunk, x, y, z)
+            level = light[i]
+            if level <= 1:
+                continue
+
+            for dx, dy, dz in faces:
+                nx = x + dx
+                ny = y + dy
+                nz = z + dz
+
+                if not 0 <= ny < CHUNK_HEIGHT:
+                    continue
+
+                key = nx >> 4, nz >> 4
+                chunk = chunks[key] if key in chunks else chunk_at(nx, nz)
+                if chunk is None:
+                    continue
+
+                block = chunk.sections[ny >> 4].get_block_index(
+                    ((ny & 0xf) * 16 + (nz & 0xf)) * 16 + (nx & 0xf))
+                spread = level - attenuation[block]
+
+                light, i = locate(chunk, nx, ny, nz)
+                if spread > light[i]:
+                    store(chunk, nx, ny, nz, i, spread)
+                    touched.add(chunk)
+                    increase.append((nx, ny, nz))
+
+        return touched
+
+class BlockLight(LightEngine):
+    """
+    A flood-fill engine for block light, given off by glowing blocks.
+    """
+
+    def locate(self, chunk, x, y, z):
+        return (chunk.blocklight,
+                ((x & 0xf) * 16 + (z & 0xf)) * CHUNK_HEIGHT + y)
+
+    def store(self, chunk, x, y, z, i, level):
+        chunk.blocklight[i] = level
+
+    def source(self, chunk, x, y, z):
+        return emission[chunk.sections[y >> 4].get_block_index(
+            ((y & 0xf) * 16 + (z & 0xf)) * 16 + (x & 0xf))]
+
+class SkyLight(LightEngine):
+    """
+    A flood-fill engine for skylight.
+
+    Sunlight shines straight down each column of blocks, losing only as much
+    light as each block dims, and then spreads sideways and into overhangs
+    and caves like any other light. The chunks' heightmaps must be valid.
+    """
+
+    def locate(self, chunk, x, y, z):
+        return (chunk.sections[y >> 4].skylight,
+                ((y & 0xf) * 16 + (z & 0xf)) * 16 + (x & 0xf))
+
+    def store(self, chunk, x, y, z, i, level):
+        chunk.unshare(y >> 4).set_skylight_index(i, level)
+
+    def source(self, chunk, x, y, z):
+        height = chunk.heightmap[(x & 0xf) * 16 + (z & 0xf)]
+        if y > height:
+            return 0xf
+
+        # Most columns are capped with something opaque.
+        top = chunk.sections[height >> 4].get_block_index(
+            ((height & 0xf) * 16 + (z & 0xf)) * 16 + (x & 0xf))
+        if dims[top] >= 0xf:
+            return 0
+
+        column = chunk.get_column(x & 0xf, z & 0xf)
+        level = 0xf
+        for block in reversed(column[y:height + 1]):
+            level -= dims[block]
+            if level <= 0:
+                return 0
+        return level
+
+    def update(self, x, y, z):
+        """
+        Relight a block which has changed, and everything lit through it.
+
+        Changing a block can change the sunlight of the whole column beneath
+        it, so the column is relit as far down as the change reaches.
+
+        :returns: the set of chunks whose light has been changed
+        """
+
+        chunk = self.chunk(x, z)
+        if chunk is None:
+            return self.touched
+
+        column = chunk.get_column(x & 0xf, z & 0xf)
+        height = chunk.heightmap[(x & 0xf) * 16 + (z & 0xf)]
+
+        # Work out the sunlight coming down into the changed block.
+        level = 0xf
+        for block in reversed(column[y + 1:height + 1]):
+            level = max(level - dims[block], 0)
+
+        # Relight the blocks whose sunlight has changed, down to where the
+        # column is dark both before and after the change.
+        for cy in xrange(y, -1, -1):
+            level = max(level - dims[column[cy]], 0)
+
+            if cy != y:
+                light, i = self.locate(chunk, x, cy, z)
+                if light[i] == level:
+                    if not level:
+                        break
+                    continue
+
+            self.relight(x, cy, z, level)
+
+        self.seed(x, y, z)
+
+        return self.run()
@@ -1,5 +1,7 @@
 from collections import defaultdict
 from itertools import product
+from operator import itemgetter
+from sys import maxint
 from UserDict import DictMixin
 
 from bravo.utilities.coords import taxicab2
@@ -201,3 +203,207 @@ class Block3DSpatialDict(SpatialDict):
             xrange(minx, maxx),
             xrange(miny, maxy),
             xrange(minz, maxz))
+
+class EntityIndex(object):
+    """
+    A spatial index of entities, for finding the entities near a point.
+
+    Like the spatial dictionaries, the index files its contents into
+    chunk-sized buckets on the XZ-plane; unlike them, it is keyed by the
+    entities themselves, and keeps each entity filed under the current
+    position of its ``Location``. The index becomes the tracker of each
+    location added to it, and is told whenever the location moves.
+
+    Positions, radii, and distances are all in pixels, like ``Position``.
+    """
+
+    size = 16 * 32
+    """
+    The width of a bucket, in pixels.
+    """
+
+    def __init__(self):
+        # Bucket coordinates -> {entity: location}
+        self.buckets = defaultdict(dict)
+        # Location -> (entity, bucket coordinates)
+        self.locations = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, entity):
+        location = getattr(entity, "location", None)
+        return (location in self.locations and
+                self.locations[location][0] is entity)
+
+    def __iter__(self):
+        for entity, key in self.locations.itervalues():
+            yield entity
+
+    def key_for_bucket(self, position):
+        return int(position.x // self.size), int(position.z // self.size)
+
+    def add(self, entity, location=None):
+        """
+        Add an entity to the index, or refile it if it is already present.
+
+        :param entity: the entity
+        :param location: the ``Location`` to track; defaults to the entity's
+                         own location
+        """
+
+        if location is None:
+            location = entity.location
+
+        if location in self.locations:
+            self._unfile(location)
+
+        key = self.key_for_bucket(location.pos)
+        self.buckets[key][entity] = location
+        self.locations[location] = entity, key
+        location.tracker = self
+
+    def _unfile(self, location):
+        entity, key = self.locations.pop(location)
+        bucket = self.buckets[key]
+        del bucket[entity]
+        if not bucket:
+            del self.buckets[key]
+
+    def discard(self, entity, location=None):
+        """
+        Remove an entity from the index, if it is present.
+        """
+
+        if location is None:
+            location = getattr(entity, "location", None)
+
+        if location in self.locations and self.locations[location][0] is entity:
+            self._unfile(location)
+            location.tracker = None
+
+    def moved(self, location):
+        """
+        Refile the entity at a location whose position has changed.
+        """
+
+        entity, old = self.locations[location]
+        key = self.key_for_bucket(location.pos)
+
+        if key != old:
+            bucket = self.buckets[old]
+            del bucket[entity]
+            if not bucket:
+                del self.buckets[old]
+
+            self.buckets[key][entity] = location
+            self.locations[location] = entity, key
+
+    def _keys_near(self, position, radius):
+        minx, minz = self.key_for_bucket(position._replace(
+            x=position.x - radius, z=position.z - radius))
+        maxx, maxz = self.key_for_bucket(position._replace(
+            x=position.x + radius, z=position.z + radius))
+
+        # Big radii cover more buckets than there are in use.
+        if (maxx - minx + 1) * (maxz - minz + 1) > len(self.buckets):
+            return [(x, z) for x, z in self.buckets
+                    if minx <= x <= maxx and minz <= z <= maxz]
+
+        return [key for key in product(xrange(minx, maxx + 1),
+                                       xrange(minz, maxz + 1))
+                if key in self.buckets]
+
+    def iteritemsnear(self, position, radius):
+        """
+        Yield pairs of (distance, entity) for all of the entities within a
+        certain radius of a position, in no particular order.
+        """
+
+        for key in self._keys_near(position, radius):
+            for entity, location in self.buckets[key].iteritems():
+                distance = position.distance(location.pos)
+                if distance <= radius:
+                    yield distance, entity
+
+    def iternear(self, position, radius):
+        """
+        Yield all of the entities within a certain radius of a position.
+        """
+
+        for distance, entity in self.iteritemsnear(position, radius):
+            yield entity
+
+    def _ring(self, x, z, r):
+        if not r:
+            return [(x, z)]
+
+        keys = [(i, z - r) for i in xrange(x - r, x + r + 1)]
+        keys.extend((i, z + r) for i in xrange(x - r, x + r + 1))
+        keys.extend((x - r, j) for j in xrange(z - r + 1, z + r))
+        keys.extend((x + r, j) for j in xrange(z - r + 1, z + r))
+        return keys
+
+    def nearest(self, position, k=1, radius=maxint):
+        """
+        Find the entities closest to a position.
+
+        Buckets are searched in rings around the position, so the cost
+        depends on how crowded the neighborhood is, not on how many entities
+        are in the index.
+
+        :param int k: the largest number of entities to find
+        :param int radius: the largest distance at which to look
+        :returns: a list of up to k entities, closest first
+        """
+
+        x, z = position.x, position.z
+        cx, cz = self.key_for_bucket(position)
+        size = self.size
+        first = itemgetter(0)
+
+        found = []
+        remaining = len(self.buckets)
+        r = 0
+
+        while remaining:
+            if r:
+                # Everything at this ring and beyond is outside of the square
+                # which was already searched.
+                bound = min(x - (cx - r + 1) * size, (cx + r) * size - x,
+                            z - (cz - r + 1) * size, (cz + r) * size - z)
+                if bound > radius:
+                    break
+                if len(found) == k and found[-1][0] <= bound:
+                    break
+
+                if 8 * r > remaining:
+                    # The rings have become sparser than the index; look
+                    # through the rest of the buckets directly.
+                    keys = [(i, j) for i, j in self.buckets
+                            if not (cx - r < i < cx + r and
+                                    cz - r < j < cz + r)]
+                    r = None
+                else:
+                    keys = self._ring(cx, cz, r)
+            else:
+                keys = self._ring(cx, cz, r)
+
+            for key in keys:
+                bucket = self.buckets.get(key)
+                if not bucket:
+                    continue
+                remaining -= 1
+                for entity, location in bucket.iteritems():
+                    distance = position.distance(location.pos)
+                    if distance <= radius:
+                        found.append((distance, entity))
+
+            found.sort(key=first)
+            del found[k:]
+
+            if r is None:
+                break
+            r += 1
+
+        return map(itemgetter(1), found)
@@ -1,4 +1,10 @@
+from collections import defaultdict, deque
+from time import time
+
+from twisted.internet import reactor
 from twisted.internet.defer import Deferred
+from twisted.internet.task import LoopingCall
+from twisted.python import log
 from twisted.python.failure import Failure
 
 """
@@ -71,3 +77,301 @@ def timestamp_from_clock(clock):
     """
 
     return int(clock.seconds() * 1000) & 0xffffffff
+
+class Subsystem(object):
+    """
+    A group of tickables which share an interval and a time budget.
+
+    Each tickable keeps its own phase, like a ``LoopingCall`` would, but
+    tickables which are due on the same tick are run together, in one batch.
+    """
+
+    budget = None
+    """
+    The largest number of seconds to spend on a single batch, or None for no
+    limit.
+    """
+
+    duration = 0
+    """
+    The number of seconds spent on the most recent batch.
+    """
+
+    deferred = 0
+    """
+    The number of times a tickable was put off until the next tick because
+    the budget ran out.
+    """
+
+    def __init__(self, name, interval, budget=None):
+        """
+        :param str name: the name of this subsystem
+        :param int interval: the number of ticks between calls to each
+            tickable
+        :param float budget: the budget, in seconds
+        """
+
+        self.name = name
+        self.interval = interval
+        self.budget = budget
+
+        # Tickable -> [tick at which it is next due, whether it wants a count]
+        self.tickables = {}
+
+        # Tick -> due tickables, including stale entries for tickables which
+        # were since rescheduled or removed.
+        self.wheel = defaultdict(list)
+
+        # Tickables which were due, but ran out of budget.
+        self.late = deque()
+
+    def __len__(self):
+        return len(self.tickables)
+
+    def __contains__(self, tickable):
+        return tickable in self.tickables
+
+    def add(self, tickable, due, count=False):
+        self.tickables[tickable] = [due, count]
+        self.wheel[due].append(tickable)
+
+    def discard(self, tickable):
+        self.tickables.pop(tickable, None)
+
+    def call(self, tickable, count):
+        """
+        Call a tickable, dropping it if it fails.
+        """
+
+        try:
+            if self.tickables[tickable][1]:
+                tickable(count)
+            else:
+                tickable()
+        except Exception:
+            # Just like a LoopingCall, a tickable which fails is stopped.
+            log.err(None, "Unhandled error in %s tickable %r" %
+                    (self.name, tickable))
+            self.discard(tickable)
+
+    def run(self, now, timer, limit):
+        """
+        Run all of the tickables which are due.
+
+        :param int now: the current tick
+        :param timer: a function returning the current time, in seconds
+        :param int limit: the largest number of intervals for a tickable to
+            catch up on at once
+        """
+
+        before = timer()
+
+        due = sorted(tick for tick in self.wheel if tick <= now)
+        for tick in due:
+            self.late.extend((tickable, tick)
+                             for tickable in self.wheel.pop(tick))
+
+        interval = self.interval
+        late = self.late
+
+        while late:
+            tickable, tick = late.popleft()
+
+            state = self.tickables.get(tickable)
+            if state is None or state[0] != tick:
+                # Stale.
+                continue
+
+            # Catch up on every interval which was missed, and then pick up
+            # the tickable's usual phase again.
+            missed = (now - tick) // interval + 1
+            state[0] = tick + missed * interval
+            self.wheel[state[0]].append(tickable)
+
+            self.call(tickable, min(missed, limit))
+
+            if self.budget is not None and timer() - before > self.budget:
+                self.deferred += len(late)
+                break
+
+        self.duration = timer() - before
+
+class TickScheduler(object):
+    """
+    A fixed-rate scheduler, which runs any number of periodic tasks from a
+    single timer.
+
+    Tasks, called tickables, belong to named subsystems, like "mobs" or
+    "furnaces", each of which has an interval and possibly a time budget. On
+    every tick, each subsystem runs the tickables which are due; when a
+    subsystem runs out of budget, its remaining tickables wait for the next
+    tick.
+
+    Tickables which are scheduled with a count are called with the number of
+    intervals which have passed since they last ran, in the manner of
+    ``LoopingCall.withCount()``, so that they can catch up after lag, or after
+    being put off by their budget. Other tickables are merely called late.
+    """
+
+    tick = 0.05
+    """
+    The length of a tick, in seconds.
+    """
+
+    catch_up = 60
+    """
+    The largest number of seconds of missed intervals which a tickable will
+    be asked to catch up on.
+    """
+
+    ticks = 0
+    """
+    The number of ticks which have passed.
+    """
+
+    skipped = 0
+    """
+    The number of ticks which were skipped because the scheduler was running
+    late.
+    """
+
+    overruns = 0
+    """
+    The number of ticks which took longer than a tick to run.
+    """
+
+    duration = 0
+    """
+    The number of seconds spent on the most recent tick.
+    """
+
+    longest = 0
+    """
+    The largest number of seconds spent on a single tick.
+    """
+
+    timer = staticmethod(time)
+
+    def __init__(self, clock=reactor):
+        self.subsystems = {}
+
+        # Budgets for subsystems, in seconds, by name.
+        self.budgets = {}
+
+        self._loop = LoopingCall.withCount(self._tick)
+        self._loop.clock = clock
+
+    @property
+    def running(self):
+        return self._loop.running
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.tick)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def add_subsystem(self, name, interval, budget=None):
+        """
+        Add a subsystem, or change the interval and budget of an existing
+        subsystem.
+
+        :param str name: the name of the subsystem
+        :param float interval: the number of seconds between calls to each
+            tickable, which is rounded to a whole number of ticks
+        :param float budget: the budget for the subsystem, in seconds;
+            defaults to the budget configured for its name, if any
+        """
+
+        interval = max(1, int(round(interval / self.tick)))
+
+        if budget is None:
+            budget = self.budgets.get(name)
+
+        if name in self.subsystems:
+            subsystem = self.subsystems[name]
+            subsystem.interval = interval
+            subsystem.budget = budget
+        else:
+            self.subsystems[name] = Subsystem(name, interval, budget)
+
+    def schedule(self, name, tickable, count=False, now=False):
+        """
+        Start calling a tickable every interval of a subsystem.
+
+        Scheduling a tickable which is already scheduled does nothing.
+
+        :param str name: the name of the subsystem
+        :param tickable: a callable
+        :param bool count: whether to call the tickable with the number of
+            intervals which have passed
+        :param bool now: whether to call the tickable right away
+        """
+
+        subsystem = self.subsystems[name]
+        if tickable in subsystem:
+            return
+
+        subsystem.add(tickable, self.ticks + subsystem.interval, count)
+
+        if now:
+            subsystem.call(tickable, 1)
+
+    def unschedule(self, name, tickable):
+        """
+        Stop calling a tickable.
+
+        Unscheduling a tickable which isn't scheduled does nothing.
+        """
+
+        if name in self.subsystems:
+            self.subsystems[name].discard(tickable)
+
+    def scheduled(self, name, tickable):
+        """
+        Whether a tickable is scheduled.
+        """
+
+        return name in self.subsystems and tickable in self.subsystems[name]
+
+    def _tick(self, count):
+        before = self.timer()
+
+        self.ticks += count
+        self.skipped += count - 1
+
+        for subsystem in self.subsystems.values():
+            seconds = subsystem.interval * self.tick
+            limit = max(1, int(self.catch_up / seconds))
+            subsystem.run(self.ticks, self.timer, limit)
+
+        self.duration = self.timer() - before
+        self.longest = max(self.longest, self.duration)
+        if self.duration > self.tick:
+            self.overruns += 1
+
+    def stats(self):
+        """
+        Get a summary of the scheduler's timeliness.
+
+        :returns: dict of statistics; durations are in milliseconds
+        """
+
+        subsystems = {}
+        for name, subsystem in self.subsystems.iteritems():
+            subsystems[name] = {
+                "tickables": len(subsystem),
+                "duration": subsystem.duration * 1000,
+                "deferred": subsystem.deferred,
+            }
+
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "overruns": self.overruns,
+            "duration": self.duration * 1000,
+            "longest": self.longest * 1000,
+            "subsystems": subsystems,
+        }
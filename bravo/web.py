@@ -89,10 +89,12 @@ class BravoWorldElement(Element):
     def status(self, request, tag):
         world = self.factory.world
         l = []
-        total = 0 + len(world._cache._dirty) + len(world._pending_chunks)
+        stats = world._cache.stats()
+        total = stats["chunks"] + len(world._pending_chunks)
         l.append(tags.li("Total chunks: %d" % total))
-        l.append(tags.li("Clean chunks: %d" % 0))
-        l.append(tags.li("Dirty chunks: %d" % len(world._cache._dirty)))
+        clean = stats["chunks"] - stats["dirty"]
+        l.append(tags.li("Clean chunks: %d" % clean))
+        l.append(tags.li("Dirty chunks: %d" % stats["dirty"]))
         l.append(tags.li("Chunks being generated: %d" %
                          len(world._pending_chunks)))
         if world._cache._perm:
@@ -1,24 +1,29 @@
 from array import array
+from collections import OrderedDict, deque
 from functools import wraps
-from itertools import imap, product
+from itertools import imap, islice, product
 import random
 import sys
 
 from twisted.internet import reactor
-from twisted.internet.defer import (inlineCallbacks, maybeDeferred,
-                                    returnValue, succeed)
+from twisted.internet.defer import (Deferred, DeferredList, inlineCallbacks,
+                                    maybeDeferred, returnValue, succeed)
 from twisted.internet.task import LoopingCall, coiterate
 from twisted.python import log
 
 from bravo.beta.structures import Level
+from bravo.blocks import nonsolid_bytes
 from bravo.chunk import Chunk, CHUNK_HEIGHT
-from bravo.entity import Player, Furnace
+from bravo.entity import Furnace, Mob, Player
 from bravo.errors import (ChunkNotLoaded, SerializerReadException,
                           SerializerWriteException)
+from bravo.geometry.section import si
 from bravo.ibravo import ISerializer
 from bravo.plugin import retrieve_named_plugins
 from bravo.utilities.coords import split_coords
-from bravo.utilities.temporal import PendingEvent
+from bravo.utilities.maths import clamp
+from bravo.utilities.spatial import EntityIndex
+from bravo.utilities.temporal import PendingEvent, TickScheduler
 from bravo.mobmanager import MobManager
 
 
@@ -28,15 +33,70 @@ class ChunkCache(object):
     memory.
 
     This cache remembers chunks that were recently used, that are in permanent
-    residency, and so forth. Its exact caching algorithm is currently null.
+    residency, and so forth. Recently used chunks are kept in a bounded
+    working set, which is trimmed with the CLOCK algorithm, a cheap
+    approximation of LRU: every chunk gets a second chance if it has been
+    looked up since the clock hand last passed over it.
+
+    Only clean chunks are ever evicted. Chunks which are pinned, dirty, or
+    reported as busy by the ``busy`` hook are taken off of the clock when the
+    hand reaches them, even if this means that the working set grows beyond
+    its size, and are put back once they are unpinned, cleaned, or
+    ``released()``. This keeps the hand from sweeping over the same
+    unevictable chunks on every insertion.
 
     When chunks dirty themselves, they are expected to notify the cache, which
-    will then schedule an eviction for the chunk.
+    will then hold on to them until they are cleaned.
     """
 
-    def __init__(self):
+    busy = None
+    """
+    Optional hook to be called with chunk coordinates, which should return
+    whether the chunk is still in use and must not be evicted.
+
+    Busy chunks are only checked again after they are ``released()``.
+    """
+
+    evicted = None
+    """
+    Optional hook to be called with each chunk which is evicted.
+    """
+
+    clock = reactor
+    """
+    The clock used to timestamp dirty chunks.
+    """
+
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, size=256):
+        """
+        :param int size: the number of chunks to hold in the working set
+        """
+
+        self.size = size
+
         self._perm = {}
         self._dirty = {}
+        # When each dirty chunk was first dirtied, oldest first.
+        self._dirtied_at = OrderedDict()
+
+        # The working set. Every key in the working set appears exactly once
+        # in either the clock or, if it couldn't be evicted when the hand
+        # last reached it, _parked. Keys with their reference bit set are in
+        # _referenced.
+        self._recent = {}
+        self._clock = deque()
+        self._parked = set()
+        self._referenced = set()
+
+    def __len__(self):
+        keys = set(self._perm)
+        keys.update(self._recent)
+        keys.update(self._dirty)
+        return len(keys)
 
     def pin(self, chunk):
         self._perm[chunk.x, chunk.z] = chunk
@@ -44,21 +104,108 @@ class ChunkCache(object):
     def unpin(self, chunk):
         del self._perm[chunk.x, chunk.z]
 
+        # Give the chunk a chance to stay in memory for a bit longer.
+        self.put(chunk)
+
     def put(self, chunk):
-        # XXX expand caching strategy
-        pass
+        """
+        Add a chunk to the working set, evicting older chunks as needed.
+        """
+
+        key = chunk.x, chunk.z
+
+        if key in self._recent:
+            self._referenced.add(key)
+            self.released(key)
+        else:
+            self._recent[key] = chunk
+            self._clock.append(key)
+
+        self.evict()
+
+    def released(self, coords):
+        """
+        Note that a chunk might have become evictable, putting it back on the
+        clock if it had been taken off.
+        """
+
+        if coords in self._parked:
+            self._parked.discard(coords)
+            self._clock.append(coords)
+
+    def evict(self):
+        """
+        Trim the working set down to its size.
+
+        Eviction stops early if every chunk left on the clock is taken off of
+        it, which takes at most one turn of the clock to clear reference bits
+        and a second turn to check every chunk.
+        """
+
+        while len(self._recent) > self.size and self._clock:
+            key = self._clock.popleft()
+
+            if key in self._referenced:
+                # Second chance.
+                self._referenced.discard(key)
+                self._clock.append(key)
+            elif (key in self._perm or key in self._dirty or
+                  (self.busy is not None and self.busy(key))):
+                # Not evictable until it is unpinned, cleaned, or released.
+                self._parked.add(key)
+            else:
+                chunk = self._recent.pop(key)
+                self.evictions += 1
+                if self.evicted is not None:
+                    self.evicted(chunk)
 
     def get(self, coords):
         if coords in self._perm:
+            self.hits += 1
             return self._perm[coords]
+
+        if coords in self._recent:
+            self.hits += 1
+            self._referenced.add(coords)
+            return self._recent[coords]
+
+        if coords in self._dirty:
+            self.hits += 1
+            return self._dirty[coords]
+
         # Returns None if not found!
-        return self._dirty.get(coords)
+        self.misses += 1
+        return None
+
+    def peek(self, coords):
+        """
+        Look up a chunk without counting it as used.
+
+        Lookups made on behalf of other chunks, like spreading light into
+        neighboring chunks, shouldn't keep those chunks in memory or skew
+        the statistics.
+
+        :returns: the chunk, or None if it isn't cached
+        """
+
+        for chunks in (self._perm, self._recent, self._dirty):
+            if coords in chunks:
+                return chunks[coords]
+        return None
 
     def cleaned(self, chunk):
-        del self._dirty[chunk.x, chunk.z]
+        key = chunk.x, chunk.z
+        self._dirty.pop(key, None)
+        self._dirtied_at.pop(key, None)
+
+        # Keep the freshly cleaned chunk around; it is quite likely to be
+        # requested again soon. This also puts it back on the clock.
+        self.put(chunk)
 
     def dirtied(self, chunk):
-        self._dirty[chunk.x, chunk.z] = chunk
+        key = chunk.x, chunk.z
+        self._dirty[key] = chunk
+        self._dirtied_at.setdefault(key, self.clock.seconds())
 
     def iterperm(self):
         return self._perm.itervalues()
@@ -66,6 +213,260 @@ class ChunkCache(object):
     def iterdirty(self):
         return self._dirty.itervalues()
 
+    def iterdirtyoldest(self):
+        """
+        Iterate over the dirty chunks, least recently dirtied first.
+        """
+
+        for key in self._dirtied_at:
+            yield self._dirty[key]
+
+    def dirty_age(self):
+        """
+        Get the number of seconds that the oldest dirty chunk has been dirty.
+        """
+
+        if not self._dirtied_at:
+            return 0
+
+        return self.clock.seconds() - next(self._dirtied_at.itervalues())
+
+    def stats(self):
+        """
+        Get a summary of the cache's effectiveness.
+
+        :returns: dict of statistics
+        """
+
+        return {
+            "size": self.size,
+            "chunks": len(self),
+            "recent": len(self._recent),
+            "perm": len(self._perm),
+            "dirty": len(self._dirty),
+            "parked": len(self._parked),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class ChunkFlusher(object):
+    """
+    A write-behind flusher for dirty chunks.
+
+    The flusher periodically saves a batch of dirty chunks. Batches are
+    picked least recently dirtied first, and chunks are grouped by the region
+    which they belong to, so that consecutive saves touch the same file. The
+    size of each batch adapts to the backlog, in order to save every dirty
+    chunk within the target latency; if chunks are overdue anyway, the
+    flusher works twice as hard until it catches up.
+    """
+
+    interval = 1
+    """
+    The number of seconds between batches.
+    """
+
+    max_batch = 64
+    """
+    The largest number of chunks which will be saved in a single batch.
+    """
+
+    batch = 0
+    """
+    The size of the most recent batch.
+    """
+
+    flushed = 0
+    """
+    The total number of chunks saved by this flusher.
+    """
+
+    def __init__(self, world, latency=30, clock=reactor):
+        """
+        :param `World` world: the world whose chunks will be flushed
+        :param int latency: the target number of seconds for which any chunk
+            should stay dirty
+        """
+
+        self.world = world
+        self.latency = latency
+
+        # Chunks which are being saved, and whoever is waiting for their
+        # saves to finish.
+        self._saving = {}
+
+        self._loop = LoopingCall(self.flush)
+        self._loop.clock = clock
+
+    @property
+    def running(self):
+        return self._loop.running
+
+    @property
+    def backlog(self):
+        return len(self.world._cache._dirty)
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.interval)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def batch_size(self):
+        """
+        Decide how many chunks should be saved in the next batch.
+        """
+
+        backlog = self.backlog
+        if not backlog:
+            return 0
+
+        # Spread the backlog evenly over the target latency.
+        size = -(-backlog * self.interval // self.latency)
+
+        # Hurry up if we are already running late.
+        if self.world._cache.dirty_age() > self.latency:
+            size *= 2
+
+        return clamp(size, 1, self.max_batch)
+
+    def plan(self, count):
+        """
+        Pick up to ``count`` dirty chunks to save, grouped by region.
+
+        The ``count`` least recently dirtied chunks are picked, and regions
+        are ordered by their least recently dirtied chunk. Only as many dirty
+        chunks as are picked are looked at.
+
+        :returns: list of chunks
+        """
+
+        regions = {}
+        order = []
+
+        for chunk in islice(self.world._cache.iterdirtyoldest(), count):
+            region = chunk.x // 32, chunk.z // 32
+            if region not in regions:
+                regions[region] = []
+                order.append(region)
+            regions[region].append(chunk)
+
+        chunks = []
+        for region in order:
+            chunks.extend(regions[region])
+
+        return chunks
+
+    def saved(self, chunk):
+        """
+        Clean a chunk off of the cache, if it was successfully saved.
+        """
+
+        if chunk is not None and not chunk.dirty:
+            self.world._cache.cleaned(chunk)
+            self.flushed += 1
+
+        return chunk
+
+    def save(self, chunks):
+        """
+        Save a list of chunks.
+
+        :returns: ``Deferred`` which will fire when all of the chunks have
+            been saved
+        """
+
+        return DeferredList([self._save(chunk) for chunk in chunks])
+
+    def _save(self, chunk):
+        """
+        Save a single chunk.
+
+        A chunk which is already being saved is clean but not yet saved, so
+        the running save is waited on instead, and the chunk is only saved
+        again if it changed in the meantime.
+        """
+
+        if chunk in self._saving:
+            d = Deferred()
+            self._saving[chunk].append(d)
+
+            @d.addCallback
+            def resave(none):
+                if chunk.dirty:
+                    return self._save(chunk)
+                return chunk
+
+            return d
+
+        waiters = self._saving[chunk] = []
+
+        d = self.world.save_chunk(chunk)
+        d.addCallback(self.saved)
+
+        @d.addBoth
+        def release(result):
+            del self._saving[chunk]
+            for waiter in waiters:
+                waiter.callback(None)
+            return result
+
+        return d
+
+    def flush(self):
+        """
+        Save the next batch of dirty chunks.
+        """
+
+        chunks = self.plan(self.batch_size())
+        self.batch = len(chunks)
+        return self.save(chunks)
+
+    @inlineCallbacks
+    def flush_all(self):
+        """
+        Save every dirty chunk, one batch at a time.
+
+        Chunks which couldn't be saved stay dirty, and the flush fails with
+        ``SerializerWriteException`` once every batch has been tried.
+
+        :returns: ``Deferred`` which will fire with the number of chunks saved
+        """
+
+        chunks = self.plan(self.backlog)
+        saved = 0
+
+        for i in xrange(0, len(chunks), self.max_batch):
+            results = yield self.save(chunks[i:i + self.max_batch])
+            # Failed saves have already been logged, and fire with None.
+            saved += sum(1 for success, chunk in results
+                         if success and chunk is not None)
+
+        if saved < len(chunks):
+            raise SerializerWriteException("Couldn't save %d of %d chunks"
+                                           % (len(chunks) - saved,
+                                              len(chunks)))
+
+        returnValue(saved)
+
+    def stats(self):
+        """
+        Get a summary of the flusher's progress.
+
+        :returns: dict of statistics
+        """
+
+        return {
+            "backlog": self.backlog,
+            "age": self.world._cache.dirty_age(),
+            "batch": self.batch,
+            "flushed": self.flushed,
+        }
+
 
 class ImpossibleCoordinates(Exception):
     """
@@ -171,6 +572,12 @@ class World(object):
     The chunk cache.
     """
 
+    pack_sections = False
+    """
+    Whether to pack the sections of chunks as they are brought into the
+    world, to save memory.
+    """
+
     def __init__(self, config, name):
         """
         :Parameters:
@@ -183,6 +590,22 @@ class World(object):
 
         self._pending_chunks = dict()
 
+        # Where everybody is, for proximity queries. Entities living in
+        # chunks are indexed while their chunks are in memory; players are
+        # indexed, by protocol, while they are logged in.
+        self.entity_index = EntityIndex()
+        self.player_index = EntityIndex()
+
+        # Everything which happens over and over again, like mobs wandering
+        # around and furnaces burning, runs off of a single scheduler.
+        # Automatons add their own subsystems.
+        self.scheduler = TickScheduler()
+        self.scheduler.add_subsystem("mobs", 0.2)
+        self.scheduler.add_subsystem("furnaces", 0.5)
+
+        self.mob_manager = MobManager()
+        self.mob_manager.world = self
+
     @property
     def season(self):
         return self._season
@@ -218,6 +641,27 @@ class World(object):
         log.msg("World connected on %s, using serializer %s" %
                 (world_url, self.serializer.name))
 
+        # Move chunk I/O off of the reactor, if the serializer can do it.
+        threads = self.config.getintdefault(self.config_name, "io_threads", 0)
+        if threads:
+            start_threads = getattr(self.serializer, "start_threads", None)
+            if start_threads is None:
+                log.msg("Serializer %s can't use I/O threads" %
+                        self.serializer.name)
+            else:
+                start_threads(threads)
+                log.msg("Using %d I/O threads" % threads)
+
+        if self.config.getbooleandefault(self.config_name, "mmap_regions",
+                                         False):
+            map_regions = getattr(self.serializer, "map_regions", None)
+            if map_regions is None:
+                log.msg("Serializer %s can't map regions" %
+                        self.serializer.name)
+            else:
+                map_regions()
+                log.msg("Reading regions through memory mappings")
+
     def start(self):
         """
         Start managing a world.
@@ -229,7 +673,26 @@ class World(object):
         self.connect()
 
         # Create our cache.
-        self._cache = ChunkCache()
+        size = self.config.getintdefault(self.config_name, "cache_size", 256)
+        self._cache = ChunkCache(size)
+
+        self.pack_sections = self.config.getbooleandefault(self.config_name,
+                                                           "pack_sections",
+                                                           False)
+
+        # Chunks carry a reference to the cache in their dirtiness hook, so
+        # don't hand the cache a bound method; copying a chunk would then
+        # copy the entire world along with it.
+        def busy(coords):
+            return self.chunk_in_use(coords)
+        self._cache.busy = busy
+
+        def evicted(chunk):
+            for entity in chunk.entities:
+                self.entity_index.discard(entity)
+                if isinstance(entity, Mob) and entity.manager is not None:
+                    self.mob_manager.stop_mob(entity)
+        self._cache.evicted = evicted
 
         # Pick a random number for the seed. Use the configured value if one
         # is present.
@@ -276,13 +739,21 @@ class World(object):
             cache_level = self.config.getint(self.config_name, "perm_cache")
             self.enable_cache(cache_level)
 
-        self.chunk_management_loop = LoopingCall(self.flush_chunk)
-        self.chunk_management_loop.start(1)
-
-        # XXX Put this in init or here?
-        self.mob_manager = MobManager()
-        # XXX  Put this in the managers constructor?
-        self.mob_manager.world = self
+        latency = self.config.getintdefault(self.config_name,
+                                            "flush_latency", 30)
+        self.flusher = ChunkFlusher(self, latency)
+        if self.saving:
+            self.flusher.start()
+
+        # Budgets are given as name:milliseconds pairs.
+        budgets = self.config.getlistdefault(self.config_name,
+                                             "tick_budgets", [])
+        for budget in budgets:
+            name, chaff, milliseconds = budget.partition(":")
+            self.scheduler.budgets[name.strip()] = int(milliseconds) / 1000.0
+        for name, subsystem in self.scheduler.subsystems.iteritems():
+            subsystem.budget = self.scheduler.budgets.get(name)
+        self.scheduler.start()
 
     @inlineCallbacks
     def stop(self):
@@ -298,17 +769,29 @@ class World(object):
         :returns: A ``Deferred`` that fires after the world has stopped.
         """
 
-        self.chunk_management_loop.stop()
+        self.flusher.stop()
+        self.scheduler.stop()
 
-        # Flush all dirty chunks to disk. Don't bother cleaning them off.
-        for chunk in self._cache.iterdirty():
-            yield self.save_chunk(chunk)
-
-        # Destroy the cache.
-        self._cache = None
-
-        # Save the level data.
-        yield maybeDeferred(self.serializer.save_level, self.level)
+        try:
+            # Flush all dirty chunks to disk.
+            yield self.flusher.flush_all()
+
+            # Don't throw away chunks which were dirtied during the flush.
+            if self.flusher.backlog:
+                raise SerializerWriteException("%d chunks weren't saved"
+                                               % self.flusher.backlog)
+
+            # Destroy the cache.
+            self._cache = None
+
+            # Save the level data.
+            yield maybeDeferred(self.serializer.save_level, self.level)
+        finally:
+            # Wind down any I/O threads and open files, even if saving
+            # failed, since leftover threads would keep the process alive.
+            close = getattr(self.serializer, "close", None)
+            if close is not None:
+                close()
 
     def enable_cache(self, size):
         """
@@ -350,19 +833,29 @@ class World(object):
 
         return d
 
-    def flush_chunk(self):
+    def chunk_in_use(self, coords):
         """
-        Flush a dirty chunk.
+        Determine whether any player currently has a chunk loaded.
 
-        This method will always block when there are dirty chunks.
+        :param tuple coords: chunk coordinates
+        :rtype: bool
         """
 
-        for chunk in self._cache.iterdirty():
-            # Save a single chunk, and add a callback to remove it from the
-            # cache when it's been cleaned.
-            d = self.save_chunk(chunk)
-            d.addCallback(self._cache.cleaned)
-            break
+        if self.factory is None:
+            return False
+
+        return bool(self.factory.protocols_for_chunk(*coords))
+
+    def release_chunk(self, coords):
+        """
+        Note that no player has a chunk loaded anymore, so that it can be
+        evicted from the cache.
+
+        :param tuple coords: chunk coordinates
+        """
+
+        if self._cache is not None:
+            self._cache.released(coords)
 
     def save_off(self):
         """
@@ -375,7 +868,7 @@ class World(object):
         if not self.saving:
             return
 
-        self.chunk_management_loop.stop()
+        self.flusher.stop()
         self.saving = False
 
     def save_on(self):
@@ -386,8 +879,8 @@ class World(object):
         if self.saving:
             return
 
-        self.chunk_management_loop.start(1)
         self.saving = True
+        self.flusher.start()
 
     def postprocess_chunk(self, chunk):
         """
@@ -407,6 +900,11 @@ class World(object):
         # Thus, it should start out undamaged.
         chunk.clear_damage()
 
+        # Now that the generators and the season are done with the chunk,
+        # pack it down until something needs its arrays.
+        if self.pack_sections:
+            chunk.pack()
+
         # Skip some of the spendier scans if we have no factory; for example,
         # if we are generating chunks offline.
         if not self.factory:
@@ -415,12 +913,13 @@ class World(object):
         # XXX slightly icky, print statements are bad
         # Register the chunk's entities with our parent factory.
         for entity in chunk.entities:
-            if hasattr(entity, 'loop'):
+            if isinstance(entity, Mob):
                 print "Started mob!"
                 self.mob_manager.start_mob(entity)
             else:
                 print "I have no loop"
             self.factory.register_entity(entity)
+            self.entity_index.add(entity)
 
         # XXX why is this for furnaces only? :T
         # Scan the chunk for burning furnaces
@@ -454,6 +953,12 @@ class World(object):
             retval = yield self._pending_chunks[x, z].deferred()
             returnValue(retval)
 
+        # Set up our event early. Loading might not happen right away, and
+        # anybody else asking for this chunk in the meantime should wait for
+        # us instead of loading their own copy.
+        pe = PendingEvent()
+        self._pending_chunks[x, z] = pe
+
         # Create a new chunk object, since the cache turned up empty.
         try:
             chunk = yield maybeDeferred(self.serializer.load_chunk, x, z)
@@ -461,19 +966,33 @@ class World(object):
             # Looks like the chunk wasn't already on disk. Guess we're gonna
             # need to keep going.
             chunk = Chunk(x, z)
+        except:
+            del self._pending_chunks[x, z]
+            pe.errback()
+            raise
 
         # Add in our magic dirtiness hook so that the cache can be aware of
         # chunks who have been...naughty.
         chunk.dirtied = self._cache.dirtied
+
+        # And let light spread into neighboring chunks.
+        chunk.neighbors = self._cache.peek
         if chunk.dirty:
             # The chunk was already dirty!? Oh, naughty indeed!
             self._cache.dirtied(chunk)
 
         if chunk.populated:
             self._cache.put(chunk)
-            self.postprocess_chunk(chunk)
-            if self.factory:
-                self.factory.scan_chunk(chunk)
+            try:
+                self.postprocess_chunk(chunk)
+                if self.factory:
+                    self.factory.scan_chunk(chunk)
+            except:
+                pe.errback()
+                raise
+            finally:
+                del self._pending_chunks[x, z]
+            pe.callback(chunk)
             returnValue(chunk)
 
         if self.async:
@@ -507,16 +1026,14 @@ class World(object):
             chunk.regenerate()
             d = succeed(chunk)
 
-        # Set up our event and generate our return-value Deferred. It has to
-        # be done early becaues PendingEvents only fire exactly once and it
-        # might fire immediately in certain cases.
-        pe = PendingEvent()
+        # Generate our return-value Deferred. It has to be done early because
+        # PendingEvents only fire exactly once and it might fire immediately
+        # in certain cases.
         # This one is for our return value.
         retval = pe.deferred()
         # This one is for scanning the chunk for automatons.
         if self.factory:
             pe.deferred().addCallback(self.factory.scan_chunk)
-        self._pending_chunks[x, z] = pe
 
         def pp(chunk):
             chunk.populated = True
@@ -525,12 +1042,17 @@ class World(object):
             self.postprocess_chunk(chunk)
 
             self._cache.dirtied(chunk)
-            del self._pending_chunks[x, z]
 
             return chunk
 
+        # Whether or not the chunk made it, nobody should wait on it anymore.
+        def forget(result):
+            del self._pending_chunks[x, z]
+            return result
+
         # Set up callbacks.
         d.addCallback(pp)
+        d.addBoth(forget)
         d.chainDeferred(pe)
 
         # Because multiple people might be attached to this callback, we're
@@ -557,17 +1079,26 @@ class World(object):
         if not chunk.dirty or not self.saving:
             return succeed(chunk)
 
+        # Clean the chunk before it is handed to the serializer, rather than
+        # afterwards. Saving might not finish right away, and if the chunk is
+        # changed in the meantime, it should be dirtied and saved again.
+        chunk.dirty = False
+
         d = maybeDeferred(self.serializer.save_chunk, chunk)
 
         @d.addCallback
         def cb(none):
-            chunk.dirty = False
             return chunk
 
         @d.addErrback
         def eb(failure):
-            failure.trap(SerializerWriteException)
-            log.msg("Couldn't write %r" % chunk)
+            # Whatever went wrong, the chunk still has to be saved, so it
+            # stays dirty and queued for the next flush.
+            chunk.dirty = True
+            if failure.check(SerializerWriteException):
+                log.msg("Couldn't write %r" % chunk)
+            else:
+                log.err(failure, "Couldn't write %r" % chunk)
 
         return d
 
@@ -666,15 +1197,122 @@ class World(object):
 
         chunk.dirty = True
 
-    @sync_coords_to_chunk
-    def sync_get_block(self, chunk, coords):
+    def sync_get_block(self, coords):
         """
         Get a block from an unknown chunk.
 
+        This is called a lot, so it finds the chunk itself and reads the
+        block by index, rather than going through ``sync_coords_to_chunk``
+        and checking bounds a second time.
+
         :returns: the requested block
         """
 
-        return chunk.get_block(coords)
+        x, y, z = coords
+
+        if not 0 <= y < CHUNK_HEIGHT:
+            raise ImpossibleCoordinates("Y value %d is impossible" % y)
+
+        x = int(x)
+        z = int(z)
+        chunk = self._cache.get((x >> 4, z >> 4))
+
+        if chunk is None:
+            raise ChunkNotLoaded("Chunk (%d, %d) isn't loaded"
+                                 % (x >> 4, z >> 4))
+
+        return chunk.get_block_index(si(x & 0xf, y, z & 0xf))
+
+    def _sync_boxes(self, lower, upper):
+        """
+        Split a box of blocks into the pieces of it in each chunk.
+
+        Yields each chunk, together with the lower and upper corners of its
+        piece of the box in chunk coordinates.
+        """
+
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+
+        for bigx in xrange(x1 >> 4, ((x2 - 1) >> 4) + 1):
+            for bigz in xrange(z1 >> 4, ((z2 - 1) >> 4) + 1):
+                chunk = self._cache.get((bigx, bigz))
+
+                if chunk is None:
+                    raise ChunkNotLoaded("Chunk (%d, %d) isn't loaded"
+                                         % (bigx, bigz))
+
+                x = bigx * 16
+                z = bigz * 16
+                yield (chunk, (max(x1 - x, 0), y1, max(z1 - z, 0)),
+                       (min(x2 - x, 16), y2, min(z2 - z, 16)))
+
+    def sync_get_blocks(self, lower, upper):
+        """
+        Get a box of blocks from unknown chunks.
+
+        The box includes ``lower`` and excludes ``upper``. Blocks are fetched
+        a section at a time, rather than one by one.
+
+        :returns: block types, one per byte, in YZX order
+        """
+
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+
+        if not 0 <= y1 <= y2 <= CHUNK_HEIGHT:
+            raise ImpossibleCoordinates("Y values %d to %d are impossible"
+                                        % (y1, y2))
+
+        if x2 <= x1 or y2 <= y1 or z2 <= z1:
+            return ""
+
+        width = x2 - x1
+        depth = z2 - z1
+        box = bytearray(width * (y2 - y1) * depth)
+
+        for chunk, clower, cupper in self._sync_boxes(lower, upper):
+            piece = chunk.get_blocks(clower, cupper)
+
+            # Copy each row of the piece into place.
+            w = cupper[0] - clower[0]
+            d = cupper[2] - clower[2]
+            x = chunk.x * 16 + clower[0] - x1
+            z = chunk.z * 16 + clower[2] - z1
+            for i in xrange(len(piece) // w):
+                dy, dz = divmod(i, d)
+                start = (dy * depth + z + dz) * width + x
+                box[start:start + w] = piece[i * w:i * w + w]
+
+        return str(box)
+
+    def sync_any_solid(self, lower, upper, passable=nonsolid_bytes):
+        """
+        Check whether a box in unknown chunks contains any solid blocks.
+
+        The box includes ``lower`` and excludes ``upper``. Any part of the box
+        above or below the world is empty.
+
+        :param str passable: the blocks which don't count as solid, one per
+            byte; defaults to the non-solid blocks
+        :returns: bool
+        """
+
+        x1, y1, z1 = lower
+        x2, y2, z2 = upper
+
+        y1 = max(y1, 0)
+        y2 = min(y2, CHUNK_HEIGHT)
+
+        if x2 <= x1 or y2 <= y1 or z2 <= z1:
+            return False
+
+        for chunk, clower, cupper in self._sync_boxes((x1, y1, z1),
+                                                      (x2, y2, z2)):
+            if chunk.any_solid(clower, cupper, passable):
+                return True
+
+        return False
 
     @sync_coords_to_chunk
     def sync_set_block(self, chunk, coords, value):
@@ -9,7 +9,7 @@ from twisted.python.filepath import FilePath
 from bravo.region import Region
 
 if len(sys.argv) < 2:
-    print "No path specified!"
+    print "Usage: %s <region> [--compact]" % sys.argv[0]
     sys.exit()
 
 fp = FilePath(sys.argv[1])
@@ -21,8 +21,15 @@ if not fp.exists():
 region = Region(fp)
 region.load_pages()
 
+if "--compact" in sys.argv[2:]:
+    reclaimed = region.compact()
+    print "Compacted region, reclaiming %.2fKiB." % (reclaimed / 1024)
+
 if region.free_pages:
-    print "Free pages:", sorted(region.free_pages)
+    print "Free pages: %d in %d runs" % (len(region.free_pages),
+        len(region.free_pages.runs))
+    for start, length in region.free_pages.runs:
+        print " ~ %d-%d" % (start, start + length - 1)
 else:
     print "No free pages."
 